@@ -1 +1,183 @@
-# Auto-generated file by template.py
+import asyncio
+import base64
+import io
+import logging
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, File, Query, Request, UploadFile
+from fastapi.responses import JSONResponse
+from omegaconf import OmegaConf
+from PIL import Image
+
+from exceptions import APIRequestError
+from inference import get_registry
+from inference.batching import MicroBatcher
+from inference.predictor import predict_batch
+from inference.visualize import color_palette, colorize, overlay_mask, resize_labels
+from logger.sem_seg import setup_logger
+from utils.constants import PROJECT_ROOT
+
+if TYPE_CHECKING:
+    from datasets.transforms import SegformerTransform
+
+logger = logging.getLogger(__name__)
+
+cfg = OmegaConf.load(Path(f"{PROJECT_ROOT}/configs/infer.yaml").resolve())
+api_cfg = cfg.get("api", {})
+default_variant = cfg.get("inference", {}).get("variant", "b0")
+
+
+@dataclass
+class ServedModel:
+    transform: "SegformerTransform"
+    palette: np.ndarray
+    id2label: dict
+    batcher: MicroBatcher
+
+
+served: dict[str, ServedModel] = {}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    setup_logger(None, logging.INFO)
+    registry = get_registry(cfg)
+    variants = list(api_cfg.get("variants", [default_variant]))
+
+    # Loading is blocking; keep it off the event loop.
+    await asyncio.get_running_loop().run_in_executor(None, registry.warmup, variants)
+    for variant in variants:
+        loaded = registry.get(variant)
+        batcher = MicroBatcher(
+            partial(predict_batch, loaded.model),
+            max_batch_size=int(api_cfg.get("max_batch_size", 8)),
+            max_latency_ms=float(api_cfg.get("max_latency_ms", 10)),
+            max_queue_size=int(api_cfg.get("max_queue_size", 64)),
+        )
+        await batcher.start()
+        served[variant] = ServedModel(
+            transform=loaded.transform,
+            palette=color_palette(loaded.model.config.num_labels),
+            id2label=dict(loaded.model.config.id2label),
+            batcher=batcher,
+        )
+    logger.info(f"Serving segformer variants {variants}")
+
+    yield
+
+    for model in served.values():
+        await model.batcher.stop()
+    served.clear()
+
+
+app = FastAPI(title="Semantic Segmentation API", lifespan=lifespan)
+
+
+@app.exception_handler(APIRequestError)
+async def api_request_error_handler(request: Request, exc: APIRequestError):
+    headers = {"Retry-After": "1"} if exc.status_code == 503 else None
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"success": False, "error": exc.message},
+        headers=headers,
+    )
+
+
+def _decode(data: bytes, transform: "SegformerTransform"):
+    try:
+        image = Image.open(io.BytesIO(data)).convert("RGB")
+    except Exception as e:
+        raise APIRequestError(f"Could not decode image: {str(e)}", 400) from e
+    return image, transform(images=image)
+
+
+def _encode_png(array: np.ndarray) -> str:
+    buffer = io.BytesIO()
+    Image.fromarray(array).save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def _build_response(
+    image: Image.Image,
+    labels: np.ndarray,
+    model: ServedModel,
+    mask_format: str,
+    overlay: bool,
+    return_original: bool,
+) -> dict:
+    labels = resize_labels(labels, image.size)
+    color_mask = colorize(labels, model.palette)
+    response = {
+        "success": True,
+        "mask": _encode_png(labels if mask_format == "labels" else color_mask),
+        "width": image.width,
+        "height": image.height,
+        "classes": [model.id2label.get(int(i), str(i)) for i in np.unique(labels)],
+    }
+    if overlay:
+        response["overlay"] = _encode_png(overlay_mask(np.asarray(image), color_mask))
+    if return_original:
+        response["original"] = _encode_png(np.asarray(image))
+    return response
+
+
+@app.get("/health")
+async def health():
+    return {
+        "status": "ok",
+        "variants": {
+            variant: {"queue_depth": model.batcher.queue_depth}
+            for variant, model in served.items()
+        },
+    }
+
+
+@app.post("/segment")
+async def segment(
+    image: UploadFile = File(...),
+    mask_format: str = Query("png", pattern="^(png|labels)$"),
+    overlay: bool = False,
+    return_original: bool = False,
+    model: Optional[str] = None,
+):
+    variant = model or default_variant
+    if variant not in served:
+        raise APIRequestError(
+            f"Unknown model '{variant}', expected one of {list(served)}", 400
+        )
+    served_model = served[variant]
+
+    data = await image.read()
+    max_upload = int(api_cfg.get("max_upload_mb", 10)) * 1024**2
+    if len(data) > max_upload:
+        raise APIRequestError("Uploaded image is too large", 413)
+
+    loop = asyncio.get_running_loop()
+    decoded, pixel_values = await loop.run_in_executor(
+        None, _decode, data, served_model.transform
+    )
+    labels = await served_model.batcher.submit(pixel_values)
+    return await loop.run_in_executor(
+        None,
+        _build_response,
+        decoded,
+        labels,
+        served_model,
+        mask_format,
+        overlay,
+        return_original,
+    )
+
+
+if __name__ == "__main__":
+    uvicorn.run(
+        app,
+        host=api_cfg.get("host", "127.0.0.1"),
+        port=int(api_cfg.get("port", 8000)),
+    )
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Sequence
+
+import numpy as np
+import torch
+from numpy.lib.format import open_memmap
+
+from exceptions import DatasetException
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+INDEX_FILE = "index.json"
+
+
+def cache_key(transform_config: str, sample_names: Sequence[str]) -> str:
+    """Hash of everything that changes the cached arrays."""
+    digest = hashlib.sha256()
+    digest.update(f"v{CACHE_VERSION}".encode())
+    digest.update(transform_config.encode())
+    for name in sample_names:
+        digest.update(name.encode())
+    return digest.hexdigest()[:16]
+
+
+class PreprocessedCache:
+    r"""
+    Memory-mapped cache of resized uint8 images (N, 3, H, W) and masks (N, H, W).
+
+    Samples are stored in ``.npy`` shards of ``shard_size`` samples plus an
+    ``index.json``. Shards are opened lazily with copy-on-write memory maps, so
+    each DataLoader worker reads straight from the page cache without copying
+    or sharing file handles across ``fork``.
+
+    Args:
+        path (str): Directory of one built cache (see ``open_or_build``).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE), "r", encoding="utf-8") as f:
+            self.index = json.load(f)
+        self.shard_size = self.index["shard_size"]
+        self._shards: Optional[list[tuple[np.ndarray, np.ndarray]]] = None
+
+    @classmethod
+    def open_or_build(
+        cls,
+        cache_root: str,
+        key: str,
+        num_samples: int,
+        load_fn: Callable[[int], tuple[np.ndarray, np.ndarray]],
+        shard_size: int = 1024,
+        num_threads: Optional[int] = None,
+    ) -> "PreprocessedCache":
+        r"""
+        Args:
+            cache_root (str): Parent directory; the cache lives in ``cache_root/key``.
+            key (str): Cache key from ``cache_key``; a new key means a rebuild.
+            num_samples (int): Number of samples in the dataset.
+            load_fn (Callable): Maps an index to a resized (3, H, W) uint8 image
+                and (H, W) uint8 mask. Called once per sample when building.
+            shard_size (int): Samples per shard file.
+            num_threads (Optional[int]): Threads used to decode and resize.
+        """
+        path = os.path.join(cache_root, key)
+        if os.path.isfile(os.path.join(path, INDEX_FILE)):
+            logger.info(f"Using preprocessed dataset cache at {path}")
+            return cls(path)
+
+        logger.info(f"Building preprocessed dataset cache at {path}")
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        try:
+            cls._build(tmp_path, key, num_samples, load_fn, shard_size, num_threads)
+            try:
+                os.replace(tmp_path, path)
+            except OSError:
+                # Another process finished the same cache first.
+                shutil.rmtree(tmp_path, ignore_errors=True)
+        except Exception as e:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise DatasetException(f"Failed to build dataset cache: {str(e)}") from e
+        return cls(path)
+
+    @staticmethod
+    def _build(
+        path: str,
+        key: str,
+        num_samples: int,
+        load_fn: Callable[[int], tuple[np.ndarray, np.ndarray]],
+        shard_size: int,
+        num_threads: Optional[int],
+    ) -> None:
+        os.makedirs(path, exist_ok=True)
+        first_image, _ = load_fn(0)
+        image_shape = list(first_image.shape)
+
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            for shard, start in enumerate(range(0, num_samples, shard_size)):
+                stop = min(start + shard_size, num_samples)
+                images = open_memmap(
+                    os.path.join(path, f"images_{shard:05d}.npy"),
+                    mode="w+",
+                    dtype=np.uint8,
+                    shape=(stop - start, *image_shape),
+                )
+                masks = open_memmap(
+                    os.path.join(path, f"masks_{shard:05d}.npy"),
+                    mode="w+",
+                    dtype=np.uint8,
+                    shape=(stop - start, *image_shape[1:]),
+                )
+                for offset, (image, mask) in enumerate(
+                    executor.map(load_fn, range(start, stop))
+                ):
+                    if list(image.shape) != image_shape:
+                        raise DatasetException(
+                            f"sample {start + offset} has shape {image.shape}, "
+                            f"expected {image_shape}; caching needs a fixed resize"
+                        )
+                    images[offset] = image
+                    masks[offset] = mask
+                images.flush()
+                masks.flush()
+                del images, masks
+
+        index = {
+            "version": CACHE_VERSION,
+            "key": key,
+            "num_samples": num_samples,
+            "shard_size": shard_size,
+            "image_shape": image_shape,
+        }
+        with open(os.path.join(path, INDEX_FILE), "w", encoding="utf-8") as f:
+            json.dump(index, f)
+
+    def _open_shards(self) -> list[tuple[np.ndarray, np.ndarray]]:
+        num_shards = -(-self.index["num_samples"] // self.shard_size)
+        return [
+            (
+                np.load(os.path.join(self.path, f"images_{k:05d}.npy"), mmap_mode="c"),
+                np.load(os.path.join(self.path, f"masks_{k:05d}.npy"), mmap_mode="c"),
+            )
+            for k in range(num_shards)
+        ]
+
+    def __getitem__(self, idx: int) -> tuple[torch.Tensor, torch.Tensor]:
+        if self._shards is None:
+            self._shards = self._open_shards()
+        images, masks = self._shards[idx // self.shard_size]
+        offset = idx % self.shard_size
+        return torch.from_numpy(images[offset]), torch.from_numpy(masks[offset])
+
+    def __len__(self) -> int:
+        return self.index["num_samples"]
+
+    def __getstate__(self):
+        # Memory maps are reopened in each worker instead of being pickled.
+        state = self.__dict__.copy()
+        state["_shards"] = None
+        return state
@@ -0,0 +1,154 @@
+from typing import Any, Mapping, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import torch
+from PIL import Image
+
+from exceptions import DataTransformException
+
+ImageInput = Union[Image.Image, np.ndarray]
+
+
+class FastSegformerPreprocessor:
+    r"""
+    Lean resize/rescale/normalize that reproduces ``SegformerImageProcessor``
+    for uint8 RGB inputs without its per-call validation and conversions.
+
+    Resizing goes through PIL with the processor's resample filter, exactly as
+    the Hugging Face processor does, so resized pixels are bit-identical.
+    Rescale and normalize are fused into one multiply-add per channel and run
+    in torch, either per sample or on a whole uint8 batch after collation
+    (optionally on the training device).
+
+    Only depends on PIL, NumPy and torch, so it can be rebuilt from a saved
+    processor config without importing ``transformers``.
+
+    Args:
+        size (Optional[Tuple[int, int]]): Output (height, width), ``None`` to skip resizing.
+        resample (int): PIL resampling filter.
+        rescale_factor (Optional[float]): Pixel scale, ``None`` to skip rescaling.
+        image_mean (Optional[Sequence[float]]): Per-channel mean, ``None`` to skip normalizing.
+        image_std (Optional[Sequence[float]]): Per-channel standard deviation.
+    """
+
+    def __init__(
+        self,
+        size: Optional[Tuple[int, int]] = (512, 512),
+        resample: int = Image.Resampling.BILINEAR,
+        rescale_factor: Optional[float] = 1 / 255,
+        image_mean: Optional[Sequence[float]] = (0.485, 0.456, 0.406),
+        image_std: Optional[Sequence[float]] = (0.229, 0.224, 0.225),
+    ):
+        self.size = tuple(size) if size is not None else None
+        self.resample = Image.Resampling(int(resample))
+
+        scale = np.full(3, rescale_factor or 1.0, dtype=np.float64)
+        shift = np.zeros(3, dtype=np.float64)
+        if image_mean is not None:
+            std = np.asarray(image_std, dtype=np.float64)
+            shift = -np.asarray(image_mean, dtype=np.float64) / std
+            scale = scale / std
+        self._scale = torch.tensor(scale, dtype=torch.float32).view(3, 1, 1)
+        self._shift = torch.tensor(shift, dtype=torch.float32).view(3, 1, 1)
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any]) -> "FastSegformerPreprocessor":
+        """Builds from ``SegformerImageProcessor.to_dict()`` or its saved JSON."""
+        size = config.get("size", {"height": 512, "width": 512})
+        do_normalize = config.get("do_normalize", True)
+        return cls(
+            size=(
+                (size["height"], size["width"])
+                if config.get("do_resize", True)
+                else None
+            ),
+            resample=config.get("resample", Image.Resampling.BILINEAR),
+            rescale_factor=(
+                config.get("rescale_factor", 1 / 255)
+                if config.get("do_rescale", True)
+                else None
+            ),
+            image_mean=config.get("image_mean") if do_normalize else None,
+            image_std=config.get("image_std"),
+        )
+
+    def resize(self, image: ImageInput) -> np.ndarray:
+        """Resizes one RGB image, returning (H, W, 3) uint8 pixels."""
+        if self.size is None:
+            return np.asarray(image, dtype=np.uint8)
+        if not isinstance(image, Image.Image):
+            image = Image.fromarray(np.asarray(image, dtype=np.uint8))
+        height, width = self.size
+        if image.size != (width, height):
+            image = image.resize((width, height), resample=self.resample)
+        return np.asarray(image)
+
+    def to_tensor(self, image: ImageInput) -> torch.Tensor:
+        """Resizes one RGB image, returning (3, H, W) uint8 pixels."""
+        pixels = self.resize(image).transpose(2, 0, 1)
+        return torch.from_numpy(np.ascontiguousarray(pixels))
+
+    def normalize(self, pixels: torch.Tensor) -> torch.Tensor:
+        r"""
+        Args:
+            pixels (torch.Tensor): uint8 tensor of shape (3, H, W) or (N, 3, H, W),
+                on any device.
+        Returns:
+            torch.Tensor: float32 pixel values of the same shape and device.
+        """
+        pixel_values = pixels.to(torch.float32)
+        # shift + pixels * scale as one in-place multiply-add kernel
+        return torch.addcmul(
+            self._shift.to(pixels.device),
+            pixel_values,
+            self._scale.to(pixels.device),
+            out=pixel_values,
+        )
+
+    # Same names as on ``SegformerTransform``, so exported-model inference can
+    # use this preprocessor in its place.
+    resize_image = resize
+    normalize_pixels = normalize
+
+    def __call__(
+        self, images: Union[ImageInput, Sequence[ImageInput]]
+    ) -> torch.Tensor:
+        r"""
+        Args:
+            images: One RGB image or a sequence of them.
+        Returns:
+            torch.Tensor: (3, H, W) for one image, (N, 3, H, W) for a sequence.
+        """
+        try:
+            if isinstance(images, (Image.Image, np.ndarray)):
+                return self.normalize(self.to_tensor(images))
+            return self.normalize(torch.stack([self.to_tensor(img) for img in images]))
+        except Exception as e:
+            raise DataTransformException(f"Fast preprocessing failed: {str(e)}") from e
+
+    def check_parity(
+        self, processor, images: Sequence[ImageInput], atol: float = 1e-4
+    ) -> float:
+        r"""
+        Compares against a Hugging Face ``SegformerImageProcessor`` on ``images``.
+
+        Returns:
+            float: Largest absolute difference over all images.
+        Raises:
+            DataTransformException: If the difference exceeds ``atol`` or shapes differ.
+        """
+        max_diff = 0.0
+        for image in images:
+            expected = processor(images=np.asarray(image), return_tensors="pt")
+            expected = expected.pixel_values.squeeze(0)
+            actual = self(image)
+            if actual.shape != expected.shape:
+                raise DataTransformException(
+                    f"Shape mismatch: {tuple(actual.shape)} vs {tuple(expected.shape)}"
+                )
+            max_diff = max(max_diff, (actual - expected).abs().max().item())
+        if max_diff > atol:
+            raise DataTransformException(
+                f"Fast preprocessing differs from processor by {max_diff:.2e}"
+            )
+        return max_diff
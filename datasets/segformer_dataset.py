@@ -1,18 +1,26 @@
 import os
-from typing import Union
+from typing import Optional, Union
 from PIL import Image
 import numpy as np
+import torch
 from torch.utils.data import Dataset
 import torchvision.transforms as T
 import torchvision.transforms.functional as TF
 
+from datasets.cache import PreprocessedCache, cache_key
 from datasets.transforms import SegformerTransform
 from exceptions import DatasetException
 
 
 class ADE20KDataset(Dataset):
     def __init__(
-        self, root, img_dir, mask_dir, transforms: Union[SegformerTransform, T.Compose]
+        self,
+        root,
+        img_dir,
+        mask_dir,
+        transforms: Union[SegformerTransform, T.Compose],
+        cache_dir: Optional[str] = None,
+        cache_shard_size: int = 1024,
     ):
         try:
             self.root = root
@@ -23,18 +31,47 @@ class ADE20KDataset(Dataset):
             self.masks = sorted(os.listdir(self.mask_dir))
 
             self.transforms = transforms
+            self.cache: Optional[PreprocessedCache] = None
+            if cache_dir is not None:
+                self.cache = self._build_cache(cache_dir, cache_shard_size)
         except Exception as e:
             raise DatasetException(f"Failed to initialize: {str(e)}") from e
 
+    def _build_cache(self, cache_dir: str, shard_size: int) -> PreprocessedCache:
+        if not isinstance(self.transforms, SegformerTransform):
+            raise DatasetException("caching requires a SegformerTransform")
+        sample_names = [
+            f"{os.path.join(self.img_dir, img)}|{os.path.join(self.mask_dir, mask)}"
+            for img, mask in zip(self.images, self.masks)
+        ]
+        key = cache_key(self.transforms.to_json_string(), sample_names)
+        return PreprocessedCache.open_or_build(
+            cache_dir, key, len(self), self._load_resized, shard_size=shard_size
+        )
+
+    def _load(self, idx):
+        img_path = os.path.join(self.img_dir, self.images[idx])
+        mask_path = os.path.join(self.mask_dir, self.masks[idx])
+
+        img = Image.open(img_path).convert("RGB")
+        mask = (
+            np.array(Image.open(mask_path), dtype=np.uint8) - 1
+        )  # Adjust mask labels to start from 0
+        return img, mask
+
+    def _load_resized(self, idx):
+        img, mask = self._load(idx)
+        img = self.transforms.resize_image(img)
+        mask = self.transforms.resize_mask(torch.from_numpy(mask), size=img.shape[:2])
+        return img.transpose(2, 0, 1), mask.numpy()
+
     def __getitem__(self, idx):
         try:
-            img_path = os.path.join(self.img_dir, self.images[idx])
-            mask_path = os.path.join(self.mask_dir, self.masks[idx])
+            if self.cache is not None:
+                img, mask = self.cache[idx]
+                return self.transforms.finish_pixels(img), mask
 
-            img = Image.open(img_path).convert("RGB")
-            mask = (
-                np.array(Image.open(mask_path), dtype=np.uint8) - 1
-            )  # Adjust mask labels to start from 0
+            img, mask = self._load(idx)
             img, mask = self.transforms(images=img, masks=mask)
 
             return img, mask
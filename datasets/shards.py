@@ -0,0 +1,276 @@
+import io
+import json
+import logging
+import os
+import random
+from typing import BinaryIO, Iterator, Optional, Sequence, Union
+
+import numpy as np
+import torch.distributed as dist
+import torchvision.transforms as T
+from PIL import Image
+from torch.utils.data import Dataset, IterableDataset, get_worker_info
+
+from datasets.transforms import SegformerTransform
+from exceptions import DatasetException
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.npy"
+META_FILE = "shards.json"
+INDEX_DTYPE = np.dtype(
+    [
+        ("shard", "<u4"),
+        ("image_offset", "<u8"),
+        ("image_size", "<u8"),
+        ("mask_offset", "<u8"),
+        ("mask_size", "<u8"),
+    ]
+)
+
+
+def pack_shards(
+    image_paths: Sequence[str],
+    mask_paths: Sequence[str],
+    output_dir: str,
+    max_shard_bytes: int = 1 << 30,
+) -> int:
+    r"""
+    Packs encoded image/mask files into large record shards plus an offset index.
+
+    Each shard is the plain concatenation of the original image and mask
+    bytes, so nothing is re-encoded. ``index.npy`` holds one ``INDEX_DTYPE``
+    record per sample, and ``shards.json`` lists the shard files and sample
+    names.
+
+    Returns:
+        int: Number of shards written.
+    """
+    if len(image_paths) != len(mask_paths):
+        raise DatasetException(
+            f"{len(image_paths)} images but {len(mask_paths)} masks to pack"
+        )
+    os.makedirs(output_dir, exist_ok=True)
+    index = np.zeros(len(image_paths), dtype=INDEX_DTYPE)
+    shard_names: list[str] = []
+    shard: Optional[BinaryIO] = None
+
+    try:
+        for i, (image_path, mask_path) in enumerate(zip(image_paths, mask_paths)):
+            if shard is None or shard.tell() >= max_shard_bytes:
+                if shard is not None:
+                    shard.close()
+                shard_names.append(f"shard-{len(shard_names):05d}.bin")
+                shard = open(os.path.join(output_dir, shard_names[-1]), "wb")
+
+            record = index[i]
+            record["shard"] = len(shard_names) - 1
+            for field, path in (("image", image_path), ("mask", mask_path)):
+                with open(path, "rb") as f:
+                    data = f.read()
+                record[f"{field}_offset"] = shard.tell()
+                record[f"{field}_size"] = len(data)
+                shard.write(data)
+    finally:
+        if shard is not None:
+            shard.close()
+
+    np.save(os.path.join(output_dir, INDEX_FILE), index)
+    meta = {
+        "shards": shard_names,
+        "names": [os.path.basename(path) for path in image_paths],
+    }
+    with open(os.path.join(output_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    logger.info(f"Packed {len(index)} samples into {len(shard_names)} shards")
+    return len(shard_names)
+
+
+class _ShardReader:
+    def __init__(
+        self, shard_dir: str, transforms: Union[SegformerTransform, T.Compose]
+    ):
+        try:
+            self.shard_dir = shard_dir
+            self.index = np.load(os.path.join(shard_dir, INDEX_FILE))
+            with open(os.path.join(shard_dir, META_FILE), "r", encoding="utf-8") as f:
+                self.shards = json.load(f)["shards"]
+            self.transforms = transforms
+        except Exception as e:
+            raise DatasetException(f"Failed to open shards: {str(e)}") from e
+
+    def _decode(self, image_bytes: bytes, mask_bytes: bytes):
+        img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+        mask = (
+            np.array(Image.open(io.BytesIO(mask_bytes)), dtype=np.uint8) - 1
+        )  # Adjust mask labels to start from 0
+        return self.transforms(images=img, masks=mask)
+
+    def _read(self, f: BinaryIO, record) -> tuple[bytes, bytes]:
+        f.seek(int(record["image_offset"]))
+        image_bytes = f.read(int(record["image_size"]))
+        f.seek(int(record["mask_offset"]))
+        mask_bytes = f.read(int(record["mask_size"]))
+        return image_bytes, mask_bytes
+
+    def __len__(self):
+        return len(self.index)
+
+
+class ShardedSegDataset(_ShardReader, Dataset):
+    """Random access over packed shards through the offset index."""
+
+    def __init__(
+        self, shard_dir: str, transforms: Union[SegformerTransform, T.Compose]
+    ):
+        super().__init__(shard_dir, transforms)
+        self._files: dict[int, BinaryIO] = {}
+
+    def __getitem__(self, idx):
+        try:
+            record = self.index[idx]
+            shard = int(record["shard"])
+            if shard not in self._files:
+                self._files[shard] = open(
+                    os.path.join(self.shard_dir, self.shards[shard]), "rb"
+                )
+            return self._decode(*self._read(self._files[shard], record))
+        except Exception as e:
+            raise DatasetException(f"loading index {idx}: {str(e)}") from e
+
+    def __getstate__(self):
+        # File handles are opened lazily in each worker instead of being pickled.
+        state = self.__dict__.copy()
+        state["_files"] = {}
+        return state
+
+    def __del__(self):
+        for f in getattr(self, "_files", {}).values():
+            f.close()
+
+
+class ShardedSegIterableDataset(_ShardReader, IterableDataset):
+    r"""
+    Sequential streaming over packed shards.
+
+    Each distributed rank and DataLoader worker reads whole shards front to
+    back. With fewer shards than readers, records are strided across readers
+    instead (with a warning), so every reader still gets samples. Each rank
+    yields the same number of samples (the excess is dropped) so DDP ranks
+    stay in step. Samples are mixed through a shuffle buffer; call
+    ``set_epoch`` before each epoch to change the shard order and the shuffle.
+
+    Args:
+        shard_dir (str): Directory written by ``pack_shards``.
+        transforms (Union[SegformerTransform, T.Compose]): Joint image/mask transform.
+        shuffle (bool): Shuffle shard order and samples.
+        shuffle_buffer (int): Number of decoded samples held for shuffling.
+        seed (int): Base seed, combined with the epoch.
+    """
+
+    def __init__(
+        self,
+        shard_dir: str,
+        transforms: Union[SegformerTransform, T.Compose],
+        shuffle: bool = True,
+        shuffle_buffer: int = 1000,
+        seed: int = 0,
+    ):
+        super().__init__(shard_dir, transforms)
+        self.shuffle = shuffle
+        self.shuffle_buffer = max(1, shuffle_buffer)
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def _assigned_records(self) -> np.ndarray:
+        rank, world_size = 0, 1
+        if dist.is_available() and dist.is_initialized():
+            rank, world_size = dist.get_rank(), dist.get_world_size()
+        worker = get_worker_info()
+        worker_id, num_workers = (worker.id, worker.num_workers) if worker else (0, 1)
+        readers = world_size * num_workers
+
+        shards = list(range(len(self.shards)))
+        if self.shuffle:
+            random.Random(self.seed + self.epoch).shuffle(shards)
+        # Records of each shard in file order.
+        shard_records = []
+        for shard in shards:
+            records = np.flatnonzero(self.index["shard"] == shard)
+            shard_records.append(
+                records[np.argsort(self.index["image_offset"][records])]
+            )
+
+        if len(shards) >= readers:
+            # Whole shards per reader, read front to back.
+            per_reader = [
+                sum(len(records) for records in shard_records[consumer::readers])
+                for consumer in range(readers)
+            ]
+            # Every rank's worker i yields as many samples as worker i of the
+            # other ranks, so all ranks produce the same batches per epoch;
+            # otherwise ranks that run out first would wait forever in the
+            # next collective.
+            keep = min(per_reader[worker_id::num_workers])
+            consumer = rank * num_workers + worker_id
+            records = shard_records[consumer::readers]
+            records = np.concatenate(records) if records else np.zeros(0, np.int64)
+            return records[:keep]
+
+        if rank == 0 and worker_id == 0:
+            logger.warning(
+                f"{len(self.shards)} shards for {readers} readers (ranks x "
+                "workers), so records are strided across readers and every "
+                "reader seeks within every shard; pack with a smaller "
+                "max_shard_bytes for sequential reads"
+            )
+        order = (
+            np.concatenate(shard_records) if shard_records else np.zeros(0, np.int64)
+        )
+        # Same number of samples on every rank, see above.
+        per_rank = len(order) // world_size
+        records = order[: per_rank * world_size][rank::world_size]
+        return records[worker_id::num_workers]
+
+    def _iter_raw(self) -> Iterator[tuple[bytes, bytes]]:
+        # Records arrive shard by shard, so one file is open at a time.
+        shard, f = None, None
+        try:
+            for i in self._assigned_records():
+                record = self.index[i]
+                if int(record["shard"]) != shard:
+                    if f is not None:
+                        f.close()
+                    shard = int(record["shard"])
+                    f = open(os.path.join(self.shard_dir, self.shards[shard]), "rb")
+                yield self._read(f, record)
+        finally:
+            if f is not None:
+                f.close()
+
+    def __iter__(self):
+        if not self.shuffle:
+            for raw in self._iter_raw():
+                yield self._decode(*raw)
+            return
+
+        worker = get_worker_info()
+        rng = random.Random(
+            hash((self.seed, self.epoch, worker.id if worker else 0))
+        )
+        # Encoded bytes are buffered rather than decoded tensors, which keeps
+        # the buffer small and defers decoding to the moment a sample is used.
+        buffer: list[tuple[bytes, bytes]] = []
+        for raw in self._iter_raw():
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(raw)
+                continue
+            i = rng.randrange(len(buffer))
+            buffer[i], raw = raw, buffer[i]
+            yield self._decode(*raw)
+        rng.shuffle(buffer)
+        for raw in buffer:
+            yield self._decode(*raw)
@@ -1,3 +1,4 @@
+import copy
 from typing import Optional, Union
 
 import numpy as np
@@ -5,13 +6,47 @@ import torch
 from PIL import Image
 from transformers import SegformerImageProcessor
 
+from datasets.preprocess import FastSegformerPreprocessor
 from exceptions import DataTransformException
 
 
+# Mask value of pixels padded during augmentation. Padding has to happen per
+# sample for collation, before photometric distortion and (deferred)
+# normalization; ``reset_padding`` turns these pixels into mmseg's padding,
+# 0 after normalization and ignored by the loss, once pixels are normalized.
+PAD_LABEL = 254
+
+
+def reset_padding(
+    pixels: torch.Tensor, mask: torch.Tensor, ignore_index: int
+) -> tuple[torch.Tensor, torch.Tensor]:
+    r"""
+    Zeroes normalized pixels whose mask is ``PAD_LABEL`` and sets their label
+    to ``ignore_index``.
+
+    Args:
+        pixels (torch.Tensor): Normalized (3, H, W) or (N, 3, H, W) pixels.
+        mask (torch.Tensor): (H, W) or (N, H, W) labels.
+    """
+    padded = mask == PAD_LABEL
+    return (
+        pixels.masked_fill(padded.unsqueeze(-3), 0.0),
+        mask.masked_fill(padded, ignore_index),
+    )
+
+
+def nearest_indices(in_size: int, out_size: int, device=None) -> torch.Tensor:
+    scale = torch.tensor(in_size / out_size, dtype=torch.float32)
+    indices = torch.arange(out_size, dtype=torch.float32, device=device) * scale
+    return indices.floor_().long().clamp_(max=in_size - 1)
+
+
 class SegformerTransform(SegformerImageProcessor):
     def __init__(self, **kwargs):
         try:
             super().__init__(**kwargs)
+            self._fast_preprocessor: Optional[FastSegformerPreprocessor] = None
+            self._defer_normalize = False
         except Exception as e:
             raise DataTransformException(f"Initialization failed: {str(e)}") from e
 
@@ -33,14 +68,23 @@ class SegformerTransform(SegformerImageProcessor):
             if masks is not None and isinstance(masks, Image.Image):
                 masks = np.array(masks)
 
-            encoding = super().__call__(images=images, return_tensors="pt")
+            if self._is_fast_input(images):
+                pixel_values = self.finish_pixels(
+                    self.fast_preprocessor.to_tensor(images)
+                )
+            elif self._defer_normalize:
+                raise DataTransformException(
+                    "deferred normalization needs (H, W, 3) uint8 images"
+                )
+            else:
+                encoding = super().__call__(images=images, return_tensors="pt")
 
-            pixel_values = encoding.pixel_values.squeeze(
-                0
-            )  # Remove batch dimension, cs we are gonna collate later
+                pixel_values = encoding.pixel_values.squeeze(
+                    0
+                )  # Remove batch dimension, cs we are gonna collate later
 
             if masks is not None:
-                mask_tensor = torch.as_tensor(masks, dtype=torch.long)
+                mask_tensor = torch.as_tensor(np.asarray(masks), dtype=torch.uint8)
                 mask_tensor = self.resize_mask(
                     mask_tensor, size=pixel_values.shape[-2:]
                 )  # Resize mask to match image size
@@ -50,14 +94,404 @@ class SegformerTransform(SegformerImageProcessor):
             raise DataTransformException(f"Data transformation failed: {str(e)}") from e
 
     def resize_mask(self, mask: torch.Tensor, size: tuple) -> torch.Tensor:
-        return (
-            torch.nn.functional.interpolate(
-                mask.unsqueeze(0).unsqueeze(0).float(), size=size, mode="nearest"
+        r"""
+        Nearest-neighbor resize of an (H, W) mask by index gather, keeping its dtype.
+
+        Picks the same source pixels as ``interpolate(mode="nearest")`` without
+        the float round trip, so uint8 masks stay uint8.
+        """
+        in_height, in_width = mask.shape[-2:]
+        height, width = int(size[0]), int(size[1])
+        if (in_height, in_width) == (height, width):
+            return mask
+        rows = nearest_indices(in_height, height, mask.device)
+        cols = nearest_indices(in_width, width, mask.device)
+        return mask[..., rows[:, None], cols[None, :]]
+
+    @property
+    def fast_preprocessor(self) -> FastSegformerPreprocessor:
+        """Lean equivalent of this processor, built once from its config."""
+        if self._fast_preprocessor is None:
+            self._fast_preprocessor = FastSegformerPreprocessor.from_config(
+                super().to_dict()
             )
-            .squeeze(0)
-            .squeeze(0)
-            .long()
+        return self._fast_preprocessor
+
+    @staticmethod
+    def _is_fast_input(images) -> bool:
+        return (
+            isinstance(images, np.ndarray)
+            and images.dtype == np.uint8
+            and images.ndim == 3
+            and images.shape[-1] == 3
         )
 
+    def resize_image(self, image: Union[Image.Image, np.ndarray]) -> np.ndarray:
+        """Applies only the processor resize, keeping the (H, W, 3) uint8 pixels."""
+        return self.fast_preprocessor.resize(image)
+
+    def normalize_pixels(self, pixels: torch.Tensor) -> torch.Tensor:
+        r"""
+        Rescales and normalizes already-resized uint8 pixels the same way
+        ``__call__`` does.
+
+        Args:
+            pixels (torch.Tensor): uint8 tensor of shape (3, H, W) or (N, 3, H, W).
+        Returns:
+            torch.Tensor: float32 pixel values of the same shape.
+        """
+        return self.fast_preprocessor.normalize(pixels)
+
+    def deferred(self) -> "SegformerTransform":
+        r"""
+        Copy of this transform that returns resized uint8 pixels and leaves
+        rescaling/normalization to ``normalize_pixels`` after the batch is on
+        device, cutting host-to-device bytes 4x.
+        """
+        transform = copy.copy(self)
+        transform._defer_normalize = True
+        return transform
+
+    def finish_pixels(self, pixels: torch.Tensor) -> torch.Tensor:
+        """Normalizes resized uint8 pixels unless normalization is deferred."""
+        return pixels if self._defer_normalize else self.normalize_pixels(pixels)
+
+    def to_dict(self):
+        output = super().to_dict()
+        output.pop("_fast_preprocessor", None)
+        output.pop("_defer_normalize", None)
+        return output
+
     def __repr__(self):
         return f"{self.__class__.__name__}({self.to_json_string()})"
+
+
+def _to_uint8_tensors(images, masks) -> tuple[torch.Tensor, torch.Tensor]:
+    if not isinstance(images, torch.Tensor):
+        images = torch.from_numpy(np.asarray(images, dtype=np.uint8)).permute(2, 0, 1)
+    if not isinstance(masks, torch.Tensor):
+        masks = torch.from_numpy(np.asarray(masks, dtype=np.uint8))
+    return images, masks
+
+
+def _rgb_to_hsv(rgb: torch.Tensor) -> torch.Tensor:
+    r, g, b = rgb.unbind(dim=-3)
+    maxc = rgb.amax(dim=-3)
+    minc = rgb.amin(dim=-3)
+    equal = maxc == minc
+    chroma = maxc - minc
+    ones = torch.ones_like(maxc)
+    saturation = chroma / torch.where(equal, ones, maxc)
+    chroma = torch.where(equal, ones, chroma)
+    rc, gc, bc = (maxc - r) / chroma, (maxc - g) / chroma, (maxc - b) / chroma
+    hue = (
+        (maxc == r) * (bc - gc)
+        + ((maxc == g) & (maxc != r)) * (2.0 + rc - bc)
+        + ((maxc != g) & (maxc != r)) * (4.0 + gc - rc)
+    )
+    hue = torch.fmod(hue / 6.0 + 1.0, 1.0)
+    return torch.stack((hue, saturation, maxc), dim=-3)
+
+
+def _hsv_to_rgb(hsv: torch.Tensor) -> torch.Tensor:
+    h, s, v = hsv.unbind(dim=-3)
+    sector = torch.floor(h * 6.0)
+    f = h * 6.0 - sector
+    sector = sector.to(torch.int64) % 6
+    p = (v * (1.0 - s)).clamp_(0.0, 1.0)
+    q = (v * (1.0 - s * f)).clamp_(0.0, 1.0)
+    t = (v * (1.0 - s * (1.0 - f))).clamp_(0.0, 1.0)
+    candidates = torch.stack(
+        (
+            torch.stack((v, q, p, p, t, v), dim=-3),
+            torch.stack((t, v, v, q, p, p), dim=-3),
+            torch.stack((p, p, t, v, v, q), dim=-3),
+        ),
+        dim=-4,
+    )  # (..., 3 channels, 6 sectors, H, W)
+    index = sector.unsqueeze(-3).unsqueeze(-4)
+    index = index.expand(*candidates.shape[:-3], 1, -1, -1)
+    return candidates.gather(-3, index).squeeze(-3)
+
+
+class RandomResize:
+    r"""
+    Rescales image and mask by a random ratio of ``scale``, keeping the aspect ratio
+    (mmseg ``RandomResize`` with ``keep_ratio=True``). A batch shares one ratio.
+    """
+
+    def __init__(
+        self,
+        scale: tuple[int, int] = (2048, 512),
+        ratio_range: tuple[float, float] = (0.5, 2.0),
+    ):
+        self.scale = scale
+        self.ratio_range = ratio_range
+
+    def __call__(self, image: torch.Tensor, mask: torch.Tensor):
+        ratio = torch.empty(1).uniform_(*self.ratio_range).item()
+        long_target = max(self.scale) * ratio
+        short_target = min(self.scale) * ratio
+        height, width = image.shape[-2:]
+        factor = min(
+            long_target / max(height, width), short_target / min(height, width)
+        )
+        size = (int(height * factor + 0.5), int(width * factor + 0.5))
+
+        batched = image.dim() == 4
+        resized = torch.nn.functional.interpolate(
+            (image if batched else image.unsqueeze(0)).float(),
+            size=size,
+            mode="bilinear",
+            align_corners=False,
+        )
+        resized = resized.round_().clamp_(0, 255).to(torch.uint8)
+        rows = nearest_indices(height, size[0], mask.device)
+        cols = nearest_indices(width, size[1], mask.device)
+        return (
+            resized if batched else resized.squeeze(0),
+            mask[..., rows[:, None], cols[None, :]],
+        )
+
+
+class RandomCrop:
+    r"""
+    Random crop of ``crop_size`` (height, width). With ``cat_max_ratio < 1`` the
+    crop is redrawn (up to 10 times) while a single class covers more than that
+    share of the non-ignored pixels. Each check is one ``bincount`` over the
+    uint8 crop rather than a sort-based ``unique``.
+    """
+
+    def __init__(
+        self,
+        crop_size: tuple[int, int] = (512, 512),
+        cat_max_ratio: float = 1.0,
+        ignore_index: int = 255,
+        max_tries: int = 10,
+    ):
+        self.crop_size = crop_size
+        self.cat_max_ratio = cat_max_ratio
+        self.ignore_index = ignore_index
+        self.max_tries = max_tries
+
+    def _random_box(self, height: int, width: int) -> tuple[int, int, int, int]:
+        crop_h = min(self.crop_size[0], height)
+        crop_w = min(self.crop_size[1], width)
+        top = int(torch.randint(0, height - crop_h + 1, (1,)))
+        left = int(torch.randint(0, width - crop_w + 1, (1,)))
+        return top, top + crop_h, left, left + crop_w
+
+    def _acceptable(self, mask: torch.Tensor) -> bool:
+        counts = torch.bincount(mask.reshape(-1), minlength=256)
+        if 0 <= self.ignore_index < counts.numel():
+            counts[self.ignore_index] = 0
+        num_classes = int((counts > 0).sum())
+        return num_classes > 1 and counts.max() < self.cat_max_ratio * counts.sum()
+
+    def _crop_one(self, image: torch.Tensor, mask: torch.Tensor):
+        height, width = mask.shape[-2:]
+        top, bottom, left, right = self._random_box(height, width)
+        if self.cat_max_ratio < 1.0:
+            for _ in range(self.max_tries):
+                if self._acceptable(mask[top:bottom, left:right]):
+                    break
+                top, bottom, left, right = self._random_box(height, width)
+        return image[..., top:bottom, left:right], mask[top:bottom, left:right]
+
+    def __call__(self, image: torch.Tensor, mask: torch.Tensor):
+        if image.dim() == 3:
+            return self._crop_one(image, mask)
+        crops = [self._crop_one(img, msk) for img, msk in zip(image, mask)]
+        return (
+            torch.stack([img for img, _ in crops]),
+            torch.stack([msk for _, msk in crops]),
+        )
+
+
+class PadToSize:
+    """Pads bottom/right up to ``size`` (height, width), masks with ``seg_pad_val``."""
+
+    def __init__(
+        self,
+        size: tuple[int, int] = (512, 512),
+        pad_val: int = 0,
+        seg_pad_val: int = 255,
+    ):
+        self.size = size
+        self.pad_val = pad_val
+        self.seg_pad_val = seg_pad_val
+
+    def __call__(self, image: torch.Tensor, mask: torch.Tensor):
+        height, width = image.shape[-2:]
+        pad_h, pad_w = max(self.size[0] - height, 0), max(self.size[1] - width, 0)
+        if pad_h == 0 and pad_w == 0:
+            return image, mask
+        padding = (0, pad_w, 0, pad_h)
+        return (
+            torch.nn.functional.pad(image, padding, value=self.pad_val),
+            torch.nn.functional.pad(mask, padding, value=self.seg_pad_val),
+        )
+
+
+class RandomFlip:
+    """Horizontal flip with probability ``prob``, drawn per sample in a batch."""
+
+    def __init__(self, prob: float = 0.5):
+        self.prob = prob
+
+    def __call__(self, image: torch.Tensor, mask: torch.Tensor):
+        if image.dim() == 3:
+            if torch.rand(1).item() < self.prob:
+                return image.flip(-1), mask.flip(-1)
+            return image, mask
+        flip = torch.rand(image.shape[0], device=image.device) < self.prob
+        return (
+            torch.where(flip.view(-1, 1, 1, 1), image.flip(-1), image),
+            torch.where(flip.view(-1, 1, 1), mask.flip(-1), mask),
+        )
+
+
+class PhotoMetricDistortion:
+    r"""
+    mmseg ``PhotoMetricDistortion``: random brightness, contrast (before or after
+    the HSV steps), saturation and hue, each applied with probability 0.5.
+    Parameters are drawn per sample and applied to the whole batch at once.
+    """
+
+    def __init__(
+        self,
+        brightness_delta: float = 32,
+        contrast_range: tuple[float, float] = (0.5, 1.5),
+        saturation_range: tuple[float, float] = (0.5, 1.5),
+        hue_delta: float = 18,
+    ):
+        self.brightness_delta = brightness_delta
+        self.contrast_range = contrast_range
+        self.saturation_range = saturation_range
+        self.hue_delta = hue_delta
+
+    def __call__(self, image: torch.Tensor, mask: torch.Tensor):
+        batched = image.dim() == 4
+        x = (image if batched else image.unsqueeze(0)).float()
+        n, device = x.shape[0], x.device
+
+        def draw(low: float, high: float, neutral: float) -> torch.Tensor:
+            values = torch.empty(n, device=device).uniform_(low, high)
+            apply = torch.rand(n, device=device) < 0.5
+            return torch.where(apply, values, neutral).view(n, 1, 1, 1)
+
+        brightness = draw(-self.brightness_delta, self.brightness_delta, 0.0)
+        contrast = draw(*self.contrast_range, 1.0)
+        contrast_first = (torch.rand(n, device=device) < 0.5).view(n, 1, 1, 1)
+        saturation = draw(*self.saturation_range, 1.0).view(n, 1, 1)
+        hue = draw(-self.hue_delta, self.hue_delta, 0.0).view(n, 1, 1) / 180.0
+
+        x = (x + brightness).clamp_(0, 255)
+        x = (x * torch.where(contrast_first, contrast, 1.0)).clamp_(0, 255)
+
+        hsv = _rgb_to_hsv(x / 255.0)
+        h, s, v = hsv.unbind(dim=1)
+        s = (s * saturation).clamp_(0.0, 1.0)
+        h = torch.remainder(h + hue, 1.0)
+        x = _hsv_to_rgb(torch.stack((h, s, v), dim=1)) * 255.0
+
+        x = (x * torch.where(contrast_first, 1.0, contrast)).clamp_(0, 255)
+        x = x.round_().to(torch.uint8)
+        return (x if batched else x.squeeze(0)), mask
+
+
+class SegAugmentation:
+    r"""
+    Joint image/mask pipeline over uint8 tensors.
+
+    Accepts the same ``images=``/``masks=`` call as ``SegformerTransform``, with a
+    PIL image / (H, W, 3) array or a (3, H, W) / (N, 3, H, W) uint8 tensor, and
+    returns ``(pixels, mask)``. With ``normalize`` set the pixels are normalized
+    floats, otherwise they stay uint8. With ``ignore_index`` set, padding marked
+    with ``PAD_LABEL`` is reset once the pixels are normalized floats.
+    """
+
+    def __init__(self, transforms: list, normalize=None, ignore_index=None):
+        self.transforms = transforms
+        self.normalize = normalize
+        self.ignore_index = ignore_index
+
+    def __call__(self, images, masks):
+        try:
+            image, mask = _to_uint8_tensors(images, masks)
+            for transform in self.transforms:
+                image, mask = transform(image, mask)
+            if self.normalize is not None:
+                image = self.normalize(image)
+            if self.ignore_index is not None and image.is_floating_point():
+                image, mask = reset_padding(image, mask, self.ignore_index)
+            return image, mask
+        except Exception as e:
+            raise DataTransformException(f"Augmentation failed: {str(e)}") from e
+
+
+def build_train_augmentation(
+    aug_cfg,
+    transform: SegformerTransform,
+    ignore_index: int,
+    num_classes: Optional[int] = None,
+):
+    r"""
+    Builds the ADE20K training pipeline from the ``augmentation`` config section.
+
+    Crops smaller than ``crop_size`` are padded with ``PAD_LABEL`` in the mask;
+    the padded pixels are set to 0 after normalization and ignored by the
+    loss, as in mmseg. With deferred normalization the Lightning wrapper does
+    this on device.
+
+    Returns:
+        (sample_transform, batch_transform): ``sample_transform`` runs in the
+        dataset. ``batch_transform`` is ``None`` unless ``aug_cfg.batched`` is
+        set, in which case flip, photometric distortion and normalization are
+        left to it and run on the collated uint8 batch on device.
+    """
+    if not aug_cfg.get("enabled", False):
+        return transform, None
+    if ignore_index == PAD_LABEL or (num_classes or 0) > PAD_LABEL:
+        raise DataTransformException(
+            f"Label {PAD_LABEL} marks padding during augmentation and cannot be "
+            "a class or the ignore index"
+        )
+
+    crop_size = tuple(aug_cfg.random_crop.crop_size)
+    sample_ops = [
+        RandomResize(
+            scale=tuple(aug_cfg.random_resize.scale),
+            ratio_range=tuple(aug_cfg.random_resize.ratio_range),
+        ),
+        RandomCrop(
+            crop_size=crop_size,
+            cat_max_ratio=aug_cfg.random_crop.cat_max_ratio,
+            ignore_index=ignore_index,
+        ),
+        PadToSize(crop_size, seg_pad_val=PAD_LABEL),
+    ]
+    batch_ops = [RandomFlip(prob=aug_cfg.random_flip.prob)]
+    distortion_cfg = aug_cfg.get("photometric_distortion", {})
+    if distortion_cfg.get("enabled", True):
+        batch_ops.append(
+            PhotoMetricDistortion(
+                brightness_delta=distortion_cfg.get("brightness_delta", 32),
+                contrast_range=tuple(
+                    distortion_cfg.get("contrast_range", (0.5, 1.5))
+                ),
+                saturation_range=tuple(
+                    distortion_cfg.get("saturation_range", (0.5, 1.5))
+                ),
+                hue_delta=distortion_cfg.get("hue_delta", 18),
+            )
+        )
+
+    if aug_cfg.get("batched", False):
+        return SegAugmentation(sample_ops), SegAugmentation(
+            batch_ops, transform.normalize_pixels, ignore_index
+        )
+    return (
+        SegAugmentation(sample_ops + batch_ops, transform.finish_pixels, ignore_index),
+        None,
+    )
@@ -1 +1,20 @@
-from .predictor import run_inference
\ No newline at end of file
+from typing import TYPE_CHECKING
+
+from utils.lazy import lazy_exports
+
+# Submodules are imported on first access so that importing the package (and
+# the entry points that use it) does not pay for torch until it is needed.
+__getattr__, __dir__ = lazy_exports(
+    __name__,
+    {
+        "run_inference": ".predictor",
+        "ModelRegistry": ".registry",
+        "get_registry": ".registry",
+    },
+)
+
+if TYPE_CHECKING:
+    from .predictor import run_inference
+    from .registry import ModelRegistry, get_registry
+
+__all__ = ["run_inference", "ModelRegistry", "get_registry"]
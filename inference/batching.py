@@ -0,0 +1,121 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Tuple
+
+from exceptions import APIRequestError
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    r"""
+    Collects concurrent requests into micro-batches for a batched predict function.
+
+    The first queued item opens a batch; further items join it until
+    ``max_batch_size`` is reached or ``max_latency_ms`` has passed. Batches run
+    one at a time on a dedicated thread so the event loop stays responsive.
+    ``submit`` rejects new work with HTTP 503 once ``max_queue_size`` items are
+    waiting.
+
+    Args:
+        predict_fn (Callable[[List[Any]], List[Any]]): Maps a list of inputs to
+            a list of outputs of the same length.
+        max_batch_size (int): Largest batch handed to ``predict_fn``.
+        max_latency_ms (float): How long the first item of a batch waits for
+            others to join.
+        max_queue_size (int): Number of waiting items before requests are rejected.
+    """
+
+    def __init__(
+        self,
+        predict_fn: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 8,
+        max_latency_ms: float = 10.0,
+        max_queue_size: int = 64,
+    ):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_latency = max(0.0, max_latency_ms) / 1000
+        self.max_queue_size = max(1, max_queue_size)
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # Items taken off the queue for the batch being collected or run.
+        self._in_flight: List[Tuple[Any, asyncio.Future]] = []
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="micro-batcher"
+        )
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        pending, self._in_flight = self._in_flight, []
+        while self._queue is not None and not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for _, future in pending:
+            if not future.done():
+                future.set_exception(APIRequestError("Server shutting down", 503))
+        self._executor.shutdown(wait=True)
+
+    async def submit(self, item: Any) -> Any:
+        if self._queue is None:
+            raise APIRequestError("Batcher is not running", 503)
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((item, future))
+        except asyncio.QueueFull:
+            raise APIRequestError("Server busy, inference queue is full", 503)
+        return await future
+
+    async def _collect(self) -> List[Tuple[Any, asyncio.Future]]:
+        loop = asyncio.get_running_loop()
+        batch = self._in_flight = [await self._queue.get()]
+        deadline = loop.time() + self.max_latency
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Clients that disconnected while waiting do not need a result.
+        return [(item, future) for item, future in batch if not future.cancelled()]
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+            items = [item for item, _ in batch]
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, self.predict_fn, items
+                )
+            except Exception as e:
+                logger.error(f"Batch of {len(items)} failed: {str(e)}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                self._in_flight = []
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+            self._in_flight = []
@@ -0,0 +1,149 @@
+import json
+import logging
+import os
+import time
+from typing import Callable, Sequence
+
+import numpy as np
+import torch
+
+from exceptions import InferenceException
+
+logger = logging.getLogger(__name__)
+
+DYNAMIC_AXES = {
+    "pixel_values": {0: "batch", 2: "height", 3: "width"},
+    "logits": {0: "batch", 2: "logit_height", 3: "logit_width"},
+}
+
+
+class LogitsOnly(torch.nn.Module):
+    r"""
+    Wraps a Hugging Face Segformer so that its forward takes a single
+    ``pixel_values`` tensor and returns only the logits, which is what both
+    the TorchScript tracer and the ONNX exporter expect.
+    """
+
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        return self.model(pixel_values=pixel_values, return_dict=False)[0]
+
+
+def export_torchscript(
+    model: torch.nn.Module, path: str, example: torch.Tensor, freeze: bool = True
+) -> str:
+    r"""
+    Traces ``model`` on ``example`` and saves the TorchScript module to ``path``.
+
+    Segformer has no data-dependent control flow, so the traced graph is valid
+    for any batch size and any input size divisible by 32.
+
+    Args:
+        model (torch.nn.Module): Segformer in eval mode.
+        path (str): Output ``.pt`` file.
+        example (torch.Tensor): Example input of shape (N, 3, H, W).
+        freeze (bool): Inline parameters and fold constants with ``torch.jit.freeze``.
+    """
+    try:
+        with torch.inference_mode(False), torch.no_grad():
+            traced = torch.jit.trace(LogitsOnly(model).eval(), example, strict=False)
+            if freeze:
+                traced = torch.jit.freeze(traced)
+        torch.jit.save(traced, path)
+    except Exception as e:
+        raise InferenceException(f"TorchScript export failed: {str(e)}") from e
+    logger.info(f"Exported TorchScript model to {path}")
+    return path
+
+
+def export_onnx(
+    model: torch.nn.Module, path: str, example: torch.Tensor, opset_version: int = 17
+) -> str:
+    r"""
+    Exports ``model`` to ONNX with dynamic batch, height and width axes.
+
+    Args:
+        model (torch.nn.Module): Segformer in eval mode.
+        path (str): Output ``.onnx`` file.
+        example (torch.Tensor): Example input of shape (N, 3, H, W).
+        opset_version (int): ONNX opset to target.
+    """
+    try:
+        with torch.no_grad():
+            torch.onnx.export(
+                LogitsOnly(model).eval(),
+                (example,),
+                path,
+                input_names=["pixel_values"],
+                output_names=["logits"],
+                dynamic_axes=DYNAMIC_AXES,
+                opset_version=opset_version,
+                do_constant_folding=True,
+            )
+    except Exception as e:
+        raise InferenceException(f"ONNX export failed: {str(e)}") from e
+    logger.info(f"Exported ONNX model to {path}")
+    return path
+
+
+def save_runtime_metadata(output_dir: str, transform, model: torch.nn.Module) -> None:
+    r"""
+    Writes ``preprocessor.json`` (the image processor config) and
+    ``config.json`` (label names) next to the exported graphs, which is all
+    the exported runtimes need besides the graph itself.
+    """
+    with open(os.path.join(output_dir, "preprocessor.json"), "w") as f:
+        json.dump(transform.to_dict(), f, indent=2)
+    config = {
+        "num_labels": model.config.num_labels,
+        "id2label": {str(k): v for k, v in model.config.id2label.items()},
+    }
+    with open(os.path.join(output_dir, "config.json"), "w") as f:
+        json.dump(config, f, indent=2)
+
+
+def check_parity(
+    reference: Callable, candidate: Callable, inputs: Sequence[torch.Tensor]
+) -> dict:
+    r"""
+    Compares the logits of two models on the same inputs.
+
+    Returns:
+        dict: ``max_abs_diff`` over all logits and ``label_agreement``, the
+        fraction of pixels whose argmax label matches.
+    """
+    max_diff, agree, total = 0.0, 0, 0
+    with torch.inference_mode():
+        for pixel_values in inputs:
+            expected = reference(pixel_values).logits.float()
+            actual = candidate(pixel_values).logits.float()
+            if actual.shape != expected.shape:
+                raise InferenceException(
+                    f"Shape mismatch: {tuple(actual.shape)} vs {tuple(expected.shape)}"
+                )
+            max_diff = max(max_diff, (actual - expected).abs().max().item())
+            agree += (actual.argmax(dim=1) == expected.argmax(dim=1)).sum().item()
+            total += expected[:, 0].numel()
+    return {"max_abs_diff": max_diff, "label_agreement": agree / max(total, 1)}
+
+
+def measure_latency(
+    model: Callable, pixel_values: torch.Tensor, warmup: int = 3, iterations: int = 20
+) -> dict:
+    """Per-call latency in milliseconds (mean, p50, p90) after ``warmup`` calls."""
+    timings = []
+    with torch.inference_mode():
+        for step in range(warmup + iterations):
+            start = time.perf_counter()
+            model(pixel_values)
+            if step >= warmup:
+                timings.append(time.perf_counter() - start)
+    timings_ms = np.asarray(timings) * 1000
+    return {
+        "mean_ms": float(timings_ms.mean()),
+        "p50_ms": float(np.percentile(timings_ms, 50)),
+        "p90_ms": float(np.percentile(timings_ms, 90)),
+    }
@@ -0,0 +1,144 @@
+import logging
+from dataclasses import dataclass, replace
+
+import torch
+
+from exceptions import ModelLoadException
+
+from .export import check_parity
+from .runtime import SegformerOutput
+
+logger = logging.getLogger(__name__)
+
+PRECISIONS = {"fp32": torch.float32, "bf16": torch.bfloat16}
+
+
+@dataclass
+class InferenceOptions:
+    precision: str = "fp32"
+    channels_last: bool = False
+    compile: bool = False
+    compile_mode: str = "default"
+    parity_guard: bool = True
+    parity_samples: int = 2
+    min_label_agreement: float = 0.98
+
+    @classmethod
+    def from_cfg(cls, optimization_cfg) -> "InferenceOptions":
+        guard_cfg = optimization_cfg.get("parity_guard", {})
+        options = cls(
+            precision=str(optimization_cfg.get("precision", "fp32")),
+            channels_last=bool(optimization_cfg.get("channels_last", False)),
+            compile=bool(optimization_cfg.get("compile", False)),
+            compile_mode=str(optimization_cfg.get("compile_mode", "default")),
+            parity_guard=bool(guard_cfg.get("enabled", True)),
+            parity_samples=int(guard_cfg.get("num_samples", 2)),
+            min_label_agreement=float(guard_cfg.get("min_label_agreement", 0.98)),
+        )
+        if options.precision not in PRECISIONS:
+            raise ModelLoadException(
+                f"Unknown precision '{options.precision}', "
+                f"expected one of {list(PRECISIONS)}"
+            )
+        return options
+
+    @property
+    def is_default(self) -> bool:
+        return (
+            self.precision == "fp32" and not self.channels_last and not self.compile
+        )
+
+
+def cpu_supports_bf16() -> bool:
+    """Whether oneDNN has native bfloat16 kernels (AVX512-BF16 or AMX) on this CPU."""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except Exception:
+        return False
+
+
+class OptimizedSegformer:
+    r"""
+    Runs an eager ``HFSegformer`` with CPU inference options applied, keeping
+    its call interface: ``model(pixel_values).logits`` (always float32) and
+    ``model.config``. The model code itself is left untouched.
+
+    Args:
+        model (torch.nn.Module): fp32 Segformer in eval mode.
+        options (InferenceOptions): Precision, memory format and compilation.
+    """
+
+    def __init__(self, model: torch.nn.Module, options: InferenceOptions):
+        self.model = model
+        self.options = options
+        self.config = model.config
+        self.dtype = PRECISIONS[options.precision]
+
+        if options.channels_last:
+            model.to(memory_format=torch.channels_last)
+        self._forward = (
+            torch.compile(model, mode=options.compile_mode)
+            if options.compile
+            else model
+        )
+
+    def eval(self) -> "OptimizedSegformer":
+        self.model.eval()
+        return self
+
+    def state_dict(self):
+        return self.model.state_dict()
+
+    def __call__(self, pixel_values: torch.Tensor) -> SegformerOutput:
+        if self.options.channels_last:
+            pixel_values = pixel_values.contiguous(memory_format=torch.channels_last)
+        with torch.autocast(
+            "cpu", dtype=self.dtype, enabled=self.dtype != torch.float32
+        ):
+            logits = self._forward(pixel_values).logits
+        return SegformerOutput(logits.float())
+
+
+def optimize_for_inference(
+    model: torch.nn.Module, options: InferenceOptions, image_size: int = 512
+) -> torch.nn.Module:
+    r"""
+    Applies ``options`` to an eager Segformer and, if the parity guard is on,
+    compares its predictions with fp32 on random inputs.
+
+    bf16 without native CPU support is emulated and slower than fp32, so it is
+    skipped with a warning. If the label agreement with fp32 falls below
+    ``min_label_agreement``, the fp32 model is returned instead.
+
+    Returns:
+        The optimized model, or ``model`` unchanged.
+    """
+    if options.is_default:
+        return model
+    if options.precision == "bf16" and not cpu_supports_bf16():
+        logger.warning("CPU has no native bfloat16 support, running in fp32")
+        options = replace(options, precision="fp32")
+
+    optimized = OptimizedSegformer(model, options)
+    if not options.parity_guard:
+        return optimized
+
+    generator = torch.Generator().manual_seed(0)
+    inputs = [
+        torch.randn(1, 3, image_size, image_size, generator=generator)
+        for _ in range(max(1, options.parity_samples))
+    ]
+    parity = check_parity(model, optimized, inputs)
+    logger.info(
+        f"Inference options {options}: max |diff| {parity['max_abs_diff']:.3e}, "
+        f"label agreement {parity['label_agreement']:.4%} vs fp32"
+    )
+    if parity["label_agreement"] < options.min_label_agreement:
+        logger.warning(
+            f"Label agreement {parity['label_agreement']:.4%} with fp32 is below "
+            f"{options.min_label_agreement:.2%}, falling back to fp32"
+        )
+        if options.channels_last:
+            model.to(memory_format=torch.contiguous_format)
+        return model
+    return optimized
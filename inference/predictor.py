@@ -1,39 +1,127 @@
 import logging
 import os
-from typing import List, Union
+from collections import defaultdict
+from typing import (
+    TYPE_CHECKING,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 import numpy as np
 import torch
 from PIL import Image
 
-from datasets.transforms import SegformerTransform
 from exceptions import InferenceException, TrainingException
-from models import HFSegformer
-
-logger = logging.getLogger(__name__)
 
+from .prefetch import Prefetcher
+from .registry import get_registry
+from .tiling import TileConfig, sliding_window_predict
+from .visualize import color_palette, colorize
+from .writer import MaskWriter
 
-def _build_color_palette(num_classes: int) -> list[int]:
-    """Generate a deterministic RGB palette for up to 256 classes."""
-    palette = [0] * (num_classes * 3)
-    for label in range(num_classes):
-        lab = label
-        r = g = b = 0
-        i = 0
-        while lab:
-            r |= ((lab >> 0) & 1) << (7 - i)
-            g |= ((lab >> 1) & 1) << (7 - i)
-            b |= ((lab >> 2) & 1) << (7 - i)
-            lab >>= 3
-            i += 1
-        palette[label * 3 : label * 3 + 3] = [r, g, b]
-    return palette
+if TYPE_CHECKING:
+    from datasets.transforms import SegformerTransform
+    from models import HFSegformer
 
+logger = logging.getLogger(__name__)
 
-def _apply_colormap(mask: "np.ndarray", palette: list[int]) -> Image.Image:
-    color_mask = Image.fromarray(mask.astype("uint8"), mode="P")
-    color_mask.putpalette(palette)
-    return color_mask.convert("RGB")
+# Full-resolution images decoded ahead of tiled inference: one image is
+# loaded while the previous one is segmented, whatever ``queue_depth`` says.
+TILED_QUEUE_DEPTH = 1
+
+
+def _chunked_iter(items: Iterable, size: int) -> Iterator[List]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def predict_batch(
+    model: "HFSegformer", pixel_values: List[torch.Tensor]
+) -> List[np.ndarray]:
+    r"""
+    Args:
+        model (HFSegformer): Segmentation model in eval mode, or an exported
+            runtime from ``inference.runtime`` with the same call interface.
+        pixel_values (List[torch.Tensor]): Preprocessed images, each of shape (3, H, W).
+    Returns:
+        List[np.ndarray]: uint8 label map per image, at logit resolution.
+
+    Images are bucketed by shape so that each bucket is one forward pass;
+    with the default fixed-size processor resize the whole batch is one bucket.
+    """
+    buckets: dict[tuple, List[int]] = defaultdict(list)
+    for index, tensor in enumerate(pixel_values):
+        buckets[tuple(tensor.shape)].append(index)
+
+    predictions: List[np.ndarray] = [None] * len(pixel_values)  # type: ignore
+    with torch.inference_mode():
+        for indices in buckets.values():
+            batch = torch.stack([pixel_values[i] for i in indices])
+            labels = model(batch).logits.argmax(dim=1).to(torch.uint8).cpu().numpy()
+            for i, label in zip(indices, labels):
+                predictions[i] = label
+    return predictions
+
+
+def iter_predictions(
+    model: "HFSegformer",
+    transform: "SegformerTransform",
+    image_paths: Sequence[Union[str, os.PathLike]],
+    batch_size: int = 1,
+    tiling: Optional[TileConfig] = None,
+    num_workers: int = 4,
+    queue_depth: int = 16,
+) -> Iterator[Tuple[Union[str, os.PathLike], np.ndarray, Tuple[int, int]]]:
+    r"""
+    Lazily yields ``(image_path, label_map, (width, height))`` per input image.
+
+    Images are decoded and preprocessed by ``num_workers`` background threads
+    up to ``queue_depth`` images ahead of the model, so decoding overlaps with
+    the forward passes while memory stays bounded by ``queue_depth`` resized
+    images. With ``tiling`` each image is segmented at full resolution by
+    sliding-window inference instead of being resized by the processor; full
+    images can be arbitrarily large, so then at most ``TILED_QUEUE_DEPTH``
+    image is decoded ahead of the one being segmented.
+    """
+    if tiling is not None:
+
+        def load_full(path) -> np.ndarray:
+            return np.asarray(Image.open(path).convert("RGB"))
+
+        depth = min(queue_depth, TILED_QUEUE_DEPTH)
+        prefetched = Prefetcher(
+            image_paths, load_full, min(num_workers, depth), depth
+        )
+        for path, image in prefetched:
+            logger.info(f"Processing image with tiled inference: {path}")
+            pixels = torch.from_numpy(image).permute(2, 0, 1)
+            labels = sliding_window_predict(
+                model, pixels, tiling, normalize=transform.normalize_pixels
+            )
+            yield path, labels.cpu().numpy(), (image.shape[1], image.shape[0])
+        return
+
+    def load(path) -> Tuple[Tuple[int, int], torch.Tensor]:
+        image = Image.open(path).convert("RGB")
+        return image.size, transform(images=image)
+
+    loaded = Prefetcher(image_paths, load, num_workers, queue_depth)
+    for batch in _chunked_iter(loaded, batch_size):
+        logger.info(f"Processing batch of {len(batch)} images")
+        predictions = predict_batch(model, [pixels for _, (_, pixels) in batch])
+        for (path, (size, _)), prediction in zip(batch, predictions):
+            yield path, prediction, size
 
 
 def run_inference(
@@ -41,16 +129,20 @@ def run_inference(
 ) -> None:
     logger.info("Starting inference process")
 
-    try:
-        transform = SegformerTransform.from_pretrained(
-            cfg.models.segformer.variant.b0.huggingface_name
-        )
+    if isinstance(image_paths, (str, os.PathLike)):
+        image_paths = [image_paths]
+    inference_cfg = cfg.get("inference", {})
+    batch_size = max(1, int(inference_cfg.get("batch_size", 1)))
+    writer_cfg = inference_cfg.get("writer", {})
+    prefetch_cfg = inference_cfg.get("prefetch", {})
+    tiling_cfg = inference_cfg.get("tiling", {})
+    tiling = TileConfig.from_cfg(tiling_cfg) if tiling_cfg.get("enabled") else None
 
-        segformer_model = HFSegformer.from_pretrained(
-            cfg.models.segformer.variant.b0.huggingface_name
-        )
+    try:
+        loaded = get_registry(cfg).get(inference_cfg.get("variant", "b0"))
+        transform, segformer_model = loaded.transform, loaded.model
         num_classes = getattr(segformer_model.config, "num_labels", 150)
-        palette = _build_color_palette(num_classes)
+        palette = color_palette(num_classes)
 
     except Exception as e:
         raise TrainingException(
@@ -59,28 +151,29 @@ def run_inference(
 
     logger.info("Model and transforms set up successfully")
 
+    def colorize_mask(mask: np.ndarray, size: Tuple[int, int]) -> Image.Image:
+        return Image.fromarray(colorize(mask, palette, size=size))
+
     try:
         inference_results_path = cfg.paths.get("inference_results", "inference_results")
         os.makedirs(inference_results_path, exist_ok=True)
-        outputs: List[tuple[Image.Image, str]] = []
-
-        for image_path in image_paths:
-            logger.info(f"Processing image: {image_path}")
-            image = Image.open(image_path).convert("RGB")
-            input = transform(images=image).unsqueeze(0)  # Add batch dimension
-            with torch.no_grad():
-                output = torch.argmax(segformer_model(input).logits, dim=1)
-            output_np = output.squeeze().detach().cpu().numpy()
-            colorized_mask = _apply_colormap(output_np, palette)
-            colorized_mask = colorized_mask.resize(image.size, Image.Resampling.NEAREST)
-            outputs.append((colorized_mask, image_path))
-
-        for colorized_mask, image_path in outputs:
-            base_name = os.path.basename(image_path)
-            name, _ = os.path.splitext(base_name)
-            save_path = os.path.join(inference_results_path, f"infer_{name}.png")
-            colorized_mask.save(save_path)
-            logger.info(f"Saved segmentation mask to: {save_path}")
+
+        with MaskWriter(
+            inference_results_path,
+            colorize_mask,
+            num_workers=int(writer_cfg.get("num_workers", 2)),
+            max_pending=int(writer_cfg.get("max_pending", 32)),
+        ) as writer:
+            for image_path, output_np, size in iter_predictions(
+                segformer_model,
+                transform,
+                list(image_paths),
+                batch_size,
+                tiling,
+                num_workers=int(prefetch_cfg.get("num_workers", 4)),
+                queue_depth=int(prefetch_cfg.get("queue_depth", 16)),
+            ):
+                writer.submit(output_np, image_path, size)
 
     except Exception as e:
         raise InferenceException(f"Inference failed: {str(e)}") from e
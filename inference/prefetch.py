@@ -0,0 +1,80 @@
+import logging
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque, Generic, Iterable, Iterator, Tuple, TypeVar
+
+from exceptions import InferenceException
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+_EXHAUSTED = object()
+
+
+class Prefetcher(Generic[T, R]):
+    r"""
+    Runs ``load_fn`` over ``items`` on a background thread pool, keeping up to
+    ``queue_depth`` results decoded ahead of the consumer.
+
+    Results are yielded in input order. While the caller runs the model on one
+    batch, the workers are already decoding and preprocessing the next ones;
+    PIL releases the GIL while decoding and resizing, so threads overlap with
+    model compute without the pickling cost of worker processes.
+
+    Args:
+        items (Iterable[T]): Inputs, e.g. image paths. Consumed lazily.
+        load_fn (Callable[[T], R]): Decodes/preprocesses one input.
+        num_workers (int): Loader threads; ``0`` loads synchronously on the
+            consuming thread.
+        queue_depth (int): Maximum number of inputs loaded or being loaded
+            ahead of the consumer.
+    """
+
+    def __init__(
+        self,
+        items: Iterable[T],
+        load_fn: Callable[[T], R],
+        num_workers: int = 4,
+        queue_depth: int = 16,
+    ):
+        self.items = items
+        self.load_fn = load_fn
+        self.num_workers = max(0, int(num_workers))
+        self.queue_depth = max(1, int(queue_depth))
+
+    def __iter__(self) -> Iterator[Tuple[T, R]]:
+        if self.num_workers == 0:
+            for item in self.items:
+                yield item, self._load(item)
+            return
+
+        pending: Deque[Tuple[T, Future]] = deque()
+        items = iter(self.items)
+        with ThreadPoolExecutor(
+            max_workers=self.num_workers, thread_name_prefix="image-loader"
+        ) as executor:
+            try:
+                for item in items:
+                    pending.append((item, executor.submit(self._load, item)))
+                    if len(pending) >= self.queue_depth:
+                        break
+                while pending:
+                    item, future = pending.popleft()
+                    next_item = next(items, _EXHAUSTED)
+                    if next_item is not _EXHAUSTED:
+                        pending.append(
+                            (next_item, executor.submit(self._load, next_item))
+                        )
+                    yield item, future.result()
+            finally:
+                # Consumer stopped early or failed: drop work not yet started.
+                for _, future in pending:
+                    future.cancel()
+
+    def _load(self, item: T) -> R:
+        try:
+            return self.load_fn(item)
+        except Exception as e:
+            raise InferenceException(f"Failed to load {item}: {str(e)}") from e
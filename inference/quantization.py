@@ -0,0 +1,110 @@
+import copy
+import logging
+from typing import Iterable, Sequence
+
+import torch
+from torch import nn
+from torch.ao.quantization import (
+    QuantWrapper,
+    convert,
+    fuse_modules,
+    get_default_qconfig,
+    prepare,
+    quantize_dynamic,
+)
+
+from exceptions import DependencyError, InferenceException
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATION_MODES = ("none", "dynamic", "static")
+
+
+def select_quantized_engine() -> str:
+    r"""
+    Picks the best available int8 CPU kernel library (x86 > fbgemm > qnnpack)
+    and makes it the active ``torch.backends.quantized.engine``.
+    """
+    supported = torch.backends.quantized.supported_engines
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in supported:
+            torch.backends.quantized.engine = engine
+            return engine
+    raise DependencyError(f"No int8 quantized engine available, got {supported}")
+
+
+def quantize_dynamic_int8(model: nn.Module) -> nn.Module:
+    r"""
+    Returns a copy of ``model`` with int8 weights and dynamically quantized
+    activations for every ``nn.Linear``.
+
+    Dynamic quantization has no convolution kernels in PyTorch, so the patch
+    embeddings, spatial-reduction and depth-wise convs stay in fp32; they are
+    covered by :func:`quantize_static_int8`.
+    """
+    select_quantized_engine()
+    try:
+        return quantize_dynamic(
+            copy.deepcopy(model).eval(), {nn.Linear}, dtype=torch.qint8
+        )
+    except Exception as e:
+        raise InferenceException(f"Dynamic quantization failed: {str(e)}") from e
+
+
+def _wrap_quantizable(module: nn.Module, qconfig, exclude: Sequence[str], prefix=""):
+    for name, child in module.named_children():
+        path = f"{prefix}{name}"
+        if any(path.startswith(skip) for skip in exclude):
+            continue
+        if isinstance(child, (nn.Conv2d, nn.Linear)):
+            wrapped = QuantWrapper(child)
+            wrapped.qconfig = qconfig
+            setattr(module, name, wrapped)
+        else:
+            _wrap_quantizable(child, qconfig, exclude, prefix=f"{path}.")
+
+
+def quantize_static_int8(
+    model: nn.Module,
+    calibration_batches: Iterable[torch.Tensor],
+    exclude: Sequence[str] = (),
+) -> nn.Module:
+    r"""
+    Post-training static int8 quantization of every ``nn.Conv2d`` and
+    ``nn.Linear`` in a Segformer, calibrated on ``calibration_batches``.
+
+    Each layer is wrapped in its own quantize/dequantize pair, so LayerNorm,
+    GELU and the attention softmax keep running in fp32 between int8 layers.
+    The decode head's fuse conv and BatchNorm are folded into one conv first.
+
+    Args:
+        model (nn.Module): fp32 ``HFSegformer`` in eval mode (left untouched).
+        calibration_batches (Iterable[torch.Tensor]): Normalized (N, 3, H, W)
+            pixel values used to observe activation ranges.
+        exclude (Sequence[str]): Module name prefixes to keep in fp32, e.g.
+            ``decode_head.classifier``.
+    Returns:
+        nn.Module: Quantized copy of ``model``.
+    """
+    engine = select_quantized_engine()
+    try:
+        quantized = copy.deepcopy(model).eval()
+        decode_head = getattr(quantized, "decode_head", None)
+        if decode_head is not None and hasattr(decode_head, "batch_norm"):
+            fuse_modules(decode_head, [["linear_fuse", "batch_norm"]], inplace=True)
+
+        _wrap_quantizable(quantized, get_default_qconfig(engine), exclude)
+        prepare(quantized, inplace=True)
+
+        num_batches = 0
+        with torch.inference_mode():
+            for pixel_values in calibration_batches:
+                quantized(pixel_values)
+                num_batches += 1
+        if num_batches == 0:
+            raise ValueError("no calibration batches")
+        logger.info(f"Calibrated static quantization on {num_batches} batches")
+
+        return convert(quantized, inplace=True)
+    except Exception as e:
+        raise InferenceException(f"Static quantization failed: {str(e)}") from e
@@ -0,0 +1,239 @@
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+import os
+from typing import TYPE_CHECKING, Any, Iterable, Mapping, Optional, Union
+
+import torch
+
+from exceptions import ModelLoadException
+
+from .optimize import InferenceOptions, OptimizedSegformer, optimize_for_inference
+from .quantization import QUANTIZATION_MODES, quantize_dynamic_int8
+from .runtime import BACKENDS, ExportedSegformer, load_exported
+
+if TYPE_CHECKING:
+    from datasets.preprocess import FastSegformerPreprocessor
+    from datasets.transforms import SegformerTransform
+    from models import HFSegformer
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class LoadedModel:
+    variant: str
+    transform: Union["SegformerTransform", "FastSegformerPreprocessor"]
+    model: Union["HFSegformer", OptimizedSegformer, ExportedSegformer]
+    nbytes: int
+
+
+def _model_nbytes(model: torch.nn.Module) -> int:
+    # Walks the state dict rather than parameters() so that the packed int8
+    # weights of quantized layers, stored as (weight, bias) tuples, count too.
+    nbytes = 0
+    for value in model.state_dict().values():
+        for t in value if isinstance(value, tuple) else (value,):
+            if isinstance(t, torch.Tensor):
+                nbytes += t.numel() * t.element_size()
+    return nbytes
+
+
+class ModelRegistry:
+    r"""
+    Process-wide LRU cache of Segformer models and their processors.
+
+    Args:
+        variants (Mapping): ``models.segformer.variant`` section of the config,
+            mapping a variant name (b0/b2/b5) to its ``huggingface_name`` and
+            optional ``weights`` (e.g. fp16 safetensors written by training)
+            loaded on top of it by the eager backend.
+        memory_budget_mb (Optional[float]): Upper bound on the summed size of
+            the cached weights. Least recently used variants are evicted once
+            it is exceeded. ``None`` disables eviction.
+        backend (str): ``eager`` runs the Hugging Face model; ``torchscript`` and
+            ``onnx`` load the graphs written by ``scripts/export.py`` from
+            ``export_dir/<variant>`` without importing ``transformers``.
+        export_dir (Optional[str]): Root directory of exported variants.
+        backend_options (Optional[Mapping]): Extra arguments for the exported
+            runtime, e.g. ``num_threads`` for ONNX Runtime.
+        quantization (str): ``none``, ``dynamic`` or ``static`` int8. With the
+            eager backend ``dynamic`` is applied at load time; the TorchScript
+            backend loads the int8 graphs written by ``scripts/quantize.py``.
+        optimization (Optional[InferenceOptions]): bf16 autocast, channels_last
+            and ``torch.compile`` for the eager fp32 backend, guarded by a
+            parity check against fp32.
+    """
+
+    def __init__(
+        self,
+        variants: Mapping,
+        memory_budget_mb: Optional[float] = None,
+        backend: str = "eager",
+        export_dir: Optional[str] = None,
+        backend_options: Optional[Mapping[str, Any]] = None,
+        quantization: str = "none",
+        optimization: Optional[InferenceOptions] = None,
+    ):
+        if backend not in BACKENDS:
+            raise ModelLoadException(
+                f"Unknown inference backend '{backend}', expected one of {BACKENDS}"
+            )
+        if quantization not in QUANTIZATION_MODES:
+            raise ModelLoadException(
+                f"Unknown quantization '{quantization}', "
+                f"expected one of {QUANTIZATION_MODES}"
+            )
+        if backend == "eager" and quantization == "static":
+            raise ModelLoadException(
+                "Static int8 models are served from TorchScript: run "
+                "scripts/quantize.py and set the backend to torchscript"
+            )
+        if optimization is not None and not optimization.is_default:
+            if backend != "eager" or quantization != "none":
+                raise ModelLoadException(
+                    "Precision, channels_last and compile options apply to the "
+                    "eager fp32 backend only"
+                )
+        self.quantization = quantization
+        self.optimization = optimization
+        self.variants = variants
+        self.backend = backend
+        self.export_dir = export_dir or "exported_models"
+        self.backend_options = dict(backend_options or {})
+        self.memory_budget = (
+            int(memory_budget_mb * 1024**2) if memory_budget_mb else None
+        )
+        self._entries: "OrderedDict[str, LoadedModel]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    @property
+    def loaded_variants(self) -> list[str]:
+        with self._lock:
+            return list(self._entries)
+
+    @property
+    def memory_usage(self) -> int:
+        with self._lock:
+            return sum(entry.nbytes for entry in self._entries.values())
+
+    def get(self, variant: str) -> LoadedModel:
+        with self._lock:
+            entry = self._entries.get(variant)
+            if entry is not None:
+                self._entries.move_to_end(variant)
+                return entry
+
+            entry = self._load(variant)
+            self._entries[variant] = entry
+            self._evict()
+            return entry
+
+    def warmup(self, variants: Optional[Iterable[str]] = None) -> None:
+        r"""
+        Loads the given variants (all configured ones by default) and runs one
+        dummy forward pass each so the first real request skips the cold start.
+        """
+        for variant in variants if variants is not None else list(self.variants):
+            entry = self.get(variant)
+            size = int(self.variants[variant].get("image_size", 512))
+            with torch.inference_mode():
+                entry.model(torch.zeros(1, 3, size, size))
+            logger.info(f"Warmed up segformer variant {variant}")
+
+    def evict(self, variant: str) -> None:
+        with self._lock:
+            self._entries.pop(variant, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _load(self, variant: str) -> LoadedModel:
+        if variant not in self.variants:
+            raise ModelLoadException(
+                f"Unknown segformer variant '{variant}', "
+                f"expected one of {list(self.variants)}"
+            )
+        if self.backend != "eager":
+            transform, model = load_exported(
+                os.path.join(self.export_dir, variant),
+                self.backend,
+                quantization=self.quantization,
+                **self.backend_options,
+            )
+            nbytes = model.nbytes
+        else:
+            huggingface_name = self.variants[variant]["huggingface_name"]
+            try:
+                from datasets.transforms import SegformerTransform
+                from utils.model_utils import load_segformer
+
+                transform = SegformerTransform.from_pretrained(huggingface_name)
+                model = load_segformer(
+                    huggingface_name, self.variants[variant].get("weights", None)
+                )
+                if self.quantization == "dynamic":
+                    model = quantize_dynamic_int8(model)
+            except Exception as e:
+                raise ModelLoadException(
+                    f"Failed to load variant '{variant}' ({huggingface_name}): {str(e)}"
+                ) from e
+            nbytes = _model_nbytes(model)
+            if self.optimization is not None:
+                image_size = int(self.variants[variant].get("image_size", 512))
+                model = optimize_for_inference(model, self.optimization, image_size)
+
+        logger.info(
+            f"Loaded segformer variant {variant} with {self.backend} backend, "
+            f"{self.quantization} quantization "
+            f"({nbytes / 1024**2:.1f} MB)"
+        )
+        return LoadedModel(variant, transform, model, nbytes)
+
+    def _evict(self) -> None:
+        if self.memory_budget is None:
+            return
+        while len(self._entries) > 1 and self.memory_usage > self.memory_budget:
+            variant, _ = self._entries.popitem(last=False)
+            logger.info(f"Evicted segformer variant {variant} from model cache")
+        if self.memory_usage > self.memory_budget:
+            logger.warning(
+                f"Variant {next(iter(self._entries))} alone exceeds the model "
+                f"cache budget of {self.memory_budget / 1024**2:.0f} MB"
+            )
+
+
+_registries: dict[str, ModelRegistry] = {}
+_registry_lock = threading.Lock()
+
+
+def get_registry(cfg) -> ModelRegistry:
+    r"""
+    Returns the process-wide registry for the options in ``cfg``, creating it
+    on first use. Configs with different variants, backend, quantization,
+    optimization or memory budget get separate registries (each with its own
+    budget) instead of silently sharing the first one.
+    """
+    inference_cfg = cfg.get("inference", {})
+    registry_cfg = inference_cfg.get("registry", {})
+    options = dict(
+        variants=cfg.models.segformer.variant,
+        memory_budget_mb=registry_cfg.get("memory_budget_mb", None),
+        backend=inference_cfg.get("backend", "eager"),
+        export_dir=inference_cfg.get("export_dir", None),
+        backend_options=inference_cfg.get("backend_options", None),
+        quantization=inference_cfg.get("quantization", "none"),
+        optimization=InferenceOptions.from_cfg(inference_cfg.get("optimization", {})),
+    )
+    key = repr(sorted(options.items()))
+    with _registry_lock:
+        if key not in _registries:
+            if _registries:
+                logger.info(
+                    f"Creating another model registry for backend "
+                    f"{options['backend']}, {options['quantization']} quantization"
+                )
+            _registries[key] = ModelRegistry(**options)
+        return _registries[key]
@@ -0,0 +1,158 @@
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import NamedTuple, Optional, Sequence, Tuple
+
+import torch
+
+from datasets.preprocess import FastSegformerPreprocessor
+from exceptions import DependencyError, ModelLoadException
+
+from .quantization import select_quantized_engine
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("eager", "torchscript", "onnx")
+MODEL_FILES = {"torchscript": "model.pt", "onnx": "model.onnx"}
+
+
+class SegformerOutput(NamedTuple):
+    logits: torch.Tensor
+
+
+@dataclass
+class ExportedConfig:
+    num_labels: int
+    id2label: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_json(cls, path: str) -> "ExportedConfig":
+        with open(path) as f:
+            config = json.load(f)
+        id2label = {int(k): v for k, v in config.get("id2label", {}).items()}
+        return cls(num_labels=int(config["num_labels"]), id2label=id2label)
+
+
+class ExportedSegformer(ABC):
+    r"""
+    Exported Segformer graph that stands in for ``HFSegformer`` at inference:
+    calling it with (N, 3, H, W) pixel values returns an object with
+    ``.logits``, and ``config`` carries ``num_labels`` and ``id2label``.
+    """
+
+    def __init__(self, path: str, config: ExportedConfig):
+        self.path = path
+        self.config = config
+
+    @property
+    def nbytes(self) -> int:
+        return os.path.getsize(self.path)
+
+    def eval(self) -> "ExportedSegformer":
+        return self
+
+    @abstractmethod
+    def __call__(self, pixel_values: torch.Tensor) -> SegformerOutput:
+        pass
+
+
+class TorchScriptSegformer(ExportedSegformer):
+    def __init__(self, path: str, config: ExportedConfig):
+        super().__init__(path, config)
+        self.module = torch.jit.load(path, map_location="cpu").eval()
+
+    def __call__(self, pixel_values: torch.Tensor) -> SegformerOutput:
+        return SegformerOutput(self.module(pixel_values))
+
+
+class OnnxSegformer(ExportedSegformer):
+    r"""
+    Args:
+        path (str): ``.onnx`` file exported with ``inference.export.export_onnx``.
+        config (ExportedConfig): Label metadata.
+        providers (Optional[Sequence[str]]): ONNX Runtime execution providers,
+            CPU only by default.
+        num_threads (Optional[int]): Intra-op threads, ``None`` for the runtime default.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        config: ExportedConfig,
+        providers: Optional[Sequence[str]] = None,
+        num_threads: Optional[int] = None,
+    ):
+        super().__init__(path, config)
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise DependencyError(
+                "onnxruntime is required for the onnx inference backend"
+            ) from e
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = int(num_threads)
+        self.session = ort.InferenceSession(
+            path, options, providers=list(providers or ["CPUExecutionProvider"])
+        )
+
+    def __call__(self, pixel_values: torch.Tensor) -> SegformerOutput:
+        inputs = {"pixel_values": pixel_values.detach().cpu().float().numpy()}
+        (logits,) = self.session.run(["logits"], inputs)
+        return SegformerOutput(torch.from_numpy(logits))
+
+
+def model_filename(backend: str, quantization: str = "none") -> str:
+    r"""
+    File name of an exported graph, e.g. ``model.pt`` or, for int8 models
+    written by ``scripts/quantize.py``, ``model_int8_static.pt``.
+    """
+    if backend not in MODEL_FILES:
+        raise ModelLoadException(
+            f"Unknown export backend '{backend}', expected one of {list(MODEL_FILES)}"
+        )
+    if quantization == "none":
+        return MODEL_FILES[backend]
+    if backend != "torchscript":
+        raise ModelLoadException(
+            f"int8 models are exported as TorchScript, not {backend}"
+        )
+    stem, ext = os.path.splitext(MODEL_FILES[backend])
+    return f"{stem}_int8_{quantization}{ext}"
+
+
+def load_exported(
+    export_dir: str, backend: str, quantization: str = "none", **backend_kwargs
+) -> Tuple[FastSegformerPreprocessor, ExportedSegformer]:
+    r"""
+    Loads an exported variant from ``export_dir`` (as written by
+    ``scripts/export.py`` or ``scripts/quantize.py``) without importing
+    ``transformers``.
+
+    Returns:
+        Tuple[FastSegformerPreprocessor, ExportedSegformer]: Preprocessor rebuilt
+        from ``preprocessor.json`` and the exported model.
+    """
+    path = os.path.join(export_dir, model_filename(backend, quantization))
+    if quantization != "none":
+        select_quantized_engine()
+    try:
+        with open(os.path.join(export_dir, "preprocessor.json")) as f:
+            preprocessor = FastSegformerPreprocessor.from_config(json.load(f))
+        config = ExportedConfig.from_json(os.path.join(export_dir, "config.json"))
+        if backend == "onnx":
+            model = OnnxSegformer(path, config, **backend_kwargs)
+        else:
+            model = TorchScriptSegformer(path, config)
+    except DependencyError:
+        raise
+    except Exception as e:
+        raise ModelLoadException(
+            f"Failed to load {backend} model from {export_dir}: {str(e)}"
+        ) from e
+    logger.info(f"Loaded {backend} model from {path}")
+    return preprocessor, model
@@ -0,0 +1,232 @@
+from dataclasses import dataclass
+from typing import Callable, Iterator, Optional
+
+import torch
+import torch.nn.functional as F
+
+from exceptions import InferenceException
+
+
+@dataclass
+class TileConfig:
+    tile_size: int = 512
+    overlap: float = 0.25
+    batch_size: int = 4
+    output_stride: int = 4  # Segformer logits are 1/4 of the input resolution
+
+    @classmethod
+    def from_cfg(cls, tiling_cfg) -> "TileConfig":
+        return cls(
+            tile_size=int(tiling_cfg.get("tile_size", 512)),
+            overlap=float(tiling_cfg.get("overlap", 0.25)),
+            batch_size=int(tiling_cfg.get("batch_size", 4)),
+        )
+
+
+def _tile_starts(length: int, tile: int, stride: int, unit: int) -> list[int]:
+    # Like mmseg's slide inference, the last tile is shifted back to the edge
+    # (rounded up to a multiple of ``unit`` so tiles stay aligned to logits).
+    if length <= tile:
+        return [0]
+    last = -(-(length - tile) // unit) * unit
+    return list(range(0, last, stride)) + [last]
+
+
+def _blend_window(height: int, width: int, device=None) -> torch.Tensor:
+    """Separable triangular weights, highest at the tile center and > 0 at its edges."""
+
+    def ramp(n: int) -> torch.Tensor:
+        i = torch.arange(n, dtype=torch.float32, device=device)
+        return torch.minimum(i + 1, n - i) / ((n + 1) // 2)
+
+    return ramp(height)[:, None] * ramp(width)[None, :]
+
+
+class _BandAccumulator:
+    r"""
+    Weighted logit sums for one band of tile rows at logit resolution.
+
+    Holds ``tile_rows + 1`` low-resolution rows (one row of context above the
+    current tile row for bilinear upsampling) across the full image width.
+    Rows that no later tile can touch are upsampled, argmaxed and handed out,
+    so memory does not grow with image height; the band itself grows linearly
+    with image width.
+    """
+
+    def __init__(
+        self,
+        num_classes: int,
+        rows: int,
+        total_rows: int,
+        padded_size: tuple[int, int],
+        out_size: tuple[int, int],
+        device=None,
+    ):
+        padded_height, padded_width = padded_size
+        low_width = padded_width * total_rows // padded_height
+        self.scores = torch.zeros(num_classes, rows, low_width, device=device)
+        self.weights = torch.zeros(rows, low_width, device=device)
+        self.top = 0  # low-res row held in self.scores[:, 0]
+        self.total_rows = total_rows  # low-res rows of the padded image
+        self.scale = total_rows / padded_height
+        self.padded_width = padded_width
+        self.height_out, self.width_out = out_size
+        self.emitted = 0  # output rows already handed out
+
+    def shift(self, new_top: int) -> None:
+        drop = new_top - self.top
+        if drop <= 0:
+            return
+        self.scores = torch.cat(
+            [self.scores[:, drop:], torch.zeros_like(self.scores[:, :drop])], dim=1
+        )
+        self.weights = torch.cat(
+            [self.weights[drop:], torch.zeros_like(self.weights[:drop])], dim=0
+        )
+        self.top = new_top
+
+    def add(self, logits: torch.Tensor, window: torch.Tensor, row: int, col: int):
+        rows, cols = logits.shape[-2:]
+        r = row - self.top
+        self.scores[:, r : r + rows, col : col + cols] += logits * window
+        self.weights[r : r + rows, col : col + cols] += window
+
+    def _normalized(self, rows: torch.Tensor, cols: slice) -> torch.Tensor:
+        rows = rows - self.top
+        return self.scores[:, rows, cols] / self.weights[rows, cols].clamp(min=1e-6)
+
+    def emit(
+        self, final_rows: int, chunk_rows: int = 16, chunk_cols: int = 2048
+    ) -> Iterator[torch.Tensor]:
+        r"""
+        Yields uint8 label rows that only need low-res rows < ``final_rows``.
+
+        Upsampling runs on ``chunk_rows`` x ``chunk_cols`` output blocks, each
+        from just the low-res columns it samples, so the float scratch memory
+        does not depend on the image width.
+        """
+        device = self.scores.device
+        low_width = self.scores.shape[-1]
+        col_scale = low_width / self.padded_width
+        while self.emitted < self.height_out:
+            stop = min(self.emitted + chunk_rows, self.height_out)
+            out_rows = torch.arange(self.emitted, stop, device=device)
+            # Same sampling as F.interpolate(mode="bilinear", align_corners=False).
+            src = ((out_rows.float() + 0.5) * self.scale - 0.5).clamp_(min=0)
+            lower = src.floor().long()
+            upper = torch.clamp(lower + 1, max=self.total_rows - 1)
+            count = int((upper < final_rows).sum())  # rows are monotonic
+            if count == 0:
+                return
+            lower, upper = lower[:count], upper[:count]
+            row_frac = (src[:count] - lower).view(1, -1, 1)
+
+            labels = []
+            for col in range(0, self.width_out, chunk_cols):
+                out_cols = torch.arange(
+                    col, min(col + chunk_cols, self.width_out), device=device
+                )
+                src_cols = ((out_cols.float() + 0.5) * col_scale - 0.5).clamp_(min=0)
+                left = src_cols.floor().long()
+                right = torch.clamp(left + 1, max=low_width - 1)
+                cols = slice(int(left[0]), int(right[-1]) + 1)
+                top_rows = self._normalized(lower, cols)
+                bottom_rows = self._normalized(upper, cols)
+                blended = top_rows + (bottom_rows - top_rows) * row_frac
+                left, right = left - cols.start, right - cols.start
+                col_frac = (src_cols - src_cols.floor()).view(1, 1, -1)
+                upsampled = blended[:, :, left] + (
+                    blended[:, :, right] - blended[:, :, left]
+                ) * col_frac
+                labels.append(upsampled.argmax(dim=0).to(torch.uint8))
+            self.emitted += count
+            yield torch.cat(labels, dim=1)
+
+
+def sliding_window_predict(
+    model: torch.nn.Module,
+    image: torch.Tensor,
+    config: TileConfig,
+    normalize: Optional[Callable[[torch.Tensor], torch.Tensor]] = None,
+) -> torch.Tensor:
+    r"""
+    Tiled inference over an image of any size.
+
+    Tiles of ``tile_size`` overlapping by ``overlap`` are run in batches of
+    ``batch_size``; their logits are blended with a triangular window at logit
+    resolution, bilinearly upsampled and argmaxed. Edge tiles are zero-padded
+    after normalization. Working memory is one batch of tiles plus one band of
+    tile-height, logit-resolution scores spanning the image width (about
+    ``num_classes * (tile_size / 4 + 1) * width`` floats) and fixed-size
+    upsampling blocks: independent of the image height, linear in its width.
+
+    Args:
+        model (torch.nn.Module): Segformer returning ``.logits``.
+        image (torch.Tensor): (3, H, W) image, uint8 if ``normalize`` is given,
+            otherwise already normalized.
+        config (TileConfig): Tile geometry and batch size.
+        normalize (Optional[Callable]): Maps a uint8 (N, 3, h, w) tile batch to
+            normalized floats.
+    Returns:
+        torch.Tensor: (H, W) uint8 label map.
+    """
+    unit = config.output_stride
+    tile = config.tile_size
+    if tile % unit:
+        raise InferenceException(f"tile_size {tile} must be a multiple of {unit}")
+    stride = max(int(tile * (1 - config.overlap)) // unit * unit, unit)
+    tile_low = tile // unit
+
+    height, width = image.shape[-2:]
+    row_starts = _tile_starts(height, tile, stride, unit)
+    col_starts = _tile_starts(width, tile, stride, unit)
+    padded_size = (row_starts[-1] + tile, col_starts[-1] + tile)
+    window = _blend_window(tile_low, tile_low, device=image.device)
+
+    def prepare(tile_pixels: torch.Tensor) -> torch.Tensor:
+        if normalize is not None:
+            tile_pixels = normalize(tile_pixels.unsqueeze(0))[0]
+        pad_h, pad_w = tile - tile_pixels.shape[-2], tile - tile_pixels.shape[-1]
+        return F.pad(tile_pixels, (0, pad_w, 0, pad_h))
+
+    accumulator: Optional[_BandAccumulator] = None
+    labels = torch.empty(height, width, dtype=torch.uint8, device=image.device)
+    written = 0
+
+    with torch.inference_mode():
+        for row in row_starts:
+            row_low = row // unit
+            if accumulator is not None:
+                for rows in accumulator.emit(final_rows=row_low):
+                    labels[written : written + rows.shape[0]] = rows
+                    written += rows.shape[0]
+                accumulator.shift(max(row_low - 1, accumulator.top))
+
+            for start in range(0, len(col_starts), config.batch_size):
+                cols = col_starts[start : start + config.batch_size]
+                batch = torch.stack(
+                    [prepare(image[:, row : row + tile, c : c + tile]) for c in cols]
+                )
+                logits = model(batch).logits.float()
+                if logits.shape[-2:] != (tile_low, tile_low):
+                    raise InferenceException(
+                        f"Expected {tile_low}x{tile_low} logits per tile, "
+                        f"got {tuple(logits.shape[-2:])}"
+                    )
+
+                if accumulator is None:
+                    accumulator = _BandAccumulator(
+                        num_classes=logits.shape[1],
+                        rows=tile_low + 1,
+                        total_rows=padded_size[0] // unit,
+                        padded_size=padded_size,
+                        out_size=(height, width),
+                        device=logits.device,
+                    )
+                for col, tile_logits in zip(cols, logits):
+                    accumulator.add(tile_logits, window, row_low, col // unit)
+
+        for rows in accumulator.emit(final_rows=accumulator.total_rows):
+            labels[written : written + rows.shape[0]] = rows
+            written += rows.shape[0]
+    return labels
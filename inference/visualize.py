@@ -1 +1,85 @@
-# Auto-generated file by template.py
+from functools import lru_cache
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+@lru_cache(maxsize=None)
+def color_palette(num_classes: int) -> np.ndarray:
+    r"""
+    Deterministic (num_classes, 3) uint8 RGB lookup table for up to 256 classes.
+
+    Spreads the bits of each label over the high bits of R, G and B (the
+    PASCAL VOC colormap). The table is built once per ``num_classes`` and is
+    read-only.
+    """
+    labels = np.arange(num_classes, dtype=np.int64)
+    palette = np.zeros((num_classes, 3), dtype=np.uint8)
+    for bit in range(8):
+        for channel in range(3):
+            palette[:, channel] |= (
+                ((labels >> (3 * bit + channel)) & 1) << (7 - bit)
+            ).astype(np.uint8)
+    palette.setflags(write=False)
+    return palette
+
+
+def resize_labels(labels: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    r"""
+    Nearest-neighbor resize of a label map or a batch of label maps.
+
+    Args:
+        labels (np.ndarray): Label map of shape (H, W) or (N, H, W).
+        size (Tuple[int, int]): Target (width, height), as in ``PIL.Image.size``.
+    Returns:
+        np.ndarray: Label map(s) of shape (height, width) or (N, height, width).
+    """
+    width, height = size
+    in_height, in_width = labels.shape[-2:]
+    if (in_height, in_width) == (height, width):
+        return labels
+    rows = ((np.arange(height) + 0.5) * (in_height / height)).astype(np.intp)
+    cols = ((np.arange(width) + 0.5) * (in_width / width)).astype(np.intp)
+    np.minimum(rows, in_height - 1, out=rows)
+    np.minimum(cols, in_width - 1, out=cols)
+    return labels[..., rows[:, None], cols[None, :]]
+
+
+def colorize(
+    labels: np.ndarray,
+    palette: np.ndarray,
+    size: Optional[Tuple[int, int]] = None,
+) -> np.ndarray:
+    r"""
+    Args:
+        labels (np.ndarray): Integer label map of shape (H, W) or (N, H, W).
+        palette (np.ndarray): (num_classes, 3) uint8 table from ``color_palette``.
+        size (Optional[Tuple[int, int]]): Optional (width, height) to resize the
+            label map to before colorizing.
+    Returns:
+        np.ndarray: uint8 RGB array of shape (..., height, width, 3).
+    """
+    if size is not None:
+        labels = resize_labels(labels, size)
+    return palette[labels]
+
+
+def overlay_mask(
+    image: np.ndarray, color_mask: np.ndarray, alpha: float = 0.5
+) -> np.ndarray:
+    r"""
+    Blends a colorized mask over an RGB image of the same (H, W).
+
+    Args:
+        image (np.ndarray): uint8 RGB image of shape (H, W, 3).
+        color_mask (np.ndarray): uint8 RGB mask of shape (H, W, 3).
+        alpha (float): Weight of the mask in the blend.
+    Returns:
+        np.ndarray: uint8 RGB array of shape (H, W, 3).
+    """
+    weight = int(round(alpha * 256))
+    blended = (
+        image.astype(np.uint16) * (256 - weight)
+        + color_mask.astype(np.uint16) * weight
+    )
+    return (blended >> 8).astype(np.uint8)
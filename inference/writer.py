@@ -0,0 +1,99 @@
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional, Union
+
+import numpy as np
+from PIL import Image
+
+from exceptions import InferenceException
+
+logger = logging.getLogger(__name__)
+
+
+class MaskWriter:
+    r"""
+    Colorizes and saves predicted label maps on a background thread pool.
+
+    At most ``max_pending`` masks are queued or in flight; ``submit`` blocks
+    once that limit is reached, so memory stays bounded regardless of how many
+    images are streamed through. Each mask is written as soon as its worker
+    picks it up.
+
+    Args:
+        output_dir (str): Directory the colorized masks are written to.
+        colorize (Callable[[np.ndarray, tuple[int, int]], Image.Image]): Maps a
+            label map and the original (width, height) to an RGB image.
+        num_workers (int): Number of writer threads.
+        max_pending (int): Maximum number of masks queued or being written.
+    """
+
+    def __init__(
+        self,
+        output_dir: Union[str, os.PathLike],
+        colorize: Callable[[np.ndarray, tuple[int, int]], Image.Image],
+        num_workers: int = 2,
+        max_pending: int = 32,
+    ):
+        self.output_dir = output_dir
+        self.colorize = colorize
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, num_workers), thread_name_prefix="mask-writer"
+        )
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._error: Optional[BaseException] = None
+
+    def output_path(self, image_path: Union[str, os.PathLike]) -> str:
+        name, _ = os.path.splitext(os.path.basename(image_path))
+        return os.path.join(self.output_dir, f"infer_{name}.png")
+
+    def submit(
+        self,
+        mask: np.ndarray,
+        image_path: Union[str, os.PathLike],
+        size: tuple[int, int],
+    ) -> None:
+        self._raise_if_failed()
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._write, mask, image_path, size)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(self._on_done)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        self._raise_if_failed()
+
+    def _write(
+        self,
+        mask: np.ndarray,
+        image_path: Union[str, os.PathLike],
+        size: tuple[int, int],
+    ) -> None:
+        save_path = self.output_path(image_path)
+        self.colorize(mask, size).save(save_path)
+        logger.info(f"Saved segmentation mask to: {save_path}")
+
+    def _on_done(self, future: Future) -> None:
+        self._slots.release()
+        error = future.exception()
+        if error is not None and self._error is None:
+            self._error = error
+
+    def _raise_if_failed(self) -> None:
+        if self._error is not None:
+            raise InferenceException(f"Writing mask failed: {str(self._error)}")
+
+    def __enter__(self) -> "MaskWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            # Let queued masks finish so partial results are on disk, but do
+            # not mask the original error with a writer error.
+            self._executor.shutdown(wait=True)
+            return
+        self.close()
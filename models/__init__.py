@@ -1,3 +1,13 @@
-from .hf_segformer import HFSegformer, HFSegformerConfig
+from typing import TYPE_CHECKING
+
+from utils.lazy import lazy_exports
+
+# transformers is only imported once a model class is actually used.
+__getattr__, __dir__ = lazy_exports(
+    __name__, {"HFSegformer": ".hf_segformer", "HFSegformerConfig": ".hf_segformer"}
+)
+
+if TYPE_CHECKING:
+    from .hf_segformer import HFSegformer, HFSegformerConfig
 
 __all__ = ["HFSegformer", "HFSegformerConfig"]
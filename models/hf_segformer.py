@@ -1,3 +1,8 @@
+import types
+from typing import Optional, Sequence
+
+import torch
+from torch.utils.checkpoint import checkpoint
 from transformers import (
     SegformerForSemanticSegmentation,
     SegformerConfig,
@@ -8,5 +13,41 @@ class HFSegformerConfig(SegformerConfig):
     pass
 
 
+def _checkpointed_forward(layer, *args, **kwargs):
+    forward = type(layer).forward
+    if layer.training and torch.is_grad_enabled():
+        return checkpoint(forward, layer, *args, use_reentrant=False, **kwargs)
+    return forward(layer, *args, **kwargs)
+
+
 class HFSegformer(SegformerForSemanticSegmentation):
-    pass
+    def enable_activation_checkpointing(
+        self, stages: Optional[Sequence[int]] = None
+    ) -> int:
+        r"""
+        Recomputes the encoder's transformer blocks (``SegformerLayer``) in
+        backward instead of keeping their activations, trading roughly one
+        extra encoder forward per step for memory. Only applies in training
+        mode with gradients enabled; parameter names are unchanged, so
+        checkpoints load either way.
+
+        Args:
+            stages (Sequence[int], optional): Encoder stages to checkpoint,
+                e.g. ``[0, 1]`` for the high-resolution ones. All by default.
+
+        Returns:
+            int: Number of checkpointed blocks.
+        """
+        blocks = self.segformer.encoder.block
+        stages = range(len(blocks)) if stages is None else stages
+        count = 0
+        for stage in stages:
+            for layer in blocks[stage]:
+                layer.forward = types.MethodType(_checkpointed_forward, layer)
+                count += 1
+        return count
+
+    def disable_activation_checkpointing(self) -> None:
+        for stage in self.segformer.encoder.block:
+            for layer in stage:
+                layer.__dict__.pop("forward", None)
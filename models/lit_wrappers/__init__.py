@@ -1,3 +1,13 @@
-from .segformer_wrapper import SegformerLitWrapper
+from typing import TYPE_CHECKING
+
+from utils.lazy import lazy_exports
+
+# pytorch_lightning is only imported once the wrapper is actually used.
+__getattr__, __dir__ = lazy_exports(
+    __name__, {"SegformerLitWrapper": ".segformer_wrapper"}
+)
+
+if TYPE_CHECKING:
+    from .segformer_wrapper import SegformerLitWrapper
 
 __all__ = ["SegformerLitWrapper"]
@@ -1,14 +1,17 @@
 import logging
 from dataclasses import dataclass
+from typing import Callable, Optional
 
 import pytorch_lightning as pl
 import torch
-import torchvision.transforms.functional as TF
-from sympy import beta
-from torchmetrics.classification import MulticlassAccuracy, MulticlassJaccardIndex
 from transformers import SegformerForSemanticSegmentation
 
+from datasets.transforms import reset_padding
 from exceptions import SegformerLitException
+from training.loss import SegmentationLoss
+from training.metrics import ConfusionMatrixMetric
+from training.optim import build_optimizer, build_scheduler
+from training.profiling import profiled
 
 logger = logging.getLogger(__name__)
 
@@ -20,21 +23,51 @@ class SegformerLitConfig:
     learning_rate: float
     weight_decay: float
     betas: tuple = (0.9, 0.999)
+    optimizer: str = "AdamW"
+    optimizer_implementation: str = "auto"
+    scheduler: Optional[str] = "PolyLR"
+    poly_power: float = 0.9
+    min_lr: float = 0.0
+    warmup_steps: int = 0
+    activation_checkpointing: bool = False
+    checkpoint_stages: Optional[tuple] = None
+    loss_mode: str = "full"
+    loss_chunk_rows: int = 64
 
 
 class SegformerLitWrapper(pl.LightningModule):
     def __init__(
-        self, model: SegformerForSemanticSegmentation, config: SegformerLitConfig
+        self,
+        model: SegformerForSemanticSegmentation,
+        config: SegformerLitConfig,
+        batch_transform: Optional[Callable] = None,
+        normalize: Optional[Callable] = None,
     ):
         try:
             super().__init__()
             self.model = model
             self.config = config
-            self.criterion = torch.nn.CrossEntropyLoss(ignore_index=config.ignore_index)
-            self.acc = MulticlassAccuracy(
+            self.batch_transform = batch_transform
+            self.normalize = normalize
+            # Set by training.profiling.StepProfiler while it records.
+            self.step_timer = None
+            if config.activation_checkpointing:
+                if not hasattr(model, "enable_activation_checkpointing"):
+                    raise SegformerLitException(
+                        f"{type(model).__name__} does not support activation "
+                        "checkpointing, use models.HFSegformer"
+                    )
+                count = model.enable_activation_checkpointing(config.checkpoint_stages)
+                logger.info(f"Activation checkpointing on {count} encoder blocks")
+            self.criterion = SegmentationLoss(
+                ignore_index=config.ignore_index,
+                mode=config.loss_mode,
+                chunk_rows=config.loss_chunk_rows,
+            )
+            self.train_metrics = ConfusionMatrixMetric(
                 num_classes=config.num_classes, ignore_index=config.ignore_index
             )
-            self.jaccard = MulticlassJaccardIndex(
+            self.val_metrics = ConfusionMatrixMetric(
                 num_classes=config.num_classes, ignore_index=config.ignore_index
             )
             self.save_hyperparameters(vars(config))
@@ -44,20 +77,43 @@ class SegformerLitWrapper(pl.LightningModule):
     def forward(self, x):
         return self.model(x)
 
+    def _recording(self) -> bool:
+        return (
+            self.step_timer is not None
+            and self.step_timer.enabled
+            and self.trainer.training
+        )
+
+    def on_before_batch_transfer(self, batch, dataloader_idx):
+        if self._recording():
+            self.step_timer.batch_fetched()
+        return batch
+
+    def on_after_batch_transfer(self, batch, dataloader_idx):
+        timing = getattr(batch, "timing", None)
+        images, masks = batch
+        if self.batch_transform is not None and self.trainer.training:
+            images, masks = self.batch_transform(images=images, masks=masks)
+        elif images.dtype == torch.uint8 and self.normalize is not None:
+            # uint8 batches from the pinned collate are normalized on device,
+            # then augmentation padding is zeroed as mmseg pads after normalizing
+            images = self.normalize(images)
+            images, masks = reset_padding(images, masks, self.config.ignore_index)
+        if self._recording():
+            self.step_timer.batch_ready(timing)
+        return images, masks
+
     def training_step(self, batch, batch_idx):
         try:
             images, masks = batch
-            outputs = self(images)
-            logits = TF.resize(
-                outputs.logits,
-                size=masks.shape[1:],
-                interpolation=TF.InterpolationMode.NEAREST,
-            )
-            preds = logits.argmax(dim=1)
-            loss = self.criterion(logits, masks)
-            self.log("train_loss", loss, prog_bar=True)
-            self.log("train_acc", self.acc(preds, masks), prog_bar=True)
-            self.log("train_miou", self.jaccard(preds, masks), prog_bar=True)
+            masks = masks.long()  # masks travel as uint8, widen on device
+            with profiled(self.step_timer, "forward"):
+                outputs = self(images)
+                loss, preds, masks = self.criterion(outputs.logits, masks)
+            with profiled(self.step_timer, "log"):
+                self.log("train_loss", loss, prog_bar=True)
+            with profiled(self.step_timer, "metric"):
+                self.train_metrics.update(preds, masks)
 
             return loss
         except Exception as e:
@@ -68,32 +124,75 @@ class SegformerLitWrapper(pl.LightningModule):
     def validation_step(self, batch, batch_idx):
         try:
             images, masks = batch
+            masks = masks.long()  # masks travel as uint8, widen on device
             outputs = self.model(images)
-            logits = outputs.logits
-            logits = TF.resize(
-                outputs.logits,
-                size=masks.shape[1:],
-                interpolation=TF.InterpolationMode.NEAREST,
-            )
-            preds = logits.argmax(dim=1)
-            loss = self.criterion(logits, masks)
-            self.log("val_loss", loss, prog_bar=True)
-            self.log("val_acc", self.acc(preds, masks), prog_bar=True)
-            self.log("val_miou", self.jaccard(preds, masks), prog_bar=True)
+            loss, preds, masks = self.criterion(outputs.logits, masks)
+            self.log("val_loss", loss, prog_bar=True, sync_dist=True)
+            self.val_metrics.update(preds, masks)
             return loss
         except Exception as e:
             raise SegformerLitException(
                 f"Validation step, batch {batch_idx}: {str(e)}"
             ) from e
 
+    def on_train_epoch_start(self) -> None:
+        dataset = getattr(self.trainer.train_dataloader, "dataset", None)
+        if hasattr(dataset, "set_epoch"):
+            dataset.set_epoch(self.current_epoch)
+
+    def _log_scores(self, prefix: str, metric: ConfusionMatrixMetric) -> dict:
+        scores = metric.compute()  # synced across processes once, here
+        metric.reset()
+        self.log(f"{prefix}_acc", scores["pixel_acc"].float(), prog_bar=True)
+        self.log(f"{prefix}_mean_iou", scores["mean_iou"].float(), prog_bar=True)
+        return scores
+
     def on_train_epoch_end(self) -> None:
+        self._log_scores("train", self.train_metrics)
         logger.info(f"Epoch {self.current_epoch} finished.")
 
+    def on_validation_end(self) -> None:
+        # Runs after the callbacks' hooks (including checkpoint saving), so
+        # neither counts towards the next training step's time.
+        if self.step_timer is not None:
+            self.step_timer.restart_clock()
+
+    def on_validation_epoch_end(self) -> None:
+        scores = self._log_scores("val", self.val_metrics)
+        logger.info(
+            f"Epoch {self.current_epoch}, step {self.global_step} validation: "
+            f"mIoU {scores['mean_iou'].item():.4f}, "
+            f"pixel acc {scores['pixel_acc'].item():.4f}"
+        )
+
     def configure_optimizers(self):
-        optimizer = torch.optim.Adam(
+        hparams = {
+            "lr": self.config.learning_rate,
+            "weight_decay": self.config.weight_decay,
+        }
+        if self.config.optimizer == "SGD":
+            hparams["momentum"] = self.config.betas[0]
+        else:
+            hparams["betas"] = tuple(self.config.betas)
+        optimizer = build_optimizer(
             self.model.parameters(),
-            lr=self.config.learning_rate,
-            weight_decay=self.config.weight_decay,
-            betas=self.config.betas,
+            name=self.config.optimizer,
+            implementation=self.config.optimizer_implementation,
+            **hparams,
+        )
+        # Total optimizer steps: max_steps in iteration-based training,
+        # otherwise derived from max_epochs, loader length and accumulation.
+        scheduler = build_scheduler(
+            optimizer,
+            self.config.scheduler,
+            total_steps=self.trainer.estimated_stepping_batches,
+            power=self.config.poly_power,
+            eta_min=self.config.min_lr,
+            warmup_steps=self.config.warmup_steps,
         )
-        return optimizer
+        if scheduler is None:
+            return optimizer
+        return {
+            "optimizer": optimizer,
+            "lr_scheduler": {"scheduler": scheduler, "interval": "step"},
+        }
@@ -0,0 +1,163 @@
+import warnings
+
+warnings.filterwarnings("ignore")
+
+import argparse
+import logging
+import sys
+import tempfile
+
+import torch
+from omegaconf import OmegaConf
+from pytorch_lightning import Callback
+from torch.utils.data import Dataset
+from transformers import SegformerConfig, SegformerForSemanticSegmentation
+
+from logger.sem_seg import setup_logger
+from models.lit_wrappers import SegformerLitWrapper
+from models.lit_wrappers.segformer_wrapper import SegformerLitConfig
+from training.engine import build_dataloader, build_trainer
+from training.metrics import confusion_matrix_update, scores_from_confusion_matrix
+from training.samplers import UnpaddedDistributedSampler
+
+NUM_CLASSES = 5
+IMAGE_SIZE = 64
+
+argparser = argparse.ArgumentParser(
+    description=(
+        "Multi-process CPU DDP smoke check: trains a tiny Segformer on synthetic "
+        "data with gloo and verifies sampling and metric reduction across ranks"
+    )
+)
+argparser.add_argument("--processes", type=int, default=2, help="Local DDP processes")
+argparser.add_argument("--samples", type=int, default=11, help="Validation samples")
+
+
+class SyntheticSegDataset(Dataset):
+    """Deterministic random images and masks, identical in every process."""
+
+    def __init__(self, num_samples: int):
+        self.num_samples = num_samples
+
+    def __len__(self) -> int:
+        return self.num_samples
+
+    def __getitem__(self, idx: int):
+        generator = torch.Generator().manual_seed(idx)
+        image = torch.randn(3, IMAGE_SIZE, IMAGE_SIZE, generator=generator)
+        mask = torch.randint(
+            0, NUM_CLASSES, (IMAGE_SIZE, IMAGE_SIZE), generator=generator
+        )
+        return image, mask.to(torch.uint8)
+
+
+class PixelCountCheck(Callback):
+    r"""
+    Sums the validation confusion matrices over ranks before the wrapper
+    resets them and checks that every pixel was counted exactly once.
+    """
+
+    def __init__(self, expected_pixels: int):
+        self.expected_pixels = expected_pixels
+        self.counted_pixels = None
+
+    def on_validation_epoch_end(self, trainer, pl_module) -> None:
+        local = pl_module.val_metrics.confmat.sum()
+        self.counted_pixels = int(trainer.strategy.reduce(local, reduce_op="sum"))
+
+
+def tiny_segformer() -> SegformerForSemanticSegmentation:
+    torch.manual_seed(0)
+    config = SegformerConfig(
+        num_labels=NUM_CLASSES,
+        depths=[1, 1, 1, 1],
+        hidden_sizes=[8, 16, 24, 32],
+        num_attention_heads=[1, 1, 1, 1],
+        decoder_hidden_size=32,
+    )
+    return SegformerForSemanticSegmentation(config)
+
+
+def main() -> int:
+    args = argparser.parse_args()
+    setup_logger(None, logging.WARNING)
+
+    trainer_cfg = OmegaConf.create(
+        {
+            "accelerator": "cpu",
+            "devices": args.processes,
+            "strategy": "ddp",
+            "ddp": {"process_group_backend": "gloo"},
+            "precision": "32-true",
+            "max_epochs": 1,
+            "limit_train_batches": 2,
+            "num_sanity_val_steps": 0,
+            "enable_checkpointing": False,
+            "enable_progress_bar": False,
+            "enable_model_summary": False,
+            "default_root_dir": tempfile.mkdtemp(prefix="ddp_smoke_"),
+        }
+    )
+    loader_cfg = {"batch_size": 2, "num_workers": 0}
+    train_set = SyntheticSegDataset(8)
+    val_set = SyntheticSegDataset(args.samples)
+
+    lit_model = SegformerLitWrapper(
+        model=tiny_segformer(),
+        config=SegformerLitConfig(
+            num_classes=NUM_CLASSES,
+            ignore_index=255,
+            learning_rate=1e-3,
+            weight_decay=0.0,
+        ),
+    )
+    pixel_check = PixelCountCheck(args.samples * IMAGE_SIZE * IMAGE_SIZE)
+    trainer = build_trainer(trainer_cfg, callbacks=[pixel_check])
+    trainer.fit(
+        lit_model,
+        train_dataloaders=build_dataloader(train_set, {**loader_cfg, "shuffle": True}),
+    )
+    (results,) = trainer.validate(
+        lit_model,
+        dataloaders=build_dataloader(
+            val_set, loader_cfg, sampler=UnpaddedDistributedSampler(val_set)
+        ),
+        verbose=False,
+    )
+    if trainer.global_rank != 0:
+        return 0
+
+    # Reference: the same (DDP-synchronized) weights on the full set, one process.
+    confmat = torch.zeros(NUM_CLASSES, NUM_CLASSES, dtype=torch.long)
+    model = lit_model.model.eval()
+    with torch.inference_mode():
+        for idx in range(len(val_set)):
+            image, mask = val_set[idx]
+            logits = model(image[None]).logits
+            _, preds, target = lit_model.criterion(logits, mask[None].long())
+            confmat += confusion_matrix_update(preds, target, NUM_CLASSES, 255)
+    expected_miou = scores_from_confusion_matrix(confmat)["mean_iou"].item()
+
+    failures = []
+    if pixel_check.counted_pixels != pixel_check.expected_pixels:
+        failures.append(
+            f"validation counted {pixel_check.counted_pixels} pixels across ranks, "
+            f"expected {pixel_check.expected_pixels}"
+        )
+    if abs(results["val_mean_iou"] - expected_miou) > 1e-6:
+        failures.append(
+            f"DDP val_mean_iou {results['val_mean_iou']:.6f} != "
+            f"single-process {expected_miou:.6f}"
+        )
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if not failures:
+        print(
+            f"OK: {args.processes} processes, val_mean_iou "
+            f"{results['val_mean_iou']:.6f} matches single-process evaluation"
+        )
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
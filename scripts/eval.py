@@ -1 +1,60 @@
-# Auto-generated file by template.py
+import traceback
+import warnings
+
+warnings.filterwarnings("ignore")
+
+import argparse
+import logging
+from pathlib import Path
+
+from omegaconf import DictConfig, OmegaConf
+
+from logger.sem_seg import setup_logger
+from utils.constants import PROJECT_ROOT
+
+argparser = argparse.ArgumentParser(description="Evaluation Script")
+argparser.add_argument(
+    "--variants", nargs="+", help="Segformer variants to evaluate, e.g. b0 b2 b5"
+)
+argparser.add_argument(
+    "--checkpoint", help="Lightning .ckpt or .safetensors weights to evaluate"
+)
+argparser.add_argument(
+    "--tta",
+    help="Enable multi-scale + flip test-time augmentation",
+    action="store_true",
+)
+argparser.add_argument(
+    "--full_tb",
+    help="Whether to print full traceback on error",
+    default=False,
+    action="store_true",
+)
+
+
+def main(cfg: DictConfig) -> None:
+    try:
+        args = argparser.parse_args()
+
+        setup_logger(None, logging.INFO)
+
+        # Imported after argument parsing so that --help does not load torch.
+        from training.evaluate import run_evaluation
+
+        if args.checkpoint:
+            cfg.eval.checkpoint = args.checkpoint
+        if args.tta:
+            cfg.eval.tta.enabled = True
+
+        for variant in args.variants or cfg.eval.variants:
+            run_evaluation(cfg, variant)
+    except Exception as e:
+        if args.full_tb:
+            logging.error(traceback.format_exc())
+        else:
+            logging.error(f"{str(e)}")
+
+
+if __name__ == "__main__":
+    cfg = OmegaConf.load(Path(f"{PROJECT_ROOT}/configs/eval.yaml").resolve())
+    main(cfg)
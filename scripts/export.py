@@ -1 +1,142 @@
-# Auto-generated file by template.py
+import traceback
+import warnings
+
+warnings.filterwarnings("ignore")
+
+import argparse
+import json
+import logging
+import os
+from pathlib import Path
+
+from omegaconf import DictConfig, OmegaConf
+
+from exceptions import InferenceException
+from logger.sem_seg import setup_logger
+from utils.constants import PROJECT_ROOT
+
+argparser = argparse.ArgumentParser(
+    description="Export Segformer to TorchScript / ONNX and compare with eager mode"
+)
+argparser.add_argument(
+    "--variants", nargs="+", default=["b0"], help="Segformer variants to export"
+)
+argparser.add_argument(
+    "--checkpoint", help="Lightning .ckpt or .safetensors weights to export"
+)
+argparser.add_argument(
+    "--formats",
+    nargs="+",
+    choices=["torchscript", "onnx"],
+    default=["torchscript", "onnx"],
+    help="Export formats",
+)
+argparser.add_argument(
+    "--output", help="Output root directory, defaults to paths.exported_models"
+)
+argparser.add_argument("--opset", type=int, default=17, help="ONNX opset version")
+argparser.add_argument(
+    "--atol", type=float, default=1e-3, help="Largest allowed logit difference"
+)
+argparser.add_argument(
+    "--iterations", type=int, default=20, help="Timed forward passes per backend"
+)
+argparser.add_argument(
+    "--full_tb",
+    help="Whether to print full traceback on error",
+    default=False,
+    action="store_true",
+)
+
+
+def export_variant(cfg: DictConfig, variant: str, args) -> dict:
+    import torch
+
+    from datasets.transforms import SegformerTransform
+    from inference.export import (
+        check_parity,
+        export_onnx,
+        export_torchscript,
+        measure_latency,
+        save_runtime_metadata,
+    )
+    from inference.runtime import MODEL_FILES, load_exported
+    from utils.model_utils import load_segformer
+
+    variant_cfg = cfg.models.segformer.variant[variant]
+    size = int(variant_cfg.get("image_size", 512))
+    output_dir = os.path.join(
+        args.output or os.path.join(PROJECT_ROOT, cfg.paths.exported_models), variant
+    )
+    os.makedirs(output_dir, exist_ok=True)
+
+    transform = SegformerTransform.from_pretrained(variant_cfg.huggingface_name)
+    model = load_segformer(variant_cfg.huggingface_name, args.checkpoint)
+    save_runtime_metadata(output_dir, transform, model)
+
+    torch.manual_seed(0)
+    example = torch.randn(1, 3, size, size)
+    # A second batch size and aspect ratio exercises the dynamic axes.
+    parity_inputs = [example, torch.randn(2, 3, size * 3 // 4, size)]
+
+    report = {
+        "variant": variant,
+        "checkpoint": args.checkpoint,
+        "input_size": size,
+        "latency": {
+            "eager": measure_latency(model, example, iterations=args.iterations)
+        },
+        "parity": {},
+    }
+    for fmt in args.formats:
+        path = os.path.join(output_dir, MODEL_FILES[fmt])
+        if fmt == "onnx":
+            export_onnx(model, path, example, opset_version=args.opset)
+        else:
+            export_torchscript(model, path, example)
+
+        _, exported = load_exported(output_dir, fmt)
+        parity = check_parity(model, exported, parity_inputs)
+        parity["passed"] = parity["max_abs_diff"] <= args.atol
+        report["parity"][fmt] = parity
+        report["latency"][fmt] = measure_latency(
+            exported, example, iterations=args.iterations
+        )
+        latency = report["latency"]
+        speedup = latency["eager"]["p50_ms"] / latency[fmt]["p50_ms"]
+        logging.info(
+            f"{variant} {fmt}: max |diff| {parity['max_abs_diff']:.2e}, "
+            f"label agreement {parity['label_agreement']:.4%}, "
+            f"p50 {latency[fmt]['p50_ms']:.1f} ms ({speedup:.2f}x eager)"
+        )
+
+    with open(os.path.join(output_dir, "export_report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+
+    failed = [fmt for fmt, parity in report["parity"].items() if not parity["passed"]]
+    if failed:
+        raise InferenceException(
+            f"Exported {variant} models {failed} differ from eager mode by more "
+            f"than {args.atol}, see {output_dir}/export_report.json"
+        )
+    return report
+
+
+def main(cfg: DictConfig) -> None:
+    try:
+        args = argparser.parse_args()
+
+        setup_logger(None, logging.INFO)
+
+        for variant in args.variants:
+            export_variant(cfg, variant, args)
+    except Exception as e:
+        if args.full_tb:
+            logging.error(traceback.format_exc())
+        else:
+            logging.error(f"{str(e)}")
+
+
+if __name__ == "__main__":
+    cfg = OmegaConf.load(Path(f"{PROJECT_ROOT}/configs/infer.yaml").resolve())
+    main(cfg)
@@ -0,0 +1,140 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence
+
+from utils.constants import PROJECT_ROOT
+
+# Never needed to serve predictions; importing any of them on the inference
+# path costs seconds of startup per worker.
+TRAINING_ONLY = ("pytorch_lightning", "lightning", "torchmetrics", "sympy")
+
+
+@dataclass
+class ImportCheck:
+    name: str
+    argv: List[str]
+    budget_ms: float
+    forbidden: Sequence[str] = field(default_factory=tuple)
+
+
+CHECKS = [
+    ImportCheck(
+        "scripts/infer.py --help",
+        ["scripts/infer.py", "--help"],
+        budget_ms=500,
+        forbidden=("torch", "transformers") + TRAINING_ONLY,
+    ),
+    ImportCheck(
+        "scripts/eval.py --help",
+        ["scripts/eval.py", "--help"],
+        budget_ms=500,
+        forbidden=("torch", "transformers") + TRAINING_ONLY,
+    ),
+    ImportCheck(
+        "import inference",
+        ["-c", "import inference"],
+        budget_ms=200,
+        forbidden=("torch", "transformers") + TRAINING_ONLY,
+    ),
+    ImportCheck(
+        "from inference import run_inference",
+        ["-c", "from inference import run_inference"],
+        budget_ms=3000,
+        forbidden=("transformers",) + TRAINING_ONLY,
+    ),
+    ImportCheck(
+        "import api.main",
+        ["-c", "import api.main"],
+        budget_ms=4000,
+        forbidden=("transformers",) + TRAINING_ONLY,
+    ),
+]
+
+
+def parse_importtime(stderr: str) -> List[tuple]:
+    r"""
+    Parses ``python -X importtime`` output.
+
+    Returns:
+        List[tuple]: ``(depth, module, cumulative_ms)`` per imported module, in
+        report order; ``depth`` 0 marks imports triggered directly by the command.
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, module = line[len("import time:") :].split("|", 2)
+        depth = (len(module) - len(module.lstrip()) - 1) // 2
+        entries.append((depth, module.strip(), int(cumulative_us) / 1000))
+    return entries
+
+
+def run_check(check: ImportCheck, python: str = sys.executable) -> dict:
+    env = {**os.environ, "PYTHONPATH": PROJECT_ROOT}
+    result = subprocess.run(
+        [python, "-X", "importtime", *check.argv],
+        cwd=PROJECT_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    entries = parse_importtime(result.stderr)
+    total_ms = sum(ms for depth, _, ms in entries if depth == 0)
+    imported = {module.split(".")[0] for _, module, _ in entries}
+    violations = sorted(imported.intersection(check.forbidden))
+    slowest = sorted(
+        (entry for entry in entries if entry[0] == 0), key=lambda e: e[2], reverse=True
+    )
+    return {
+        "name": check.name,
+        "total_ms": round(total_ms, 1),
+        "budget_ms": check.budget_ms,
+        "forbidden_imports": violations,
+        "slowest": [{"module": m, "ms": round(ms, 1)} for _, m, ms in slowest[:10]],
+        "returncode": result.returncode,
+        "passed": result.returncode == 0
+        and total_ms <= check.budget_ms
+        and not violations,
+    }
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    argparser = argparse.ArgumentParser(
+        description="Profile import time of the entry points (python -X importtime)"
+    )
+    argparser.add_argument(
+        "--budget_scale",
+        type=float,
+        default=1.0,
+        help="Multiply every budget, e.g. 2.0 on slow CI machines",
+    )
+    argparser.add_argument("--output", help="Write the report as JSON to this path")
+    args = argparser.parse_args(argv)
+
+    reports = []
+    for check in CHECKS:
+        check.budget_ms *= args.budget_scale
+        report = run_check(check)
+        reports.append(report)
+        status = "ok" if report["passed"] else "FAIL"
+        print(
+            f"[{status}] {report['name']}: {report['total_ms']:.0f} ms "
+            f"(budget {report['budget_ms']:.0f} ms)"
+        )
+        if report["forbidden_imports"]:
+            print(f"    forbidden imports: {', '.join(report['forbidden_imports'])}")
+        for entry in report["slowest"][:5]:
+            print(f"    {entry['ms']:8.1f} ms  {entry['module']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(reports, f, indent=2)
+    return 0 if all(report["passed"] for report in reports) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
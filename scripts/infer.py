@@ -9,10 +9,8 @@ import os
 from pathlib import Path
 import argparse
 
-from hydra.core import hydra_config
 from omegaconf import DictConfig, OmegaConf
 
-from inference import run_inference
 from logger.sem_seg import setup_logger
 from utils.constants import PROJECT_ROOT
 
@@ -31,6 +29,9 @@ def main(cfg: DictConfig) -> None:
 
         setup_logger(None, logging.INFO)
 
+        # Imported after argument parsing so that --help does not load torch.
+        from inference import run_inference
+
         inference_input_dir = os.path.join(
             f"{PROJECT_ROOT}", cfg.paths.inference_inputs
         )
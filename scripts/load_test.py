@@ -0,0 +1,77 @@
+import argparse
+import json
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from utils.constants import PROJECT_ROOT
+
+argparser = argparse.ArgumentParser(description="Load test for the segmentation API")
+argparser.add_argument("--url", default="http://127.0.0.1:8000/segment")
+argparser.add_argument("--image", default=f"{PROJECT_ROOT}/image.png")
+argparser.add_argument("--concurrency", type=int, default=16)
+argparser.add_argument("--requests", type=int, default=200)
+
+
+def _multipart(path: Path) -> tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    head = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="image"; filename="{path.name}"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode()
+    body = head + path.read_bytes() + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def _send(url: str, body: bytes, content_type: str) -> tuple[int, float]:
+    request = urllib.request.Request(
+        url, data=body, headers={"Content-Type": content_type}, method="POST"
+    )
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return status, time.perf_counter() - start
+
+
+def main() -> None:
+    args = argparser.parse_args()
+    body, content_type = _multipart(Path(args.image))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(
+            executor.map(
+                lambda _: _send(args.url, body, content_type), range(args.requests)
+            )
+        )
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([latency for status, latency in results if status == 200])
+    statuses: dict[int, int] = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+
+    report = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "statuses": statuses,
+        "throughput_rps": len(latencies) / elapsed,
+    }
+    if len(latencies):
+        for p in (50, 90, 99):
+            report[f"latency_p{p}_ms"] = float(np.percentile(latencies, p) * 1000)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
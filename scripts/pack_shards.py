@@ -0,0 +1,45 @@
+import argparse
+import logging
+import os
+from pathlib import Path
+
+from omegaconf import OmegaConf
+
+from logger.sem_seg import setup_logger
+from utils.constants import PROJECT_ROOT
+
+argparser = argparse.ArgumentParser(
+    description="Pack ADE20K image/mask pairs into record shards"
+)
+argparser.add_argument("--split", choices=["train", "val"], default="train")
+argparser.add_argument(
+    "--output", help="Output directory, defaults to paths.<split>_shards"
+)
+argparser.add_argument(
+    "--max_shard_mb", type=int, default=1024, help="Approximate size of one shard"
+)
+
+
+def main() -> None:
+    args = argparser.parse_args()
+    setup_logger(None, logging.INFO)
+
+    from datasets.shards import pack_shards
+
+    cfg = OmegaConf.load(Path(f"{PROJECT_ROOT}/configs/train.yaml").resolve())
+
+    root = os.path.join(PROJECT_ROOT, cfg.paths.dataset_root)
+    img_dir = os.path.join(root, cfg.paths[f"{args.split}_images"])
+    mask_dir = os.path.join(root, cfg.paths[f"{args.split}_masks"])
+    output = args.output or os.path.join(root, cfg.paths[f"{args.split}_shards"])
+
+    pack_shards(
+        [os.path.join(img_dir, name) for name in sorted(os.listdir(img_dir))],
+        [os.path.join(mask_dir, name) for name in sorted(os.listdir(mask_dir))],
+        output,
+        max_shard_bytes=args.max_shard_mb * 1024**2,
+    )
+
+
+if __name__ == "__main__":
+    main()
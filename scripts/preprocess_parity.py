@@ -0,0 +1,69 @@
+import warnings
+
+warnings.filterwarnings("ignore")
+
+import argparse
+import sys
+from typing import List, Optional, Sequence
+
+import numpy as np
+from PIL import Image
+from transformers import SegformerImageProcessor
+
+from datasets.preprocess import FastSegformerPreprocessor
+from exceptions import DataTransformException
+
+# Odd, non-square and already-target sizes exercise every resize path.
+SYNTHETIC_SIZES = [(512, 512), (375, 500), (683, 1024), (97, 61)]
+
+argparser = argparse.ArgumentParser(
+    description=(
+        "Checks that FastSegformerPreprocessor matches the Hugging Face "
+        "SegformerImageProcessor on sample images"
+    )
+)
+argparser.add_argument(
+    "--huggingface_name",
+    nargs="+",
+    default=["nvidia/segformer-b0-finetuned-ade-512-512"],
+    help="Processor configs to check, e.g. the variants' huggingface_name",
+)
+argparser.add_argument(
+    "--images", nargs="*", default=[], help="Image files to check in addition"
+)
+argparser.add_argument(
+    "--synthetic", type=int, default=2, help="Random images per synthetic size"
+)
+argparser.add_argument("--atol", type=float, default=1e-4, help="Tolerance")
+
+
+def sample_images(paths: Sequence[str], per_size: int) -> List[Image.Image]:
+    rng = np.random.default_rng(0)
+    images = [Image.open(path).convert("RGB") for path in paths]
+    for height, width in SYNTHETIC_SIZES:
+        for _ in range(per_size):
+            pixels = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+            images.append(Image.fromarray(pixels))
+    return images
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = argparser.parse_args(argv)
+    images = sample_images(args.images, args.synthetic)
+
+    failures = 0
+    for name in args.huggingface_name:
+        processor = SegformerImageProcessor.from_pretrained(name)
+        fast = FastSegformerPreprocessor.from_config(processor.to_dict())
+        try:
+            max_diff = fast.check_parity(processor, images, atol=args.atol)
+        except DataTransformException as e:
+            failures += 1
+            print(f"[FAIL] {name}: {str(e)}")
+            continue
+        print(f"[ok] {name}: {len(images)} images, max abs diff {max_diff:.2e}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
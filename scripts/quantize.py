@@ -0,0 +1,182 @@
+import traceback
+import warnings
+
+warnings.filterwarnings("ignore")
+
+import argparse
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+from omegaconf import DictConfig, OmegaConf
+
+from logger.sem_seg import setup_logger
+from utils.constants import PROJECT_ROOT
+
+argparser = argparse.ArgumentParser(
+    description="Post-training int8 quantization of Segformer for CPU inference"
+)
+argparser.add_argument(
+    "--variants", nargs="+", help="Segformer variants to quantize, e.g. b0 b2"
+)
+argparser.add_argument(
+    "--checkpoint", help="Lightning .ckpt or .safetensors weights to quantize"
+)
+argparser.add_argument(
+    "--modes", nargs="+", choices=["dynamic", "static"], help="Quantization modes"
+)
+argparser.add_argument(
+    "--output", help="Output root directory, defaults to paths.exported_models"
+)
+argparser.add_argument(
+    "--full_tb",
+    help="Whether to print full traceback on error",
+    default=False,
+    action="store_true",
+)
+
+
+def evaluate(model, loader, num_classes: int, ignore_index: int) -> dict:
+    """mIoU, pixel accuracy and throughput (first batch excluded) on ``loader``."""
+    import torch
+
+    from training.evaluate import predict_logits
+    from training.metrics import confusion_matrix_update, scores_from_confusion_matrix
+
+    confmat = torch.zeros(num_classes, num_classes, dtype=torch.long)
+    elapsed, num_images = 0.0, 0
+    with torch.inference_mode():
+        for batch_idx, (images, masks) in enumerate(loader):
+            start = time.perf_counter()
+            preds = predict_logits(model, images, masks.shape[-2:]).argmax(dim=1)
+            if batch_idx > 0:
+                elapsed += time.perf_counter() - start
+                num_images += images.shape[0]
+            confmat += confusion_matrix_update(preds, masks, num_classes, ignore_index)
+    scores = scores_from_confusion_matrix(confmat)
+    return {
+        "mean_iou": scores["mean_iou"].item(),
+        "pixel_acc": scores["pixel_acc"].item(),
+        "images_per_s": num_images / elapsed if elapsed > 0 else None,
+    }
+
+
+def quantize_variant(cfg: DictConfig, variant: str, args) -> dict:
+    import torch
+    from torch.utils.data import DataLoader, Subset
+
+    from datasets.segformer_dataset import ADE20KDataset
+    from datasets.transforms import SegformerTransform
+    from inference.export import export_torchscript, save_runtime_metadata
+    from inference.quantization import (
+        quantize_dynamic_int8,
+        quantize_static_int8,
+        select_quantized_engine,
+    )
+    from inference.runtime import model_filename
+    from training.engine import build_dataset
+    from utils.model_utils import load_segformer
+
+    quant_cfg = cfg.quantization
+    huggingface_name = cfg.models.segformer.variant[variant].huggingface_name
+    size = int(cfg.models.segformer.variant[variant].get("image_size", 512))
+    output_dir = os.path.join(
+        args.output or os.path.join(PROJECT_ROOT, cfg.paths.exported_models), variant
+    )
+    os.makedirs(output_dir, exist_ok=True)
+
+    transform = SegformerTransform.from_pretrained(huggingface_name)
+    model = load_segformer(huggingface_name, args.checkpoint)
+    save_runtime_metadata(output_dir, transform, model)
+
+    loader_kwargs = {
+        "batch_size": int(quant_cfg.get("calibration_batch_size", 8)),
+        "num_workers": int(cfg.dataloader.val.get("num_workers", 0)),
+    }
+    train_set = ADE20KDataset(
+        root=os.path.join(PROJECT_ROOT, cfg.paths.dataset_root),
+        img_dir=cfg.paths.train_images,
+        mask_dir=cfg.paths.train_masks,
+        transforms=transform,
+    )
+    generator = torch.Generator().manual_seed(int(quant_cfg.get("seed", 0)))
+    calibration_indices = torch.randperm(len(train_set), generator=generator)
+    calibration_indices = calibration_indices[
+        : int(quant_cfg.get("calibration_samples", 32))
+    ].tolist()
+    calibration_loader = DataLoader(
+        Subset(train_set, calibration_indices), **loader_kwargs
+    )
+
+    val_set = build_dataset(cfg, "val", transform)
+    num_eval = min(len(val_set), int(quant_cfg.get("eval_samples", 200)))
+    eval_loader = DataLoader(Subset(val_set, range(num_eval)), **loader_kwargs)
+    num_classes, ignore_index = cfg.dataset.num_classes, cfg.dataset.ignore_index
+
+    fp32 = evaluate(model, eval_loader, num_classes, ignore_index)
+    logging.info(
+        f"{variant} fp32: mIoU {fp32['mean_iou']:.4f}, "
+        f"{fp32['images_per_s'] or 0:.2f} images/s"
+    )
+    report = {
+        "variant": variant,
+        "checkpoint": args.checkpoint,
+        "engine": select_quantized_engine(),
+        "calibration_samples": len(calibration_indices),
+        "eval_samples": num_eval,
+        "fp32": fp32,
+    }
+
+    example = torch.randn(1, 3, size, size)
+    for mode in args.modes or quant_cfg.get("modes", ["dynamic", "static"]):
+        if mode == "dynamic":
+            quantized = quantize_dynamic_int8(model)
+        else:
+            quantized = quantize_static_int8(
+                model,
+                (images for images, _ in calibration_loader),
+                exclude=list(quant_cfg.get("exclude", [])),
+            )
+        result = evaluate(quantized, eval_loader, num_classes, ignore_index)
+        result["mean_iou_delta"] = result["mean_iou"] - fp32["mean_iou"]
+        result["speedup"] = (
+            result["images_per_s"] / fp32["images_per_s"]
+            if result["images_per_s"] and fp32["images_per_s"]
+            else None
+        )
+        path = os.path.join(output_dir, model_filename("torchscript", mode))
+        export_torchscript(quantized, path, example)
+        result["path"] = path
+        report[mode] = result
+        logging.info(
+            f"{variant} int8 {mode}: mIoU {result['mean_iou']:.4f} "
+            f"({result['mean_iou_delta']:+.4f}), {result['speedup'] or 0:.2f}x fp32"
+        )
+
+    report_path = os.path.join(output_dir, "quantization_report.json")
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    logging.info(f"Saved quantization report to: {report_path}")
+    return report
+
+
+def main(cfg: DictConfig) -> None:
+    try:
+        args = argparser.parse_args()
+
+        setup_logger(None, logging.INFO)
+
+        for variant in args.variants or cfg.eval.variants:
+            quantize_variant(cfg, variant, args)
+    except Exception as e:
+        if args.full_tb:
+            logging.error(traceback.format_exc())
+        else:
+            logging.error(f"{str(e)}")
+
+
+if __name__ == "__main__":
+    cfg = OmegaConf.load(Path(f"{PROJECT_ROOT}/configs/eval.yaml").resolve())
+    main(cfg)
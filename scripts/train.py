@@ -11,7 +11,6 @@ from hydra.core import hydra_config
 from omegaconf import DictConfig
 
 from logger.sem_seg import setup_logger
-from training.engine import run_training
 from utils.constants import PROJECT_ROOT
 
 
@@ -24,7 +23,20 @@ def main(cfg: DictConfig) -> None:
     os.makedirs(log_dir, exist_ok=True)
     log_file = f"{log_dir}/{Path(__file__).stem}.log"
 
-    setup_logger(log_file, logging.INFO)
+    # Imported here so that hydra's --help / --cfg do not load Lightning.
+    from pytorch_lightning.utilities.rank_zero import rank_zero_only
+
+    from training.engine import run_training
+
+    # Under DDP every process runs this script; only rank zero writes the log
+    # file and INFO messages, the others report warnings and errors. Before
+    # Lightning sets the global rank, the first process of every node started
+    # by Lightning's launcher reads as rank zero, so the node rank is checked
+    # as well.
+    if rank_zero_only.rank == 0 and int(os.environ.get("NODE_RANK", 0)) == 0:
+        setup_logger(log_file, logging.INFO)
+    else:
+        setup_logger(None, logging.WARNING)
 
     run_training(cfg)
 
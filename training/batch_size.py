@@ -0,0 +1,264 @@
+import logging
+import math
+import os
+import resource
+import sys
+from typing import Optional
+
+import torch
+
+from exceptions import TrainingException
+
+logger = logging.getLogger(__name__)
+
+# Per-parameter state tensors kept by each optimizer (Adam: both moments).
+OPTIMIZER_STATE_TENSORS = {"AdamW": 2, "Adam": 2, "SGD": 1}
+
+
+def device_memory_bytes(device: torch.device) -> int:
+    r"""
+    Memory available to this process on ``device``: the GPU's total memory,
+    or on CPU the cgroup limit (containers) or else the physical memory.
+    """
+    if device.type == "cuda":
+        return torch.cuda.get_device_properties(device).total_memory
+    physical = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    for limit_file in (
+        "/sys/fs/cgroup/memory.max",
+        "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+    ):
+        try:
+            with open(limit_file) as f:
+                limit = f.read().strip()
+        except OSError:
+            continue
+        if limit.isdigit():
+            return min(int(limit), physical)
+    return physical
+
+
+def _reset_peak_memory(device: torch.device) -> None:
+    if device.type == "cuda":
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats(device)
+
+
+def _resident_bytes() -> Optional[int]:
+    """Current resident set size of this process, ``None`` without procfs."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _peak_memory_bytes(device: torch.device) -> int:
+    if device.type == "cuda":
+        return torch.cuda.max_memory_reserved(device)
+    # Process high-water mark; kilobytes on Linux, bytes on macOS.
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def autocast_dtype(precision, device: torch.device) -> Optional[torch.dtype]:
+    """Autocast dtype for a Lightning ``precision`` setting, ``None`` for fp32."""
+    precision = str(precision)
+    if precision.startswith("bf16"):
+        return torch.bfloat16
+    if precision in ("16", "16-mixed") and device.type != "cuda":
+        # Same as Lightning, which only runs float16 mixed precision on GPUs.
+        raise TrainingException(
+            f"precision={precision!r} is not supported on {device.type}, "
+            "use precision='bf16-mixed' instead"
+        )
+    if precision.startswith("16"):
+        return torch.float16
+    return None
+
+
+def _probe(
+    model: torch.nn.Module,
+    criterion: torch.nn.Module,
+    batch_size: int,
+    image_size: tuple,
+    num_classes: int,
+    device: torch.device,
+    optimizer_name: str,
+    dtype: Optional[torch.dtype],
+) -> Optional[int]:
+    """Peak memory of one training step, ``None`` if it ran out of memory."""
+    _reset_peak_memory(device)
+    try:
+        images = torch.randn(batch_size, 3, *image_size, device=device)
+        masks = torch.randint(
+            0, num_classes, (batch_size, *image_size), device=device
+        )
+        # Stand-in for the optimizer state, without touching the weights.
+        optimizer_state = [
+            torch.zeros_like(param)
+            for param in model.parameters()
+            for _ in range(OPTIMIZER_STATE_TENSORS.get(optimizer_name, 2))
+        ]
+        with torch.autocast(device.type, dtype=dtype, enabled=dtype is not None):
+            logits = model(images).logits
+            loss, _, _ = criterion(logits, masks)
+        loss.backward()
+        del images, masks, logits, loss, optimizer_state
+        return _peak_memory_bytes(device)
+    except (torch.cuda.OutOfMemoryError, MemoryError):
+        return None
+    except RuntimeError as e:
+        # The CPU allocator fails with a plain RuntimeError.
+        message = str(e).lower()
+        if "can't allocate memory" in message or "out of memory" in message:
+            return None
+        raise
+    finally:
+        model.zero_grad(set_to_none=True)
+
+
+def find_batch_size(
+    model: torch.nn.Module,
+    criterion: torch.nn.Module,
+    image_size: tuple,
+    num_classes: int,
+    budget_bytes: int,
+    device: torch.device,
+    max_batch_size: int = 64,
+    optimizer_name: str = "AdamW",
+    precision="32-true",
+) -> tuple[int, list[dict]]:
+    r"""
+    Largest training batch size whose peak memory (forward and backward on
+    random inputs, plus the optimizer state) stays within ``budget_bytes``.
+
+    Batch sizes are doubled until the budget is exceeded. On CUDA the peak is
+    reset per probe and the last interval is bisected. On CPU the peak is the
+    process's resident high-water mark, which cannot be reset. Each probe's
+    use is its rise over the resident size before it, and probes that do not
+    raise the high-water mark are left out of the fit. A probe is skipped when
+    a linear fit of the previous ones predicts it over budget (so the host is
+    never pushed into swap or the OOM killer); the size interpolated from
+    that fit is probed once and only returned if it fits. Allocation failures
+    count as not fitting on either device.
+
+    The model's buffers (e.g. BatchNorm statistics), device and train/eval
+    mode are restored afterwards; the weights are never updated.
+
+    Returns:
+        ``(batch_size, probes)`` where ``probes`` lists every measured
+        ``{"batch_size", "peak_bytes", "increase_bytes", "fits"}``, where
+        ``increase_bytes`` (CPU only) is ``None`` for probes that did not
+        raise the process peak.
+    """
+    dtype = autocast_dtype(precision, device)
+    was_training = model.training
+    buffers = {name: buf.clone() for name, buf in model.named_buffers()}
+    source_device = next(model.parameters()).device
+    model.to(device).train()
+
+    probes = []
+
+    def measure(batch_size: int) -> bool:
+        # On CPU the process peak only moves when a probe exceeds every earlier
+        # allocation, so a probe's own use is its rise over the resident size
+        # right before it, and a probe that leaves the peak unchanged says
+        # nothing about its size.
+        before = _peak_memory_bytes(device) if device.type != "cuda" else None
+        baseline = _resident_bytes() if device.type != "cuda" else None
+        peak = _probe(
+            model,
+            criterion,
+            batch_size,
+            image_size,
+            num_classes,
+            device,
+            optimizer_name,
+            dtype,
+        )
+        measured = peak is not None and (before is None or peak > before)
+        if peak is None:
+            fits = False
+        else:
+            # An unchanged peak is one the process has already sustained.
+            fits = not measured or peak <= budget_bytes
+        probes.append(
+            {
+                "batch_size": batch_size,
+                "peak_bytes": peak,
+                "increase_bytes": (
+                    peak - (baseline if baseline is not None else before)
+                    if measured and before is not None
+                    else None
+                ),
+                "fits": fits,
+            }
+        )
+        logger.info(
+            f"Batch size {batch_size}: peak "
+            f"{'OOM' if peak is None else f'{peak / 2**30:.2f} GiB'}"
+            f"{'' if measured or peak is None else ' (process peak unchanged)'}, "
+            f"budget {budget_bytes / 2**30:.2f} GiB"
+        )
+        return fits
+
+    def linear_fit() -> Optional[tuple[float, float]]:
+        """``(base, per_sample)`` bytes of a probe's rise above the resident size."""
+        fitting = [p for p in probes if p["fits"] and p["increase_bytes"] is not None]
+        if len(fitting) < 2:
+            return None
+        (b1, p1), (b2, p2) = [
+            (p["batch_size"], p["increase_bytes"]) for p in fitting[-2:]
+        ]
+        per_sample = max((p2 - p1) / (b2 - b1), 1.0)
+        return p1 - per_sample * b1, per_sample
+
+    def predicted_peak(batch_size: int, fit: tuple[float, float]) -> float:
+        resident = _resident_bytes() or _peak_memory_bytes(device)
+        return resident + fit[0] + fit[1] * batch_size
+
+    try:
+        fit, fail, size = 0, None, 1
+        while size <= max_batch_size:
+            estimate = linear_fit() if device.type != "cuda" else None
+            if estimate and predicted_peak(size, estimate) > budget_bytes:
+                fail = size
+                break
+            if not measure(size):
+                fail = size
+                break
+            fit = size
+            if size == max_batch_size:
+                break
+            size = min(size * 2, max_batch_size)
+
+        if fit == 0:
+            raise TrainingException(
+                f"Batch size 1 at {tuple(image_size)} does not fit the memory "
+                f"budget of {budget_bytes / 2**30:.2f} GiB"
+            )
+        if fail is not None and device.type == "cuda":
+            while fail - fit > 1:
+                mid = (fit + fail) // 2
+                if measure(mid):
+                    fit = mid
+                else:
+                    fail = mid
+        elif fail is not None and linear_fit() is not None:
+            # Only a measured size is returned: the interpolated one is probed
+            # once, as it is predicted to stay within the budget.
+            base, per_sample = linear_fit()
+            resident = _resident_bytes() or _peak_memory_bytes(device)
+            estimate = math.floor((budget_bytes - resident - base) / per_sample)
+            candidate = min(estimate, fail - 1)
+            if candidate > fit and measure(candidate):
+                fit = candidate
+    finally:
+        model.zero_grad(set_to_none=True)
+        with torch.no_grad():
+            for name, buf in model.named_buffers():
+                buf.copy_(buffers[name])
+        model.to(source_device).train(was_training)
+        _reset_peak_memory(device)
+
+    return fit, probes
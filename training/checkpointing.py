@@ -0,0 +1,346 @@
+import logging
+import os
+import random
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Optional
+
+import numpy as np
+import pytorch_lightning as pl
+import torch
+import torch.distributed as dist
+from pytorch_lightning.callbacks import ModelCheckpoint
+from pytorch_lightning.plugins.io import CheckpointIO, TorchCheckpointIO
+
+from exceptions import CheckpointError
+from training.samplers import ResumableSampler
+from utils.constants import PROJECT_ROOT
+
+logger = logging.getLogger(__name__)
+
+
+def _snapshot(obj: Any) -> Any:
+    """Copies every tensor in a nested checkpoint dict to CPU memory."""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return type(obj)((key, _snapshot(value)) for key, value in obj.items())
+    if isinstance(obj, (list, tuple)) and not hasattr(obj, "_fields"):
+        return type(obj)(_snapshot(value) for value in obj)
+    return obj
+
+
+class BackgroundCheckpointIO(CheckpointIO):
+    r"""
+    Writes checkpoints on a background thread.
+
+    Unlike handing the live checkpoint to a thread, every tensor is first
+    copied to CPU on the calling thread, so the next optimizer steps cannot
+    change the weights being serialized. The training loop only waits for
+    that copy; pickling and disk I/O overlap with the following steps.
+
+    Loading or removing a checkpoint waits for pending writes, and a failed
+    write is raised as :class:`CheckpointError` on the next call.
+    """
+
+    def __init__(self, checkpoint_io: Optional[CheckpointIO] = None):
+        self.checkpoint_io = checkpoint_io or TorchCheckpointIO()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="checkpoint-io"
+        )
+        self._pending: list[Future] = []
+
+    def _wait(self) -> None:
+        pending, self._pending = self._pending, []
+        for future in pending:
+            try:
+                future.result()
+            except Exception as e:
+                raise CheckpointError(
+                    f"Background checkpoint save failed: {str(e)}"
+                ) from e
+
+    def save_checkpoint(
+        self, checkpoint: dict, path, storage_options: Optional[Any] = None
+    ) -> None:
+        # Surfaces earlier failures and keeps at most one snapshot in flight.
+        self._wait()
+        snapshot = _snapshot(checkpoint)
+        self._pending.append(
+            self._executor.submit(
+                self.checkpoint_io.save_checkpoint, snapshot, path, storage_options
+            )
+        )
+
+    def load_checkpoint(self, path, map_location: Optional[Any] = None) -> dict:
+        self._wait()
+        return self.checkpoint_io.load_checkpoint(path, map_location=map_location)
+
+    def remove_checkpoint(self, path) -> None:
+        self._wait()
+        self.checkpoint_io.remove_checkpoint(path)
+
+    def teardown(self) -> None:
+        try:
+            self._wait()
+        finally:
+            self._executor.shutdown(wait=True)
+            self.checkpoint_io.teardown()
+
+
+def collect_rng_states() -> dict:
+    """Python, NumPy and torch (CPU and every visible CUDA device) RNG states."""
+    states = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        states["cuda"] = torch.cuda.get_rng_state_all()
+    return states
+
+
+def set_rng_states(states: dict) -> None:
+    random.setstate(states["python"])
+    np.random.set_state(states["numpy"])
+    torch.set_rng_state(states["torch"])
+    if "cuda" in states and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(states["cuda"])
+
+
+class ResumeStateCallback(pl.Callback):
+    r"""
+    Stores what Lightning's checkpoint leaves out for an exact mid-epoch
+    resume: the position of the training sampler in the current epoch and
+    the RNG states of every rank.
+
+    Together with the optimizer, scheduler and loop state saved by Lightning,
+    resuming continues with the same samples in the same order and the same
+    random draws in the main process (including batched on-device
+    augmentation). Augmentation inside DataLoader workers is reseeded per
+    worker and does not replay the interrupted epoch bit for bit.
+
+    Args:
+        sampler (ResumableSampler): Sampler of the training loader, or ``None``
+            for iterable datasets (only RNG states are then restored).
+    """
+
+    def __init__(self, sampler: Optional[ResumableSampler] = None):
+        self.sampler = sampler
+        self._trainer: Optional[pl.Trainer] = None
+
+    def setup(self, trainer: pl.Trainer, pl_module, stage: str) -> None:
+        self._trainer = trainer
+
+    def state_dict(self) -> dict:
+        # Called on every rank before rank zero writes the checkpoint.
+        rng_states = collect_rng_states()
+        if dist.is_available() and dist.is_initialized():
+            gathered = [None] * dist.get_world_size()
+            dist.all_gather_object(gathered, rng_states)
+        else:
+            gathered = [rng_states]
+        state = {"rng_states": gathered}
+        if self.sampler is not None and self._trainer is not None:
+            loader = self._trainer.train_dataloader
+            completed = (
+                self._trainer.fit_loop.epoch_loop.batch_progress.current.completed
+            )
+            state["sampler"] = {
+                "epoch": self._trainer.current_epoch,
+                "consumed": completed * getattr(loader, "batch_size", 1),
+            }
+        return state
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        rank = dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+        rng_states = state_dict.get("rng_states", [])
+        if rank < len(rng_states):
+            set_rng_states(rng_states[rank])
+        else:
+            logger.warning(
+                f"Checkpoint holds RNG states for {len(rng_states)} processes, "
+                f"not restoring them on rank {rank}"
+            )
+        sampler_state = state_dict.get("sampler")
+        if self.sampler is not None and sampler_state is not None:
+            self.sampler.resume(sampler_state["epoch"], sampler_state["consumed"])
+            logger.info(
+                f"Resuming epoch {sampler_state['epoch']} after "
+                f"{sampler_state['consumed']} samples per process"
+            )
+
+
+class InferenceWeightsCallback(pl.Callback):
+    r"""
+    Whenever the monitored validation metric improves, writes the model's
+    weights (without optimizer state) as ``safetensors`` in ``dtype``, e.g.
+    ``saved_models/segformer-b0.safetensors`` for the predictor to load via
+    the variant's ``weights`` entry. Runs on rank zero, and the file is
+    written on a background thread and swapped in atomically.
+
+    The monitored value is stored in the file's metadata. An existing file
+    is only replaced by a better score than the one it holds, so a new run
+    does not overwrite earlier best weights with worse ones.
+
+    Args:
+        dirpath (str): Output directory.
+        filename (str): Output file name.
+        monitor (str): Logged metric, e.g. ``val_mean_iou``.
+        mode (str): ``max`` or ``min``.
+        dtype (str): Floating point dtype of the saved weights.
+        metadata (dict, optional): String metadata stored in the file header.
+    """
+
+    def __init__(
+        self,
+        dirpath: str,
+        filename: str,
+        monitor: str = "val_mean_iou",
+        mode: str = "max",
+        dtype: str = "float16",
+        metadata: Optional[dict] = None,
+    ):
+        self.path = os.path.join(dirpath, filename)
+        self.monitor = monitor
+        self.mode = mode
+        self.dtype = getattr(torch, dtype)
+        self.metadata = {key: str(value) for key, value in (metadata or {}).items()}
+        self.best: Optional[float] = None
+        self._existing: Optional[float] = None
+        self._existing_read = False
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="weights-export"
+        )
+        self._pending: Optional[Future] = None
+
+    def _better(self, value: float, reference: Optional[float]) -> bool:
+        if reference is None:
+            return True
+        return value > reference if self.mode == "max" else value < reference
+
+    def _existing_score(self) -> Optional[float]:
+        """Monitored value stored in an existing output file, read once."""
+        if not self._existing_read:
+            self._existing_read = True
+            if os.path.exists(self.path):
+                from safetensors import safe_open
+
+                try:
+                    with safe_open(self.path, framework="pt") as f:
+                        value = (f.metadata() or {}).get(self.monitor)
+                    self._existing = float(value) if value is not None else None
+                except Exception as e:
+                    logger.warning(
+                        f"Cannot read {self.monitor} from {self.path}: {str(e)}"
+                    )
+                if self._existing is not None:
+                    logger.info(
+                        f"{self.path} holds {self.monitor} {self._existing:.4f}, "
+                        "replacing it only with a better model"
+                    )
+                else:
+                    logger.warning(
+                        f"{self.path} has no {self.monitor} metadata and will "
+                        "be replaced at the first validation"
+                    )
+        return self._existing
+
+    def _improved(self, value: float) -> bool:
+        return self._better(value, self.best) and self._better(
+            value, self._existing_score()
+        )
+
+    def on_validation_end(self, trainer: pl.Trainer, pl_module) -> None:
+        if trainer.sanity_checking or not trainer.is_global_zero:
+            return
+        value = trainer.callback_metrics.get(self.monitor)
+        if value is None or not self._improved(float(value)):
+            return
+        self.best = float(value)
+
+        state = {
+            key: (
+                tensor.detach().to("cpu", self.dtype)
+                if tensor.is_floating_point()
+                else tensor.detach().cpu()
+            ).contiguous()
+            for key, tensor in pl_module.model.state_dict().items()
+        }
+        metadata = {
+            **self.metadata,
+            self.monitor: f"{self.best:.6f}",
+            "step": str(trainer.global_step),
+        }
+        self._wait()
+        self._pending = self._executor.submit(self._write, state, metadata)
+
+    def _write(self, state: dict, metadata: dict) -> None:
+        from safetensors.torch import save_file
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        save_file(state, tmp_path, metadata=metadata)
+        os.replace(tmp_path, self.path)
+        logger.info(
+            f"Saved inference weights ({metadata[self.monitor]} {self.monitor}, "
+            f"step {metadata['step']}) to {self.path}"
+        )
+
+    def _wait(self) -> None:
+        if self._pending is None:
+            return
+        pending, self._pending = self._pending, None
+        try:
+            pending.result()
+        except Exception as e:
+            raise CheckpointError(f"Saving inference weights failed: {str(e)}") from e
+
+    def teardown(self, trainer: pl.Trainer, pl_module, stage: str) -> None:
+        self._wait()
+
+    def state_dict(self) -> dict:
+        return {"best": self.best}
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        self.best = state_dict.get("best")
+
+
+def build_checkpoint_callbacks(
+    trainer_cfg, sampler: Optional[ResumableSampler] = None, metadata=None
+) -> list[pl.Callback]:
+    r"""
+    Checkpointing callbacks from ``trainer.callbacks``: top-k Lightning
+    checkpoints (``model_checkpoint``), fp16 inference weights
+    (``inference_weights``) and the sampler/RNG state for exact resume.
+    """
+    callbacks_cfg = trainer_cfg.get("callbacks", {})
+    callbacks: list[pl.Callback] = [ResumeStateCallback(sampler)]
+
+    checkpoint_cfg = callbacks_cfg.get("model_checkpoint", None)
+    if checkpoint_cfg is not None and trainer_cfg.get("enable_checkpointing", True):
+        callbacks.append(
+            ModelCheckpoint(
+                dirpath=checkpoint_cfg.get("dirpath", None),
+                filename=checkpoint_cfg.get("filename", None),
+                monitor=checkpoint_cfg.get("monitor", "val_mean_iou"),
+                mode=checkpoint_cfg.get("mode", "max"),
+                save_top_k=checkpoint_cfg.get("save_top_k", 3),
+                save_last=checkpoint_cfg.get("save_last", True),
+            )
+        )
+
+    weights_cfg = callbacks_cfg.get("inference_weights", {})
+    if weights_cfg.get("enabled", False):
+        callbacks.append(
+            InferenceWeightsCallback(
+                dirpath=os.path.join(
+                    PROJECT_ROOT, weights_cfg.get("dirpath", "saved_models")
+                ),
+                filename=weights_cfg.get("filename", "segformer.safetensors"),
+                monitor=weights_cfg.get("monitor", "val_mean_iou"),
+                mode=weights_cfg.get("mode", "max"),
+                dtype=weights_cfg.get("dtype", "float16"),
+                metadata=metadata,
+            )
+        )
+    return callbacks
@@ -0,0 +1,142 @@
+import threading
+from collections import defaultdict, deque
+from typing import Optional, Sequence, Tuple
+
+import torch
+from torch.utils.data import default_collate, get_worker_info
+
+
+class PinnedBufferPool:
+    r"""
+    Reusable page-locked host buffers, keyed by shape and dtype.
+
+    A buffer handed back with ``release`` is only reused once the device copy
+    out of it (recorded as a CUDA event) has finished, so asynchronous
+    host-to-device transfers never read a buffer that is being overwritten.
+
+    Args:
+        max_free (int): Buffers kept per (shape, dtype); extra ones are freed.
+    """
+
+    def __init__(self, max_free: int = 8):
+        self.max_free = max_free
+        self.allocated = 0
+        self._free = defaultdict(deque)
+        self._lock = threading.Lock()
+
+    def acquire(self, shape: Sequence[int], dtype: torch.dtype) -> torch.Tensor:
+        key = (tuple(shape), dtype)
+        with self._lock:
+            entry = self._free[key].popleft() if self._free[key] else None
+            if entry is None:
+                self.allocated += 1
+        if entry is None:
+            return torch.empty(key[0], dtype=dtype, pin_memory=True)
+        buffer, event = entry
+        if event is not None:
+            event.synchronize()
+        return buffer
+
+    def release(self, buffer: torch.Tensor, event=None) -> None:
+        key = (tuple(buffer.shape), buffer.dtype)
+        with self._lock:
+            if len(self._free[key]) < self.max_free:
+                self._free[key].append((buffer, event))
+
+
+_pool: Optional[PinnedBufferPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pinned_pool() -> PinnedBufferPool:
+    """Returns the process-wide pool used by the DataLoader pin-memory thread."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = PinnedBufferPool()
+        return _pool
+
+
+class SegBatch:
+    r"""
+    Collated ``(images, masks)`` batch of uint8 tensors.
+
+    Implements the ``pin_memory`` hook of ``DataLoader`` by copying into
+    pooled pinned buffers instead of allocating new ones, and ``to`` (used by
+    Lightning for the device transfer) by copying asynchronously and handing
+    the pinned buffers back to the pool. Unpacks like a tuple. ``timing``
+    carries loader instrumentation (see ``training.profiling``) through both.
+    """
+
+    def __init__(
+        self,
+        images: torch.Tensor,
+        masks: torch.Tensor,
+        pooled=False,
+        timing: Optional[dict] = None,
+    ):
+        self.images = images
+        self.masks = masks
+        self.pooled = pooled
+        self.timing = timing
+
+    def __iter__(self):
+        return iter((self.images, self.masks))
+
+    def __len__(self) -> int:
+        return 2
+
+    def pin_memory(self, device=None) -> "SegBatch":
+        if self.pooled:
+            return self
+        pool = get_pinned_pool()
+        images = pool.acquire(self.images.shape, self.images.dtype)
+        masks = pool.acquire(self.masks.shape, self.masks.dtype)
+        images.copy_(self.images)
+        masks.copy_(self.masks)
+        return SegBatch(images, masks, pooled=True, timing=self.timing)
+
+    def to(self, device, non_blocking: bool = True) -> "SegBatch":
+        device = torch.device(device)
+        if device.type == "cpu":
+            return self
+        images = self.images.to(device, non_blocking=non_blocking)
+        masks = self.masks.to(device, non_blocking=non_blocking)
+        if self.pooled:
+            event = None
+            if device.type == "cuda":
+                event = torch.cuda.Event()
+                event.record(torch.cuda.current_stream(device))
+            pool = get_pinned_pool()
+            pool.release(self.images, event)
+            pool.release(self.masks, event)
+        return SegBatch(images, masks, timing=self.timing)
+
+
+class SegBatchCollator:
+    r"""
+    Collates ``(uint8 image, uint8 mask)`` samples into a :class:`SegBatch`.
+
+    In worker processes the batch is stacked straight into shared memory (as
+    ``default_collate`` does) and pinned by the DataLoader into pooled buffers.
+    Without workers it is stacked directly into a pooled pinned buffer.
+
+    Args:
+        pin_memory (bool): Whether the loader pins batches (``pin_memory: true``).
+    """
+
+    def __init__(self, pin_memory: bool = True):
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+
+    def __call__(self, samples: Sequence[Tuple[torch.Tensor, torch.Tensor]]):
+        images = [torch.as_tensor(image) for image, _ in samples]
+        masks = [torch.as_tensor(mask) for _, mask in samples]
+        if get_worker_info() is not None or not self.pin_memory:
+            return SegBatch(default_collate(images), default_collate(masks))
+
+        pool = get_pinned_pool()
+        images_out = pool.acquire((len(images), *images[0].shape), images[0].dtype)
+        masks_out = pool.acquire((len(masks), *masks[0].shape), masks[0].dtype)
+        torch.stack(images, out=images_out)
+        torch.stack(masks, out=masks_out)
+        return SegBatch(images_out, masks_out, pooled=True)
@@ -1,38 +1,294 @@
 import logging
+import math
 import os
+from datetime import timedelta
 
 import pytorch_lightning as pl
 import torch
-from torch.utils.data import DataLoader
+import torch.distributed as dist
+from pytorch_lightning.callbacks import LearningRateMonitor
+from pytorch_lightning.strategies import DDPStrategy
+from torch.utils.data import DataLoader, IterableDataset
 from transformers import (
     SegformerConfig,
-    SegformerForSemanticSegmentation,
     SegformerImageProcessor,
 )
 
 from datasets.segformer_dataset import ADE20KDataset
-from datasets.transforms import SegformerTransform
+from datasets.shards import ShardedSegDataset, ShardedSegIterableDataset
+from datasets.transforms import SegformerTransform, build_train_augmentation
 from exceptions import TrainingException
+from training.batch_size import device_memory_bytes, find_batch_size
+from training.checkpointing import BackgroundCheckpointIO, build_checkpoint_callbacks
+from training.collate import SegBatchCollator
+from training.profiling import (
+    ProfiledDataLoader,
+    ProfilingConfig,
+    StepProfiler,
+    TimedCollator,
+)
+from training.samplers import ResumableSampler, UnpaddedDistributedSampler
+from models import HFSegformer
 from models.lit_wrappers import SegformerLitWrapper
 from models.lit_wrappers.segformer_wrapper import SegformerLitConfig
 from utils.constants import PROJECT_ROOT
 
 logger = logging.getLogger(__name__)
 
+# Batch size found on rank zero, inherited by the ranks Lightning launches.
+FOUND_BATCH_SIZE_ENV = "SEGFORMER_FOUND_BATCH_SIZE"
+
+
+def build_dataset(cfg, split: str, transform):
+    """Builds the ``train`` or ``val`` dataset in the configured storage format."""
+    root = os.path.join(PROJECT_ROOT, cfg.paths.dataset_root)
+
+    if cfg.dataset.get("format", "files") == "shards":
+        shard_cfg = cfg.dataset.get("shards", {})
+        shard_dir = os.path.join(root, cfg.paths[f"{split}_shards"])
+        if split == "train" and shard_cfg.get("streaming", True):
+            return ShardedSegIterableDataset(
+                shard_dir,
+                transforms=transform,
+                shuffle=cfg.dataloader.train.get("shuffle", True),
+                shuffle_buffer=shard_cfg.get("shuffle_buffer", 1000),
+            )
+        return ShardedSegDataset(shard_dir, transforms=transform)
+
+    cache_cfg = cfg.dataset.get("cache", {})
+    cache_dir = (
+        os.path.join(PROJECT_ROOT, cache_cfg.dir)
+        if cache_cfg.get("enabled", False)
+        else None
+    )
+    return ADE20KDataset(
+        root=root,
+        img_dir=cfg.paths[f"{split}_images"],
+        mask_dir=cfg.paths[f"{split}_masks"],
+        transforms=transform,
+        cache_dir=cache_dir,
+        cache_shard_size=cache_cfg.get("shard_size", 1024),
+    )
+
+
+def build_dataloader(
+    dataset, loader_cfg, uint8_batches: bool = False, sampler=None, profile=False
+) -> DataLoader:
+    r"""
+    With ``uint8_batches`` the dataset must yield uint8 images (see
+    ``SegformerTransform.deferred``); batches are collated into reused pinned
+    buffers and normalized on device by the Lightning wrapper. ``profile``
+    stamps batches and times the loader for ``training.profiling``.
+    """
+    loader_kwargs = dict(loader_cfg)
+    if isinstance(dataset, ShardedSegIterableDataset):
+        # Iterable datasets shuffle through their own shuffle buffer.
+        loader_kwargs.pop("shuffle", None)
+    if sampler is not None:
+        loader_kwargs.pop("shuffle", None)
+        loader_kwargs["sampler"] = sampler
+    if uint8_batches:
+        loader_kwargs["collate_fn"] = SegBatchCollator(
+            pin_memory=loader_kwargs.get("pin_memory", False)
+        )
+    if profile:
+        loader_kwargs["collate_fn"] = TimedCollator(loader_kwargs.get("collate_fn"))
+        return ProfiledDataLoader(dataset=dataset, **loader_kwargs)
+    return DataLoader(dataset=dataset, **loader_kwargs)
+
+
+def build_strategy(trainer_cfg):
+    r"""
+    ``trainer.strategy`` as a Lightning strategy. ``ddp`` is configured from
+    ``trainer.ddp``; a ``null`` process group backend lets Lightning pick
+    NCCL on GPUs and gloo on CPUs.
+    """
+    strategy = trainer_cfg.get("strategy", "auto")
+    if strategy != "ddp":
+        return strategy
+    ddp_cfg = trainer_cfg.get("ddp", {})
+    return DDPStrategy(
+        process_group_backend=ddp_cfg.get("process_group_backend", None),
+        find_unused_parameters=ddp_cfg.get("find_unused_parameters", False),
+        timeout=timedelta(seconds=ddp_cfg.get("timeout_s", 1800)),
+    )
+
+
+def build_trainer(trainer_cfg, callbacks=None, plugins=None) -> pl.Trainer:
+    """Builds the Lightning trainer from the ``trainer`` config section."""
+    val_interval = trainer_cfg.get("val_interval", None)
+    return pl.Trainer(
+        accelerator=trainer_cfg.get("accelerator", "auto"),
+        devices=trainer_cfg.get("devices", "auto"),
+        num_nodes=trainer_cfg.get("num_nodes", 1),
+        strategy=build_strategy(trainer_cfg),
+        sync_batchnorm=trainer_cfg.get("sync_batchnorm", False),
+        precision=trainer_cfg.get("precision", "32-true"),
+        max_epochs=trainer_cfg.get("max_epochs", None),
+        max_steps=trainer_cfg.get("max_steps", -1),
+        accumulate_grad_batches=trainer_cfg.get("accumulate_grad_batches", 1),
+        # An integer interval counts training batches across epoch boundaries
+        # only when per-epoch validation is switched off.
+        val_check_interval=val_interval,
+        check_val_every_n_epoch=None if val_interval else 1,
+        limit_train_batches=trainer_cfg.get("limit_train_batches", None),
+        limit_val_batches=trainer_cfg.get("limit_val_batches", None),
+        num_sanity_val_steps=trainer_cfg.get("num_sanity_val_steps", 2),
+        log_every_n_steps=trainer_cfg.get("log_every_n_steps", 50),
+        enable_checkpointing=trainer_cfg.get("enable_checkpointing", True),
+        enable_progress_bar=trainer_cfg.get("enable_progress_bar", True),
+        enable_model_summary=trainer_cfg.get("enable_model_summary", True),
+        default_root_dir=trainer_cfg.get("default_root_dir", None),
+        callbacks=callbacks,
+        plugins=plugins,
+    )
+
+
+def _train_image_size(cfg) -> tuple:
+    """Training input size: the augmentation crop, else the model's image size."""
+    augmentation_cfg = cfg.get("augmentation", {})
+    if augmentation_cfg.get("enabled", False):
+        return tuple(augmentation_cfg.random_crop.crop_size)
+    image_size = cfg.models.segformer.variant.b0.image_size
+    return (image_size, image_size)
+
+
+def _probe_device(trainer_cfg) -> torch.device:
+    accelerator = trainer_cfg.get("accelerator", "auto")
+    if accelerator in ("gpu", "cuda") or (
+        accelerator == "auto" and torch.cuda.is_available()
+    ):
+        return torch.device("cuda", int(os.environ.get("LOCAL_RANK", 0)))
+    return torch.device("cpu")
+
+
+def _set_batch_size(cfg, finder_cfg, batch_size: int) -> None:
+    cfg.dataloader.train.batch_size = batch_size
+    target = finder_cfg.get("target_batch_size", None)
+    if target:
+        cfg.trainer.accumulate_grad_batches = math.ceil(target / batch_size)
+
+
+def _agree_on_batch_size(batch_size: int, device: torch.device, trainer_cfg) -> int:
+    r"""
+    Smallest batch size found by any process, so that all DDP ranks train with
+    the same batch.
+
+    Processes started together by an external launcher (``torchrun`` sets
+    ``RANK`` and ``WORLD_SIZE``) each run the finder and take the minimum over
+    a process group, which Lightning then reuses. On a single node,
+    Lightning's own launcher starts the other local ranks from ``trainer.fit``
+    on rank zero, so they inherit rank zero's result through
+    ``FOUND_BATCH_SIZE_ENV`` instead. Other multi-node launches are rejected
+    by ``resolve_batch_size``, as each node would find its own batch size.
+    """
+    if int(os.environ.get("WORLD_SIZE", 1)) > 1 and "RANK" in os.environ:
+        backend = trainer_cfg.get("ddp", {}).get("process_group_backend", None)
+        backend = backend or ("nccl" if device.type == "cuda" else "gloo")
+        if not dist.is_initialized():
+            if device.type == "cuda":
+                torch.cuda.set_device(device)
+            timeout_s = trainer_cfg.get("ddp", {}).get("timeout_s", 1800)
+            dist.init_process_group(backend, timeout=timedelta(seconds=timeout_s))
+        size = torch.tensor(
+            [batch_size], device=device if backend == "nccl" else "cpu"
+        )
+        dist.all_reduce(size, op=dist.ReduceOp.MIN)
+        batch_size = int(size.item())
+    os.environ[FOUND_BATCH_SIZE_ENV] = str(batch_size)
+    return batch_size
+
+
+def resolve_batch_size(cfg, lit_model: SegformerLitWrapper) -> None:
+    r"""
+    Runs the batch size finder when ``batch_size_finder.enabled`` and writes
+    the result to ``dataloader.train.batch_size``. With ``target_batch_size``
+    set, ``trainer.accumulate_grad_batches`` is derived so that the
+    effective per-process batch stays at (at least) that size. All ranks use
+    the same batch size, see ``_agree_on_batch_size``.
+    """
+    finder_cfg = cfg.get("batch_size_finder", {})
+    if not finder_cfg.get("enabled", False):
+        return
+
+    if int(cfg.trainer.get("num_nodes", 1)) > 1 and "RANK" not in os.environ:
+        raise TrainingException(
+            "batch_size_finder on more than one node needs torchrun (which "
+            "sets RANK and WORLD_SIZE) so that all nodes agree on the batch "
+            "size; otherwise set dataloader.train.batch_size and disable it"
+        )
+
+    device = _probe_device(cfg.trainer)
+    inherited = os.environ.get(FOUND_BATCH_SIZE_ENV, None)
+    if inherited is not None and int(os.environ.get("LOCAL_RANK", 0)) > 0:
+        _set_batch_size(cfg, finder_cfg, int(inherited))
+        logger.info(f"Batch size finder: using batch size {inherited} of rank 0")
+        return
+
+    budget_gb = finder_cfg.get("budget_gb", None)
+    if budget_gb is not None:
+        budget_bytes = int(budget_gb * 2**30)
+    else:
+        budget_bytes = device_memory_bytes(device) * finder_cfg.get(
+            "budget_fraction", 0.8
+        )
+        devices = cfg.trainer.get("devices", "auto")
+        if device.type == "cpu" and isinstance(devices, int):
+            # CPU DDP processes share the host memory.
+            budget_bytes /= devices
+    batch_size, probes = find_batch_size(
+        lit_model.model,
+        lit_model.criterion,
+        image_size=_train_image_size(cfg),
+        num_classes=cfg.dataset.num_classes,
+        budget_bytes=int(budget_bytes),
+        device=device,
+        max_batch_size=finder_cfg.get("max_batch_size", 64),
+        optimizer_name=lit_model.config.optimizer,
+        precision=cfg.trainer.get("precision", "32-true"),
+    )
+    found = batch_size
+    batch_size = _agree_on_batch_size(found, device, cfg.trainer)
+    _set_batch_size(cfg, finder_cfg, batch_size)
+    logger.info(
+        f"Batch size finder: batch size {batch_size} on {device} "
+        f"({len(probes)} probes, {found} locally), accumulating "
+        f"{cfg.trainer.get('accumulate_grad_batches', 1)} batches per step"
+    )
+
 
 def run_training(cfg):
     logger.info("Starting training process")
 
+    seed = cfg.trainer.get("seed", None)
+    if seed is not None:
+        # workers=True derives DataLoader worker seeds from it as well.
+        pl.seed_everything(seed, workers=True)
+
     try:
         segformer_config = SegformerConfig.from_pretrained(
             cfg.models.segformer.variant.b0.huggingface_name
         )
 
+        stages = cfg.lit_wrapper.segformer.get("checkpoint_stages", None)
         segformerlit_config = SegformerLitConfig(
-            learning_rate=cfg.lit_wrapper.segformer.learning_rate,
-            weight_decay=cfg.lit_wrapper.segformer.weight_decay,
+            learning_rate=cfg.optimizer.lr,
+            weight_decay=cfg.optimizer.weight_decay,
             num_classes=cfg.dataset.num_classes,
             ignore_index=cfg.dataset.ignore_index,
+            optimizer=cfg.optimizer.get("name", "AdamW"),
+            optimizer_implementation=cfg.optimizer.get("implementation", "auto"),
+            betas=tuple(cfg.optimizer.get("betas", (0.9, 0.999))),
+            scheduler=cfg.scheduler.get("name", "PolyLR"),
+            poly_power=cfg.scheduler.get("power", 0.9),
+            min_lr=cfg.scheduler.get("eta_min", 0.0),
+            warmup_steps=cfg.scheduler.get("warmup_steps", 0),
+            activation_checkpointing=cfg.lit_wrapper.segformer.get(
+                "activation_checkpointing", False
+            ),
+            checkpoint_stages=tuple(stages) if stages is not None else None,
+            loss_mode=cfg.get("loss", {}).get("mode", "full"),
+            loss_chunk_rows=cfg.get("loss", {}).get("chunk_rows", 64),
         )
     except Exception as e:
         raise TrainingException(f"Failed to build configs: {e}")
@@ -43,29 +299,28 @@ def run_training(cfg):
         transform = SegformerTransform.from_pretrained(
             cfg.models.segformer.variant.b0.huggingface_name
         )
-        train_dataset = ADE20KDataset(
-            root=os.path.join(PROJECT_ROOT, cfg.paths.dataset_root),
-            img_dir=cfg.paths.train_images,
-            mask_dir=cfg.paths.train_masks,
-            transforms=transform,
-        )
-        val_dataset = ADE20KDataset(
-            root=os.path.join(PROJECT_ROOT, cfg.paths.dataset_root),
-            img_dir=cfg.paths.val_images,
-            mask_dir=cfg.paths.val_masks,
-            transforms=transform,
+        uint8_batches = cfg.dataloader.get("uint8_batches", False)
+        if uint8_batches:
+            transform = transform.deferred()
+        train_transform, batch_transform = build_train_augmentation(
+            cfg.get("augmentation", {}),
+            transform,
+            cfg.dataset.ignore_index,
+            num_classes=cfg.dataset.num_classes,
         )
-
-        train_loader = DataLoader(dataset=train_dataset, **cfg.dataloader.train)
-        val_loader = DataLoader(dataset=val_dataset, **cfg.dataloader.val)
+        train_dataset = build_dataset(cfg, "train", train_transform)
+        val_dataset = build_dataset(cfg, "val", transform)
     except Exception as e:
-        raise TrainingException(f"Failed to set up datasets or dataloaders: {e}")
+        raise TrainingException(f"Failed to set up datasets: {e}")
 
     try:
-        segformer_model = SegformerForSemanticSegmentation(segformer_config)
+        segformer_model = HFSegformer(segformer_config)
 
         lit_model = SegformerLitWrapper(
-            model=segformer_model, config=segformerlit_config
+            model=segformer_model,
+            config=segformerlit_config,
+            batch_transform=batch_transform,
+            normalize=transform.normalize_pixels if uint8_batches else None,
         )
     except Exception as e:
         raise TrainingException(f"Failed to set up models: {e}")
@@ -73,19 +328,71 @@ def run_training(cfg):
     logger.info("Model and transforms set up successfully")
 
     try:
+        threads = cfg.trainer.get("cpu_threads_per_process", None)
+        if threads:
+            # Several processes on one box would otherwise each use all cores.
+            torch.set_num_threads(int(threads))
+        resolve_batch_size(cfg, lit_model)
+
+        # Map-style training sets use a seeded sampler whose position is
+        # checkpointed, so that resuming continues mid-epoch in the same order.
+        train_sampler = (
+            None
+            if isinstance(train_dataset, IterableDataset)
+            else ResumableSampler(
+                train_dataset,
+                shuffle=cfg.dataloader.train.get("shuffle", True),
+                seed=seed or 0,
+            )
+        )
+        profiling_cfg = cfg.get("profiling", {})
+        profile = profiling_cfg.get("enabled", False)
+        train_loader = build_dataloader(
+            train_dataset,
+            cfg.dataloader.train,
+            uint8_batches,
+            sampler=train_sampler,
+            profile=profile,
+        )
+        # Both samplers split across ranks themselves under DDP; val is split
+        # without padding so that summed metrics see each image once.
+        val_loader = build_dataloader(
+            val_dataset,
+            cfg.dataloader.val,
+            uint8_batches,
+            sampler=(
+                None
+                if isinstance(val_dataset, IterableDataset)
+                else UnpaddedDistributedSampler(val_dataset)
+            ),
+        )
+    except Exception as e:
+        raise TrainingException(f"Failed to set up dataloaders: {e}")
 
-        trainer = pl.Trainer(
-            max_epochs=cfg.trainer.max_epochs,
-            precision=cfg.trainer.precision,
-            log_every_n_steps=cfg.trainer.log_every_n_steps,
-            accelerator="gpu" if torch.cuda.is_available() else "cpu",
-            devices=1 if torch.cuda.is_available() else None,
-            enable_checkpointing=cfg.trainer.enable_checkpointing,
-            enable_progress_bar=cfg.trainer.enable_progress_bar,
-            enable_model_summary=cfg.trainer.enable_model_summary,
-            default_root_dir=cfg.trainer.default_root_dir,
-            limit_train_batches=10,
+    try:
+        callbacks = build_checkpoint_callbacks(
+            cfg.trainer,
+            sampler=train_sampler,
+            metadata={
+                "huggingface_name": cfg.models.segformer.variant.b0.huggingface_name
+            },
+        )
+        callbacks.append(LearningRateMonitor(logging_interval="step"))
+        if profile:
+            profiler = StepProfiler(
+                os.path.join(
+                    cfg.trainer.get("default_root_dir", None) or ".", "profiling"
+                ),
+                ProfilingConfig.from_cfg(profiling_cfg),
+            )
+            train_loader.step_timer = profiler.timer
+            callbacks.append(profiler)
+        plugins = (
+            [BackgroundCheckpointIO()]
+            if cfg.trainer.get("async_checkpointing", True)
+            else None
         )
+        trainer = build_trainer(cfg.trainer, callbacks=callbacks, plugins=plugins)
     except Exception as e:
         raise TrainingException(f"Failed to initialize trainer: {e}")
 
@@ -93,7 +400,10 @@ def run_training(cfg):
 
     try:
         trainer.fit(
-            lit_model, train_dataloaders=train_loader, val_dataloaders=val_loader
+            lit_model,
+            train_dataloaders=train_loader,
+            val_dataloaders=val_loader,
+            ckpt_path=cfg.trainer.get("resume_from", None),
         )
     except Exception as e:
         raise TrainingException(f"Training failed: {e}")
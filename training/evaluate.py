@@ -0,0 +1,159 @@
+import json
+import logging
+import os
+import time
+from typing import Optional, Sequence
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from datasets.transforms import SegformerTransform
+from exceptions import InferenceException, ModelLoadException
+from inference.tiling import TileConfig, sliding_window_predict
+from training.engine import build_dataloader, build_dataset
+from training.metrics import confusion_matrix_update, scores_from_confusion_matrix
+from utils.model_utils import load_segformer
+
+logger = logging.getLogger(__name__)
+
+
+def _resize(tensor: torch.Tensor, size: Sequence[int]) -> torch.Tensor:
+    return F.interpolate(tensor, size=tuple(size), mode="bilinear", align_corners=False)
+
+
+def predict_logits(
+    model: torch.nn.Module,
+    images: torch.Tensor,
+    out_size: Sequence[int],
+    img_ratios: Optional[Sequence[float]] = None,
+    flip: bool = False,
+) -> torch.Tensor:
+    r"""
+    Class scores at ``out_size`` for a batch of normalized images.
+
+    Without ``img_ratios`` and ``flip`` this is one forward pass with bilinear
+    upsampling of the logits. Otherwise it is multi-scale (+ horizontal flip)
+    test-time augmentation, averaging softmax probabilities over all views.
+    """
+    ratios = list(img_ratios) if img_ratios else [1.0]
+    if len(ratios) == 1 and ratios[0] == 1.0 and not flip:
+        return _resize(model(images).logits, out_size)
+
+    height, width = images.shape[-2:]
+    scores = None
+    for ratio in ratios:
+        size = (int(height * ratio + 0.5), int(width * ratio + 0.5))
+        scaled = images if size == (height, width) else _resize(images, size)
+        for flipped in (False, True) if flip else (False,):
+            view = scaled.flip(-1) if flipped else scaled
+            logits = model(view).logits
+            if flipped:
+                logits = logits.flip(-1)
+            probs = _resize(logits, out_size).softmax(dim=1)
+            scores = probs if scores is None else scores.add_(probs)
+    return scores
+
+
+def run_evaluation(cfg, variant: str) -> dict:
+    logger.info(f"Starting evaluation of segformer variant {variant}")
+    eval_cfg = cfg.eval
+    huggingface_name = cfg.models.segformer.variant[variant].huggingface_name
+
+    tiling_cfg = eval_cfg.get("tiling", {})
+    tiling = TileConfig.from_cfg(tiling_cfg) if tiling_cfg.get("enabled") else None
+
+    try:
+        if tiling is not None:
+            # Full-resolution images of different sizes, one per batch.
+            transform = SegformerTransform.from_pretrained(
+                huggingface_name, do_resize=False
+            )
+            loader_cfg = {**cfg.dataloader.val, "batch_size": 1}
+        else:
+            transform = SegformerTransform.from_pretrained(huggingface_name)
+            loader_cfg = cfg.dataloader.val
+        model = load_segformer(huggingface_name, eval_cfg.get("checkpoint", None))
+        loader = build_dataloader(build_dataset(cfg, "val", transform), loader_cfg)
+    except ModelLoadException:
+        raise
+    except Exception as e:
+        raise InferenceException(f"Failed to set up evaluation: {str(e)}") from e
+
+    tta_cfg = eval_cfg.get("tta", {})
+    tta_enabled = tta_cfg.get("enabled", False)
+    if tiling is not None and tta_enabled:
+        logger.warning("Test-time augmentation is ignored with tiled inference")
+        tta_enabled = False
+    img_ratios = list(tta_cfg.get("img_ratios", [1.0])) if tta_enabled else None
+    flip = tta_enabled and tta_cfg.get("flip", False)
+    warmup_batches = int(eval_cfg.get("warmup_batches", 0))
+    max_batches = eval_cfg.get("max_batches", None)
+
+    num_classes = cfg.dataset.num_classes
+    confmat = torch.zeros(num_classes, num_classes, dtype=torch.long)
+    latencies: list[float] = []
+    num_timed_images = 0
+
+    try:
+        with torch.inference_mode():
+            for batch_idx, (images, masks) in enumerate(loader):
+                if max_batches is not None and batch_idx >= max_batches:
+                    break
+                start = time.perf_counter()
+                if tiling is not None:
+                    preds = torch.stack(
+                        [sliding_window_predict(model, img, tiling) for img in images]
+                    )
+                else:
+                    scores = predict_logits(
+                        model, images, masks.shape[-2:], img_ratios, flip
+                    )
+                    preds = scores.argmax(dim=1)
+                elapsed = time.perf_counter() - start
+
+                confmat += confusion_matrix_update(
+                    preds, masks, num_classes, cfg.dataset.ignore_index
+                )
+                if batch_idx >= warmup_batches:
+                    latencies.append(elapsed)
+                    num_timed_images += images.shape[0]
+    except Exception as e:
+        raise InferenceException(f"Evaluation failed: {str(e)}") from e
+
+    scores = scores_from_confusion_matrix(confmat)
+    id2label = model.config.id2label
+    latency_ms = np.asarray(latencies) * 1000
+    report = {
+        "variant": variant,
+        "tiling": vars(tiling) if tiling is not None else None,
+        "checkpoint": eval_cfg.get("checkpoint", None),
+        "tta": {"img_ratios": img_ratios, "flip": flip} if tta_enabled else None,
+        "mean_iou": scores["mean_iou"].item(),
+        "pixel_acc": scores["pixel_acc"].item(),
+        "per_class_iou": {
+            id2label.get(i, str(i)): iou
+            for i, iou in enumerate(scores["iou"].tolist())
+        },
+        "throughput_images_per_s": (
+            num_timed_images / latency_ms.sum() * 1000 if len(latencies) else None
+        ),
+        "batch_latency_ms": (
+            {f"p{p}": float(np.percentile(latency_ms, p)) for p in (50, 90, 99)}
+            if len(latencies)
+            else None
+        ),
+    }
+    logger.info(
+        f"{variant}: mIoU {report['mean_iou']:.4f}, "
+        f"pixel acc {report['pixel_acc']:.4f}, "
+        f"{report['throughput_images_per_s'] or 0:.2f} images/s"
+    )
+
+    results_dir = cfg.paths.get("eval_results", "eval_results")
+    os.makedirs(results_dir, exist_ok=True)
+    report_path = os.path.join(results_dir, f"eval_{variant}.json")
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Saved evaluation report to: {report_path}")
+    return report
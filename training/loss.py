@@ -1 +1,93 @@
-# Auto-generated file by template.py
+import torch
+import torch.nn.functional as F
+import torchvision.transforms.functional as TF
+from torch.utils.checkpoint import checkpoint
+
+from datasets.transforms import nearest_indices
+
+LOSS_MODES = ("full", "downsample", "chunked")
+
+
+class SegmentationLoss(torch.nn.Module):
+    r"""
+    Cross-entropy between Segformer logits (1/4 of the input resolution) and
+    full-resolution masks.
+
+    Modes:
+        ``full``: nearest-upsample the logits to mask size, then cross-entropy
+            and argmax. Materializes (N, C, H, W) logits.
+        ``downsample``: nearest-downsample the masks to logit size instead;
+            loss and predictions are computed at logit resolution.
+        ``chunked``: same result as ``full``, but upsampling and cross-entropy
+            run over ``chunk_rows`` output rows at a time under activation
+            checkpointing, so full-resolution logits never exist in forward
+            or backward.
+
+    Returns ``(loss, preds, target)`` where ``preds`` and ``target`` share the
+    resolution the metrics should be computed at.
+    """
+
+    def __init__(self, ignore_index: int, mode: str = "full", chunk_rows: int = 64):
+        super().__init__()
+        if mode not in LOSS_MODES:
+            raise ValueError(
+                f"Unknown loss mode '{mode}', expected one of {LOSS_MODES}"
+            )
+        self.ignore_index = ignore_index
+        self.mode = mode
+        self.chunk_rows = max(1, chunk_rows)
+        self.criterion = torch.nn.CrossEntropyLoss(ignore_index=ignore_index)
+
+    def forward(self, logits: torch.Tensor, masks: torch.Tensor):
+        if self.mode == "downsample":
+            return self._downsample(logits, masks)
+        if self.mode == "chunked":
+            return self._chunked(logits, masks)
+        logits = TF.resize(
+            logits,
+            size=masks.shape[1:],
+            interpolation=TF.InterpolationMode.NEAREST,
+        )
+        return self.criterion(logits, masks), logits.argmax(dim=1), masks
+
+    def _downsample(self, logits: torch.Tensor, masks: torch.Tensor):
+        height, width = logits.shape[-2:]
+        rows = nearest_indices(masks.shape[-2], height, masks.device)
+        cols = nearest_indices(masks.shape[-1], width, masks.device)
+        masks = masks[:, rows[:, None], cols[None, :]]
+        return self.criterion(logits, masks), logits.argmax(dim=1), masks
+
+    def _chunk_loss_sum(
+        self,
+        logits: torch.Tensor,
+        rows: torch.Tensor,
+        cols: torch.Tensor,
+        target: torch.Tensor,
+    ) -> torch.Tensor:
+        upsampled = logits[:, :, rows[:, None], cols[None, :]]
+        return F.cross_entropy(
+            upsampled, target, ignore_index=self.ignore_index, reduction="sum"
+        )
+
+    def _chunked(self, logits: torch.Tensor, masks: torch.Tensor):
+        height, width = masks.shape[-2:]
+        rows = nearest_indices(logits.shape[-2], height, logits.device)
+        cols = nearest_indices(logits.shape[-1], width, logits.device)
+
+        loss_sum = logits.new_zeros((), dtype=torch.float32)
+        for start in range(0, height, self.chunk_rows):
+            args = (logits, rows[start : start + self.chunk_rows], cols)
+            target = masks[:, start : start + self.chunk_rows]
+            if torch.is_grad_enabled() and logits.requires_grad:
+                chunk = checkpoint(
+                    self._chunk_loss_sum, *args, target, use_reentrant=False
+                )
+            else:
+                chunk = self._chunk_loss_sum(*args, target)
+            loss_sum = loss_sum + chunk.float()
+        loss = loss_sum / (masks != self.ignore_index).sum().clamp(min=1)
+
+        # Nearest upsampling commutes with argmax, so predict at logit resolution.
+        with torch.no_grad():
+            preds = logits.argmax(dim=1)[:, rows[:, None], cols[None, :]]
+        return loss, preds, masks
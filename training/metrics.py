@@ -1 +1,72 @@
-# Auto-generated file by template.py
+import torch
+from torchmetrics import Metric
+
+
+def confusion_matrix_update(
+    preds: torch.Tensor, target: torch.Tensor, num_classes: int, ignore_index: int
+) -> torch.Tensor:
+    r"""
+    Args:
+        preds (torch.Tensor): Predicted class ids, any shape.
+        target (torch.Tensor): Ground-truth class ids, same shape as ``preds``.
+    Returns:
+        torch.Tensor: (num_classes, num_classes) int64 matrix, rows are targets
+        and columns are predictions. Pixels equal to ``ignore_index`` or outside
+        ``[0, num_classes)`` are skipped.
+    """
+    target = target.reshape(-1).long()
+    preds = preds.reshape(-1).long()
+    valid = (target != ignore_index) & (target >= 0) & (target < num_classes)
+    indices = target[valid] * num_classes + preds[valid]
+    return torch.bincount(indices, minlength=num_classes**2).view(
+        num_classes, num_classes
+    )
+
+
+def scores_from_confusion_matrix(confmat: torch.Tensor) -> dict[str, torch.Tensor]:
+    r"""
+    Derives pixel accuracy, per-class accuracy/IoU and mIoU from a confusion matrix.
+
+    Classes that appear neither in the targets nor the predictions have NaN IoU
+    and are left out of the mean, as in mmseg's ``IoUMetric``.
+    """
+    confmat = confmat.double()
+    true_positive = confmat.diag()
+    target_count = confmat.sum(dim=1)
+    union = target_count + confmat.sum(dim=0) - true_positive
+    iou = true_positive / union
+    return {
+        "pixel_acc": true_positive.sum() / confmat.sum().clamp(min=1),
+        "class_acc": true_positive / target_count,
+        "iou": iou,
+        "mean_iou": iou.nanmean(),
+    }
+
+
+class ConfusionMatrixMetric(Metric):
+    r"""
+    Streaming segmentation metric backed by one (C, C) confusion matrix.
+
+    ``update`` is a single ``bincount`` per batch; the matrix is summed across
+    processes only when ``compute`` is called, i.e. once per epoch.
+    """
+
+    full_state_update = False
+
+    def __init__(self, num_classes: int, ignore_index: int, **kwargs):
+        super().__init__(**kwargs)
+        self.num_classes = num_classes
+        self.ignore_index = ignore_index
+        self.add_state(
+            "confmat",
+            default=torch.zeros(num_classes, num_classes, dtype=torch.long),
+            dist_reduce_fx="sum",
+        )
+
+    def update(self, preds: torch.Tensor, target: torch.Tensor) -> None:
+        self.confmat += confusion_matrix_update(
+            preds, target, self.num_classes, self.ignore_index
+        )
+
+    def compute(self) -> dict[str, torch.Tensor]:
+        return scores_from_confusion_matrix(self.confmat)
@@ -0,0 +1,151 @@
+import logging
+from typing import Iterable, Optional
+
+import torch
+from torch.optim.lr_scheduler import LRScheduler
+
+from exceptions import ConfigError
+
+logger = logging.getLogger(__name__)
+
+OPTIMIZERS = {
+    "AdamW": torch.optim.AdamW,
+    "Adam": torch.optim.Adam,
+    "SGD": torch.optim.SGD,
+}
+IMPLEMENTATIONS = {
+    "fused": {"fused": True},
+    "foreach": {"foreach": True},
+    "for_loop": {"foreach": False},
+}
+
+
+class PolyLR(LRScheduler):
+    r"""
+    Polynomial decay from the base learning rate to ``eta_min`` over
+    ``total_steps`` scheduler steps, as mmseg's ``PolyLR`` with
+    ``by_epoch=False``, optionally after a linear warmup.
+
+    ``lr = eta_min + (base_lr - eta_min) * (1 - step / total_steps) ** power``
+
+    Args:
+        optimizer (torch.optim.Optimizer): Wrapped optimizer.
+        total_steps (int): Steps until ``eta_min`` is reached (e.g. max iterations).
+        power (float): Decay exponent.
+        eta_min (float): Final learning rate.
+        warmup_steps (int): Steps of linear warmup from ``warmup_ratio * lr``.
+        warmup_ratio (float): Learning rate factor at the first warmup step.
+    """
+
+    def __init__(
+        self,
+        optimizer: torch.optim.Optimizer,
+        total_steps: int,
+        power: float = 0.9,
+        eta_min: float = 0.0,
+        warmup_steps: int = 0,
+        warmup_ratio: float = 1e-6,
+        last_epoch: int = -1,
+    ):
+        self.total_steps = max(1, int(total_steps))
+        self.power = power
+        self.eta_min = eta_min
+        self.warmup_steps = int(warmup_steps)
+        self.warmup_ratio = warmup_ratio
+        super().__init__(optimizer, last_epoch)
+
+    def get_lr(self) -> list[float]:
+        step = min(self.last_epoch, self.total_steps)
+        factor = (1 - step / self.total_steps) ** self.power
+        lrs = [self.eta_min + (base - self.eta_min) * factor for base in self.base_lrs]
+        if step < self.warmup_steps:
+            progress = step / self.warmup_steps
+            warmup = self.warmup_ratio + (1 - self.warmup_ratio) * progress
+            lrs = [lr * warmup for lr in lrs]
+        return lrs
+
+
+def _fused_supported(params: list) -> bool:
+    """Whether every parameter is a floating point tensor on a fused-kernel device."""
+    try:
+        from torch.utils._foreach_utils import _get_fused_kernels_supported_devices
+
+        devices = set(_get_fused_kernels_supported_devices())
+    except ImportError:
+        devices = {"cuda"}
+    return all(
+        param.device.type in devices and param.is_floating_point() for param in params
+    )
+
+
+def build_optimizer(
+    params: Iterable[torch.nn.Parameter],
+    name: str = "AdamW",
+    implementation: str = "auto",
+    **kwargs,
+) -> torch.optim.Optimizer:
+    r"""
+    Builds ``torch.optim.<name>`` with the fastest available update kernels.
+
+    Args:
+        params: Parameters to optimize.
+        name (str): ``AdamW``, ``Adam`` or ``SGD``.
+        implementation (str): ``fused`` (one kernel for all parameters),
+            ``foreach`` (multi-tensor ops), ``for_loop`` (per-parameter), or
+            ``auto`` to try them in that order. Fused kernels need a recent
+            PyTorch and floating point parameters on a supported device, so
+            build the optimizer after moving the model; unsupported choices
+            fall through.
+        **kwargs: Optimizer arguments such as ``lr`` and ``weight_decay``.
+    """
+    if name not in OPTIMIZERS:
+        raise ConfigError(
+            f"Unknown optimizer '{name}', expected one of {list(OPTIMIZERS)}"
+        )
+    optimizer_cls = OPTIMIZERS[name]
+    params = list(params)
+
+    if implementation != "auto" and implementation not in IMPLEMENTATIONS:
+        raise ConfigError(
+            f"Unknown optimizer implementation '{implementation}', "
+            f"expected auto or one of {list(IMPLEMENTATIONS)}"
+        )
+    # Fastest first; an unsupported choice falls through to the next one.
+    candidates = list(IMPLEMENTATIONS)
+    if implementation != "auto":
+        candidates = candidates[candidates.index(implementation) :]
+    if candidates[0] == "fused" and not _fused_supported(params):
+        # Some versions only reject unsupported devices at the first step().
+        logger.debug(f"{name} fused implementation unavailable for these parameters")
+        candidates = candidates[1:]
+    for impl in candidates:
+        try:
+            optimizer = optimizer_cls(params, **kwargs, **IMPLEMENTATIONS[impl])
+        except (RuntimeError, TypeError, ValueError) as e:
+            logger.debug(f"{name} {impl} implementation unavailable: {str(e)}")
+            continue
+        logger.info(f"Using {impl} {name}")
+        return optimizer
+    return optimizer_cls(params, **kwargs)
+
+
+def build_scheduler(
+    optimizer: torch.optim.Optimizer,
+    name: Optional[str],
+    total_steps: int,
+    power: float = 0.9,
+    eta_min: float = 0.0,
+    warmup_steps: int = 0,
+) -> Optional[LRScheduler]:
+    """Per-step learning rate schedule, ``None`` for a constant learning rate."""
+    if name is None:
+        return None
+    if name != "PolyLR":
+        raise ConfigError(f"Unknown scheduler '{name}', expected PolyLR or null")
+    return PolyLR(
+        optimizer,
+        total_steps=total_steps,
+        power=power,
+        eta_min=eta_min,
+        warmup_steps=warmup_steps,
+    )
@@ -0,0 +1,479 @@
+import bisect
+import csv
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import numpy as np
+import pytorch_lightning as pl
+import torch
+from torch.utils.data import DataLoader, default_collate, get_worker_info
+
+from training.collate import SegBatch
+
+logger = logging.getLogger(__name__)
+
+PHASES = (
+    "data_wait",
+    "transfer",
+    "forward",
+    "backward",
+    "optimizer",
+    "metric",
+    "log",
+    "other",
+)
+
+
+class TimedBatch:
+    r"""
+    Collated ``(images, masks)`` batch of a loader without :class:`SegBatch`
+    collation, carrying ``timing`` through pinning and the device transfer.
+    Both behave as for the plain tensors, without pooled pinned buffers.
+    """
+
+    def __init__(
+        self, images: torch.Tensor, masks: torch.Tensor, timing: Optional[dict] = None
+    ):
+        self.images = images
+        self.masks = masks
+        self.timing = timing
+
+    def __iter__(self):
+        return iter((self.images, self.masks))
+
+    def __len__(self) -> int:
+        return 2
+
+    def pin_memory(self, device=None) -> "TimedBatch":
+        return TimedBatch(
+            self.images.pin_memory(), self.masks.pin_memory(), self.timing
+        )
+
+    def to(self, device, non_blocking: bool = True) -> "TimedBatch":
+        return TimedBatch(
+            self.images.to(device, non_blocking=non_blocking),
+            self.masks.to(device, non_blocking=non_blocking),
+            self.timing,
+        )
+
+
+class TimedCollator:
+    r"""
+    Wraps a DataLoader ``collate_fn`` so that every batch is stamped with the
+    producing worker, the time it was collated and that worker's CPU time so
+    far. :class:`SegBatch` batches carry the stamp themselves, other batches
+    are wrapped in a :class:`TimedBatch`, so profiling does not change how
+    they are pinned. ``time.perf_counter`` is the system-wide monotonic clock
+    on Linux, so stamps from worker processes compare directly with the
+    training process.
+    """
+
+    def __init__(self, collate_fn: Optional[Callable] = None):
+        self.collate_fn = collate_fn or default_collate
+
+    def __call__(self, samples):
+        batch = self.collate_fn(samples)
+        if not isinstance(batch, SegBatch):
+            images, masks = batch
+            batch = TimedBatch(images, masks)
+        worker = get_worker_info()
+        batch.timing = {
+            "worker": worker.id if worker is not None else -1,
+            "produced": time.perf_counter(),
+            "worker_cpu": time.process_time(),
+        }
+        return batch
+
+
+class StepTimer:
+    r"""
+    Accumulates the phases of the current training step. The profiler
+    callback opens and closes steps; ``SegformerLitWrapper`` times its own
+    phases through :meth:`phase` and reports batch arrival and transfer.
+
+    Args:
+        sync_cuda (bool): Synchronize CUDA at phase boundaries so that GPU
+            work is attributed to the phase that launched it.
+    """
+
+    def __init__(self, sync_cuda: bool = True):
+        self.sync_cuda = sync_cuda and torch.cuda.is_available()
+        self.enabled = False
+        self.current: dict = {}
+        self.batch_timing: Optional[dict] = None
+        self.step_start: Optional[float] = None
+        self._fetched: Optional[float] = None
+        self._open: dict = {}
+
+    def now(self) -> float:
+        if self.sync_cuda:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.current[phase] = self.current.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name: str):
+        start = self.now()
+        try:
+            yield
+        finally:
+            self.add(name, self.now() - start)
+
+    def start(self, name: str) -> None:
+        self._open[name] = self.now()
+
+    def stop(self, name: str) -> None:
+        start = self._open.pop(name, None)
+        if start is not None:
+            self.add(name, self.now() - start)
+
+    def restart_clock(self) -> None:
+        """Starts the next step now, after validation or at an epoch start."""
+        self.step_start = self.now() if self.enabled else time.perf_counter()
+
+    def batch_fetched(self) -> None:
+        self._fetched = self.now()
+
+    def batch_ready(self, timing: Optional[dict]) -> None:
+        if self._fetched is not None:
+            self.add("transfer", self.now() - self._fetched)
+        if timing is not None:
+            self.batch_timing = dict(timing)
+
+    def finish_step(self) -> Optional[dict]:
+        r"""
+        Closes the step and returns its phase times in seconds, with
+        ``other`` the unattributed remainder, or ``None`` for the first step
+        after the clock was reset mid-step.
+        """
+        end = self.now()
+        row = None
+        if self.step_start is not None:
+            total = end - self.step_start
+            row = {phase: self.current.get(phase, 0.0) for phase in PHASES}
+            row["other"] = max(0.0, total - sum(row.values()))
+            row["total"] = total
+            if self.batch_timing is not None:
+                row.update(self.batch_timing)
+        self.current, self.batch_timing, self._fetched = {}, None, None
+        self._open.clear()
+        self.step_start = end
+        return row
+
+
+def profiled(step_timer: Optional[StepTimer], phase: str):
+    """``step_timer.phase(phase)`` while the timer records, else a no-op."""
+    if step_timer is None or not step_timer.enabled:
+        return nullcontext()
+    return step_timer.phase(phase)
+
+
+class _TimedIterator:
+    def __init__(self, iterator, step_timer: StepTimer):
+        self.iterator = iterator
+        self.step_timer = step_timer
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        batch = next(self.iterator)
+        end = time.perf_counter()
+        if self.step_timer.enabled:
+            self.step_timer.add("data_wait", end - start)
+        timing = getattr(batch, "timing", None)
+        if timing is not None:
+            timing["consumed"] = end
+        return batch
+
+
+class ProfiledDataLoader(DataLoader):
+    r"""
+    ``DataLoader`` whose iterator reports the time the training loop blocks on
+    it as ``data_wait`` and stamps batches with the time they were taken from
+    the loader, once ``step_timer`` is set. Lightning's one-batch prefetch
+    calls it between steps, so the wait is charged to the step it delays.
+    """
+
+    step_timer: Optional[StepTimer] = None
+
+    def __iter__(self):
+        iterator = super().__iter__()
+        if self.step_timer is None:
+            return iterator
+        return _TimedIterator(iterator, self.step_timer)
+
+
+def summarize_steps(
+    rows: list[dict], batch_size: Optional[int], input_bound_threshold: float = 0.2
+) -> dict:
+    r"""
+    Per-phase statistics over the recorded steps, plus DataLoader health from
+    the batch stamps: ready-batch queue depth when the training loop took a
+    batch (batches collated but not yet consumed), batch age in the queue,
+    and per-worker utilization (worker CPU time over wall time).
+    """
+    totals = np.asarray([row["total"] for row in rows])
+    wall = float(totals.sum())
+    summary = {
+        "steps": len(rows),
+        "steps_per_s": len(rows) / wall if wall else None,
+        "samples_per_s": (
+            len(rows) * batch_size / wall if wall and batch_size else None
+        ),
+        "step_ms": {
+            "mean": float(totals.mean() * 1000),
+            "p50": float(np.percentile(totals, 50) * 1000),
+            "p90": float(np.percentile(totals, 90) * 1000),
+        },
+        "phases": {},
+    }
+    for phase in PHASES:
+        values = np.asarray([row[phase] for row in rows])
+        summary["phases"][phase] = {
+            "mean_ms": float(values.mean() * 1000),
+            "p50_ms": float(np.percentile(values, 50) * 1000),
+            "p90_ms": float(np.percentile(values, 90) * 1000),
+            "fraction": float(values.sum() / wall) if wall else 0.0,
+        }
+    data_fraction = summary["phases"]["data_wait"]["fraction"]
+    summary["bound"] = "input" if data_fraction > input_bound_threshold else "compute"
+
+    stamped = [row for row in rows if "produced" in row]
+    if stamped:
+        produced = sorted(row["produced"] for row in stamped)
+        depths = [
+            bisect.bisect_right(produced, row["consumed"]) - (i + 1)
+            for i, row in enumerate(stamped)
+        ]
+        ages = [(row["consumed"] - row["produced"]) * 1000 for row in stamped]
+        utilization = {}
+        for worker in sorted({row["worker"] for row in stamped}):
+            batches = [row for row in stamped if row["worker"] == worker]
+            if worker < 0 or len(batches) < 2:
+                continue
+            elapsed = batches[-1]["produced"] - batches[0]["produced"]
+            busy = batches[-1]["worker_cpu"] - batches[0]["worker_cpu"]
+            utilization[str(worker)] = busy / elapsed if elapsed > 0 else None
+        known = [value for value in utilization.values() if value is not None]
+        summary["dataloader"] = {
+            "queue_depth": {
+                "mean": float(np.mean(depths)),
+                "min": int(min(depths)),
+                "max": int(max(depths)),
+                "empty_fraction": float(np.mean([depth <= 0 for depth in depths])),
+            },
+            "batch_age_ms": {
+                "mean": float(np.mean(ages)),
+                "p50": float(np.percentile(ages, 50)),
+            },
+            "worker_utilization": utilization,
+            "mean_worker_utilization": float(np.mean(known)) if known else None,
+        }
+    return summary
+
+
+@dataclass
+class ProfilingConfig:
+    skip_first: int = 20
+    num_steps: int = 200
+    sync_cuda: bool = True
+    input_bound_threshold: float = 0.2
+    torch_profiler: bool = False
+    torch_profiler_warmup: int = 2
+    torch_profiler_active: int = 5
+    record_shapes: bool = False
+    profile_memory: bool = False
+    with_stack: bool = False
+
+    @classmethod
+    def from_cfg(cls, profiling_cfg) -> "ProfilingConfig":
+        torch_cfg = profiling_cfg.get("torch_profiler", {})
+        return cls(
+            skip_first=int(profiling_cfg.get("skip_first", 20)),
+            num_steps=int(profiling_cfg.get("num_steps", 200)),
+            sync_cuda=bool(profiling_cfg.get("sync_cuda", True)),
+            input_bound_threshold=float(
+                profiling_cfg.get("input_bound_threshold", 0.2)
+            ),
+            torch_profiler=bool(torch_cfg.get("enabled", False)),
+            torch_profiler_warmup=int(torch_cfg.get("warmup", 2)),
+            torch_profiler_active=int(torch_cfg.get("active", 5)),
+            record_shapes=bool(torch_cfg.get("record_shapes", False)),
+            profile_memory=bool(torch_cfg.get("profile_memory", False)),
+            with_stack=bool(torch_cfg.get("with_stack", False)),
+        )
+
+
+class StepProfiler(pl.Callback):
+    r"""
+    Records a step-time breakdown for ``num_steps`` training steps after
+    ``skip_first`` warm-up steps and writes, per rank, into ``output_dir``:
+
+    - ``step_times_rank<r>.csv``: phase times of every recorded step
+    - ``step_summary_rank<r>.json``: statistics from :func:`summarize_steps`
+      and whether the run is input- or compute-bound
+    - ``trace_rank<r>.json`` and ``ops_rank<r>.txt``: optional
+      ``torch.profiler`` Chrome trace and operator table for
+      ``torch_profiler_active`` steps starting at ``skip_first``
+
+    ``other`` is the unattributed rest of the step: Lightning's loop overhead
+    and logger flushes. Validation and checkpointing between steps are not
+    counted. Timing is only active inside the window, so the rest of the run
+    is not slowed down by CUDA synchronization.
+
+    Args:
+        output_dir (str): Directory for the outputs, e.g. ``<run dir>/profiling``.
+        config (ProfilingConfig): Window and options.
+    """
+
+    def __init__(self, output_dir: str, config: ProfilingConfig):
+        self.output_dir = output_dir
+        self.config = config
+        self.timer = StepTimer(sync_cuda=config.sync_cuda)
+        self.rows: list[dict] = []
+        self.done = False
+        self._steps_seen = 0
+        self._rank = 0
+        self._torch_profiler = None
+
+    def setup(self, trainer: pl.Trainer, pl_module, stage: str) -> None:
+        self._rank = trainer.global_rank
+        pl_module.step_timer = self.timer
+
+    def on_train_start(self, trainer: pl.Trainer, pl_module) -> None:
+        self.timer.enabled = self.config.skip_first == 0
+        if not self.config.torch_profiler:
+            return
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self._torch_profiler = torch.profiler.profile(
+            activities=activities,
+            schedule=torch.profiler.schedule(
+                skip_first=self.config.skip_first,
+                wait=0,
+                warmup=self.config.torch_profiler_warmup,
+                active=self.config.torch_profiler_active,
+                repeat=1,
+            ),
+            on_trace_ready=self._export_trace,
+            record_shapes=self.config.record_shapes,
+            profile_memory=self.config.profile_memory,
+            with_stack=self.config.with_stack,
+        )
+        self._torch_profiler.start()
+
+    def _export_trace(self, profiler) -> None:
+        os.makedirs(self.output_dir, exist_ok=True)
+        trace_path = os.path.join(self.output_dir, f"trace_rank{self._rank}.json")
+        profiler.export_chrome_trace(trace_path)
+        sort_by = (
+            "cuda_time_total" if torch.cuda.is_available() else "cpu_time_total"
+        )
+        with open(os.path.join(self.output_dir, f"ops_rank{self._rank}.txt"), "w") as f:
+            f.write(profiler.key_averages().table(sort_by=sort_by, row_limit=50))
+        logger.info(f"torch.profiler trace written to {trace_path}")
+
+    def on_train_epoch_start(self, trainer: pl.Trainer, pl_module) -> None:
+        self.timer.restart_clock()
+
+    def on_before_backward(self, trainer, pl_module, loss) -> None:
+        if self.timer.enabled:
+            self.timer.start("backward")
+
+    def on_after_backward(self, trainer, pl_module) -> None:
+        if self.timer.enabled:
+            self.timer.stop("backward")
+
+    def on_before_optimizer_step(self, trainer, pl_module, optimizer) -> None:
+        if self.timer.enabled:
+            self.timer.start("optimizer")
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx):
+        if self.timer.enabled:
+            self.timer.stop("optimizer")
+            row = self.timer.finish_step()
+            if row is not None:
+                self.rows.append({"step": trainer.global_step, **row})
+        elif not self.done:
+            # Outside the window only the clock moves on, without a CUDA sync.
+            self.timer.restart_clock()
+
+        if self._torch_profiler is not None:
+            self._torch_profiler.step()
+
+        self._steps_seen += 1
+        if self.done:
+            return
+        if self._steps_seen >= self.config.skip_first and not self.timer.enabled:
+            self.timer.enabled = True
+            self.timer.restart_clock()
+        if len(self.rows) >= self.config.num_steps:
+            self.timer.enabled = False
+            self._write_summary(trainer)
+
+    def on_train_end(self, trainer: pl.Trainer, pl_module) -> None:
+        if self._torch_profiler is not None:
+            self._torch_profiler.stop()
+            self._torch_profiler = None
+        if not self.done and self.rows:
+            self._write_summary(trainer)
+
+    def _write_summary(self, trainer: pl.Trainer) -> None:
+        self.done = True
+        self.timer.enabled = False
+        loader = trainer.train_dataloader
+        summary = summarize_steps(
+            self.rows,
+            getattr(loader, "batch_size", None),
+            self.config.input_bound_threshold,
+        )
+        summary["rank"] = self._rank
+        summary["num_workers"] = getattr(loader, "num_workers", None)
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(
+            os.path.join(self.output_dir, f"step_times_rank{self._rank}.csv"), "w"
+        ) as f:
+            writer = csv.DictWriter(
+                f, fieldnames=list(self.rows[0]), extrasaction="ignore"
+            )
+            writer.writeheader()
+            writer.writerows(self.rows)
+        summary_path = os.path.join(
+            self.output_dir, f"step_summary_rank{self._rank}.json"
+        )
+        with open(summary_path, "w") as f:
+            json.dump(summary, f, indent=2)
+
+        phases = summary["phases"]
+        loader_stats = summary.get("dataloader", {})
+        logger.info(
+            f"Step profile over {summary['steps']} steps: "
+            f"{summary['steps_per_s']:.2f} steps/s, {summary['bound']}-bound; "
+            + ", ".join(
+                f"{phase} {phases[phase]['fraction']:.0%}" for phase in PHASES
+            )
+            + (
+                f"; queue depth {loader_stats['queue_depth']['mean']:.1f}, "
+                f"worker utilization {loader_stats['mean_worker_utilization']:.0%}"
+                if loader_stats.get("mean_worker_utilization") is not None
+                else ""
+            )
+            + f" ({summary_path})"
+        )
+
+    def teardown(self, trainer: pl.Trainer, pl_module, stage: str) -> None:
+        if self._torch_profiler is not None:
+            self._torch_profiler.stop()
+            self._torch_profiler = None
+        pl_module.step_timer = None
@@ -0,0 +1,98 @@
+import math
+from typing import Iterator
+
+import torch
+import torch.distributed as dist
+from torch.utils.data import DistributedSampler
+
+
+class UnpaddedDistributedSampler(DistributedSampler):
+    r"""
+    Evaluation sampler that gives rank ``r`` the indices ``r, r + W, r + 2W, ...``
+    without padding, so every validation sample is counted exactly once when
+    the per-rank confusion matrices are summed.
+
+    ``DistributedSampler`` pads the last round with repeated samples and needs
+    an initialized process group at construction. This subclass reads the rank
+    and world size when iterated instead, so it can be built before the
+    Lightning DDP launcher sets up the process group. Being a
+    ``DistributedSampler`` it is left in place by Lightning rather than
+    replaced with a padded one.
+    """
+
+    def __init__(self, dataset):
+        # Deliberately skips DistributedSampler.__init__, which would query the
+        # (not yet initialized) process group.
+        self.dataset = dataset
+        self.epoch = 0
+
+    @staticmethod
+    def _rank_and_world_size() -> tuple[int, int]:
+        if dist.is_available() and dist.is_initialized():
+            return dist.get_rank(), dist.get_world_size()
+        return 0, 1
+
+    def __iter__(self) -> Iterator[int]:
+        rank, world_size = self._rank_and_world_size()
+        return iter(range(rank, len(self.dataset), world_size))
+
+    def __len__(self) -> int:
+        rank, world_size = self._rank_and_world_size()
+        return len(range(rank, len(self.dataset), world_size))
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+
+class ResumableSampler(DistributedSampler):
+    r"""
+    Training sampler with a per-epoch permutation (seeded by ``seed + epoch``,
+    split across ranks like ``DistributedSampler``) that can resume in the
+    middle of an epoch: after :meth:`resume`, the next iteration of that epoch
+    skips the samples this rank had already consumed.
+
+    Like :class:`UnpaddedDistributedSampler`, the rank and world size are read
+    when iterated, and Lightning keeps it (calling ``set_epoch``) instead of
+    replacing it with its own ``DistributedSampler``. ``len`` stays the full
+    per-rank epoch length, as Lightning keeps counting batches from the
+    restored position.
+
+    Args:
+        dataset: Map-style dataset.
+        shuffle (bool): Permute the indices every epoch.
+        seed (int): Base seed of the permutation, identical on every rank.
+    """
+
+    def __init__(self, dataset, shuffle: bool = True, seed: int = 0):
+        self.dataset = dataset
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self._resume_at = None
+
+    def _indices(self) -> list[int]:
+        rank, world_size = UnpaddedDistributedSampler._rank_and_world_size()
+        if self.shuffle:
+            generator = torch.Generator().manual_seed(self.seed + self.epoch)
+            indices = torch.randperm(len(self.dataset), generator=generator).tolist()
+        else:
+            indices = list(range(len(self.dataset)))
+        # Pad by wrapping around so that every rank gets the same count.
+        total = math.ceil(len(indices) / world_size) * world_size
+        indices += indices[: total - len(indices)]
+        return indices[rank:total:world_size]
+
+    def __iter__(self) -> Iterator[int]:
+        indices = self._indices()
+        if self._resume_at is not None and self._resume_at[0] == self.epoch:
+            indices = indices[self._resume_at[1] :]
+        self._resume_at = None
+        return iter(indices)
+
+    def __len__(self) -> int:
+        _, world_size = UnpaddedDistributedSampler._rank_and_world_size()
+        return math.ceil(len(self.dataset) / world_size)
+
+    def resume(self, epoch: int, consumed: int) -> None:
+        """Skip the first ``consumed`` samples of this rank's ``epoch``."""
+        self._resume_at = (epoch, consumed)
@@ -0,0 +1,35 @@
+import importlib
+from typing import Callable, Dict, List, Tuple
+
+
+def lazy_exports(
+    package: str, exports: Dict[str, str]
+) -> Tuple[Callable[[str], object], Callable[[], List[str]]]:
+    r"""
+    Builds PEP 562 ``__getattr__`` / ``__dir__`` hooks for a package that
+    re-exports names from its submodules without importing them up front.
+
+    Importing the package stays cheap; the submodule (and whatever heavy
+    dependencies it pulls in, such as ``torch`` or ``transformers``) is only
+    imported the first time one of its names is accessed.
+
+    Args:
+        package (str): ``__name__`` of the package.
+        exports (Dict[str, str]): Exported name -> relative submodule, e.g.
+            ``{"run_inference": ".predictor"}``.
+    Returns:
+        The ``__getattr__`` and ``__dir__`` functions for the package module.
+    """
+
+    def __getattr__(name: str):
+        submodule = exports.get(name)
+        if submodule is None:
+            raise AttributeError(f"module {package!r} has no attribute {name!r}")
+        value = getattr(importlib.import_module(submodule, package), name)
+        setattr(importlib.import_module(package), name, value)
+        return value
+
+    def __dir__() -> List[str]:
+        return sorted(set(vars(importlib.import_module(package))) | set(exports))
+
+    return __getattr__, __dir__
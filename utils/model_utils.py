@@ -1 +1,54 @@
-# Auto-generated file by template.py
+import logging
+from typing import Optional
+
+import torch
+
+from exceptions import ModelLoadException
+from models import HFSegformer
+
+logger = logging.getLogger(__name__)
+
+
+def load_state_dict(path: str) -> dict[str, torch.Tensor]:
+    r"""
+    Reads model weights from a Lightning ``.ckpt`` (``model.`` prefix stripped),
+    a ``.safetensors`` file or a plain ``torch.save``'d state dict.
+    """
+    try:
+        if path.endswith(".safetensors"):
+            from safetensors.torch import load_file
+
+            return load_file(path)
+
+        state = torch.load(path, map_location="cpu", weights_only=False)
+        if "state_dict" in state:  # Lightning checkpoint of SegformerLitWrapper
+            state = {
+                key[len("model.") :]: value
+                for key, value in state["state_dict"].items()
+                if key.startswith("model.")
+            }
+        return state
+    except Exception as e:
+        raise ModelLoadException(f"Failed to read weights {path}: {str(e)}") from e
+
+
+def load_segformer(
+    huggingface_name: str, weights: Optional[str] = None
+) -> HFSegformer:
+    """Loads a Segformer variant, optionally overriding its weights, in eval mode."""
+    try:
+        model = HFSegformer.from_pretrained(huggingface_name)
+        if weights is not None:
+            state = {
+                key: value.float() if value.is_floating_point() else value
+                for key, value in load_state_dict(weights).items()
+            }
+            model.load_state_dict(state)
+            logger.info(f"Loaded weights from {weights}")
+    except ModelLoadException:
+        raise
+    except Exception as e:
+        raise ModelLoadException(
+            f"Failed to load {huggingface_name}: {str(e)}"
+        ) from e
+    return model.eval()